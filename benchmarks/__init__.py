@@ -0,0 +1 @@
+"""Scripts de mesure des performances de la chaîne de blocs."""
@@ -0,0 +1,63 @@
+"""
+Compare deux rapports de python -m benchmarks.run.
+
+Usage : python -m benchmarks.compare AVANT.json APRÈS.json [--threshold 0.1]
+
+Affiche, pour chaque scénario présent dans les deux rapports, le rapport des
+débits et des latences médianes. Le code de sortie est 1 si le débit d'un
+scénario a baissé de plus de <threshold> (10 % par défaut).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Any
+
+
+def compare(
+    before: dict[str, Any], after: dict[str, Any], threshold: float
+) -> list[str]:
+    """Affiche la comparaison de <before> et <after> ; renvoie les scénarios en
+    régression."""
+    old: dict[str, dict[str, Any]] = {r["name"]: r for r in before["results"]}
+    regressions: list[str] = []
+    for result in after["results"]:
+        previous: dict[str, Any] | None = old.get(result["name"])
+        if previous is None or not previous["throughput"]:
+            continue
+        ratio: float = result["throughput"] / previous["throughput"]
+        latency: float = (
+            result["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] else 0.0
+        )
+        flag: str = ""
+        if ratio < 1 - threshold:
+            regressions.append(result["name"])
+            flag = "  RÉGRESSION"
+        print(
+            f"{result['name']:>20}: débit x{ratio:5.2f}, "
+            f"latence médiane x{latency:5.2f}{flag}"
+        )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Compare deux rapports de benchmarks."
+    )
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    options: argparse.Namespace = parser.parse_args(argv)
+
+    with open(options.before) as f:
+        before: dict[str, Any] = json.load(f)
+    with open(options.after) as f:
+        after: dict[str, Any] = json.load(f)
+    if compare(before, after, options.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
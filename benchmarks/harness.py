@@ -0,0 +1,65 @@
+"""Mesure du temps et de la mémoire d'une opération répétée."""
+
+from __future__ import annotations
+
+import gc
+import time
+import tracemalloc
+from typing import Any, Callable, Iterable
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Renvoie le percentile <fraction> (entre 0 et 1) de <values>, triées."""
+    if not values:
+        return 0.0
+    index: int = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+def measure(
+    name: str,
+    calls: Iterable[Callable[[], Any]],
+    items_per_call: int = 1,
+    trace_memory: bool = True,
+) -> dict[str, Any]:
+    """
+    Exécute chacune des opérations <calls> et renvoie un résultat :
+        - name, calls, items : nombre d'opérations et d'éléments traités
+          (<items_per_call> par opération) ;
+        - total_s, throughput : durée totale et éléments par seconde ;
+        - p50_ms, p90_ms, p99_ms, max_ms : percentiles de la latence d'une opération ;
+        - peak_bytes : pic de mémoire allouée pendant les opérations (tracemalloc),
+          si <trace_memory> est True.
+
+    tracemalloc ralentit les allocations : les latences mesurées avec
+    <trace_memory> ne sont comparables qu'entre elles.
+    """
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    latencies: list[float] = []
+    try:
+        for call in calls:
+            start: float = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+        peak: int | None = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    latencies.sort()
+    total: float = sum(latencies)
+    items: int = len(latencies) * items_per_call
+    return {
+        "name": name,
+        "calls": len(latencies),
+        "items": items,
+        "total_s": total,
+        "throughput": items / total if total > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        "peak_bytes": peak,
+    }
@@ -0,0 +1,335 @@
+"""
+Benchmarks de la validation, de l'assemblage de blocs et des requêtes de
+portefeuille sur des charges synthétiques.
+
+Usage : python -m benchmarks.run [--wallets N] [--blocks M] [--txs K]
+            [--fan-in I] [--fan-out O] [--fork-depth D] [--sign-inputs E]
+            [--seed S]
+            [--only NOM ...] [--no-memory] [--output FICHIER.json]
+
+Le résultat (paramètres, environnement et mesures de chaque scénario) est écrit
+en JSON, à comparer entre deux commits avec python -m benchmarks.compare.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterator
+
+from benchmarks.harness import measure
+from benchmarks.workloads import ChainGenerator, Wallets
+from blockchain import crypto
+from blockchain.block import Block
+from blockchain.block_handler import BlockHandler
+from blockchain.blockchain import Blockchain
+from blockchain.chain_io import export_chain, import_chain, read_genesis
+from blockchain.transaction import Transaction
+from blockchain.transaction_handler import TransactionHandler
+from blockchain.utxo_pool import UTXOPool
+from blockchain.wallet import get_balance
+
+Scenario = Callable[[argparse.Namespace], dict[str, Any]]
+
+
+def _generator(options: argparse.Namespace) -> ChainGenerator:
+    rng: random.Random = random.Random(options.seed)
+    return ChainGenerator(
+        Wallets(options.wallets, rng),
+        rng,
+        fan_in=options.fan_in,
+        fan_out=options.fan_out,
+        merkle=options.merkle,
+    )
+
+
+def _expect(result: Any) -> None:
+    if not result:
+        raise RuntimeError("Opération refusée : la charge générée est invalide!")
+
+
+def _expecting(operation: Callable[..., Any], *args: Any) -> Callable[[], None]:
+    """Renvoie l'opération qui appelle <operation>(*<args>) et vérifie son résultat."""
+    return lambda: _expect(operation(*args))
+
+
+def bench_add_block(options: argparse.Namespace) -> dict[str, Any]:
+    """Blockchain.add_block sur une chaîne de <blocks> blocs de <txs> transactions."""
+    generator: ChainGenerator = _generator(options)
+    blocks: list[Block] = generator.blocks(options.blocks, options.txs)
+    blockchain: Blockchain = Blockchain(generator.genesis)
+    return measure(
+        "add_block",
+        (_expecting(blockchain.add_block, block) for block in blocks),
+        options.txs,
+        options.memory,
+    )
+
+
+def bench_add_block_assume_valid(options: argparse.Namespace) -> dict[str, Any]:
+    """Comme add_block, avec le dernier bloc comme bloc de référence assume-valid :
+    les signatures ne sont pas vérifiées."""
+    generator: ChainGenerator = _generator(options)
+    blocks: list[Block] = generator.blocks(options.blocks, options.txs)
+    assert blocks[-1].hash is not None
+    blockchain: Blockchain = Blockchain(generator.genesis, assume_valid=blocks[-1].hash)
+    _expect(
+        blockchain.add_assumed_headers(
+            [(block.hash, block.prev_block_hash) for block in blocks if block.hash]
+        )
+        == len(blocks)
+    )
+    return measure(
+        "add_block_assume_valid",
+        (_expecting(blockchain.add_block, block) for block in blocks),
+        options.txs,
+        options.memory,
+    )
+
+
+def bench_handle_transactions(options: argparse.Namespace) -> dict[str, Any]:
+    """TransactionHandler.handle_transactions sur les transactions de chaque bloc."""
+    generator: ChainGenerator = _generator(options)
+    blocks: list[Block] = generator.blocks(options.blocks, options.txs)
+    blockchain: Blockchain = Blockchain(generator.genesis)
+
+    def calls() -> Iterator[Callable[[], None]]:
+        for block in blocks:
+            utxo_pool: UTXOPool = blockchain.get_max_height_utxo_pool()
+            txs: list[Transaction] = block.transactions
+            yield lambda: _expect(
+                len(TransactionHandler(utxo_pool).handle_transactions(txs)) == len(txs)
+            )
+            # Hors mesure : le bloc suivant est validé sur celui-ci
+            _expect(blockchain.add_block(block))
+
+    return measure("handle_transactions", calls(), options.txs, options.memory)
+
+
+def bench_add_transaction(options: argparse.Namespace) -> dict[str, Any]:
+    """Blockchain.add_transaction (admission dans le memory pool)."""
+    generator: ChainGenerator = _generator(options)
+    txs: list[Transaction] = generator.transactions(options.txs * options.blocks)
+    blockchain: Blockchain = Blockchain(generator.genesis)
+    return measure(
+        "add_transaction",
+        (_expecting(blockchain.add_transaction, tx) for tx in txs),
+        1,
+        options.memory,
+    )
+
+
+def bench_create_block(options: argparse.Namespace) -> dict[str, Any]:
+    """BlockHandler.create_block avec <txs> transactions dans le memory pool, le
+    gabarit étant tenu à jour par process_transaction."""
+    generator: ChainGenerator = _generator(options)
+    blockchain: Blockchain = Blockchain(generator.genesis)
+    handler: BlockHandler = BlockHandler(blockchain)
+    miner = generator.wallets.public_keys[0]
+
+    def calls() -> Iterator[Callable[[], None]]:
+        for _ in range(options.blocks):
+            for tx in generator.transactions(options.txs):
+                _expect(handler.process_transaction(tx))
+            yield lambda: _expect(handler.create_block(miner))
+
+    return measure("create_block", calls(), options.txs, options.memory)
+
+
+def bench_get_balance(options: argparse.Namespace) -> dict[str, Any]:
+    """wallet.get_balance de chaque portefeuille, sur la chaîne complète."""
+    generator: ChainGenerator = _generator(options)
+    blocks: list[Block] = generator.blocks(options.blocks, options.txs)
+    blockchain: Blockchain = Blockchain(generator.genesis)
+    for block in blocks:
+        _expect(blockchain.add_block(block))
+
+    keys = generator.wallets.public_keys * options.repeat
+    return measure(
+        "get_balance",
+        (partial(get_balance, blockchain, pk) for pk in keys),
+        1,
+        options.memory,
+    )
+
+
+def bench_fork(options: argparse.Namespace) -> dict[str, Any]:
+    """
+    Branche concurrente de <fork_depth> + 1 blocs partant de <fork_depth> blocs
+    sous le sommet : l'ajout de son dernier bloc déclenche une réorganisation.
+    """
+    depth: int = min(options.fork_depth, Blockchain.CUT_OFF_AGE - 1)
+    depth = min(depth, options.blocks)
+    generator: ChainGenerator = _generator(options)
+    blockchain: Blockchain = Blockchain(generator.genesis)
+    for block in generator.blocks(options.blocks - depth, options.txs):
+        _expect(blockchain.add_block(block))
+
+    fork: ChainGenerator = generator.fork()
+    for block in generator.blocks(depth, options.txs):
+        _expect(blockchain.add_block(block))
+    fork_blocks: list[Block] = fork.blocks(depth + 1, options.txs)
+
+    result: dict[str, Any] = measure(
+        "fork",
+        (_expecting(blockchain.add_block, block) for block in fork_blocks),
+        options.txs,
+        options.memory,
+    )
+    _expect(blockchain.get_max_height_block() is fork_blocks[-1])
+    result["depth"] = depth
+    return result
+
+
+def bench_sign(options: argparse.Namespace) -> dict[str, Any]:
+    """Transaction.sign_all sur <blocks> transactions de <sign_inputs> entrées."""
+    wallets: Wallets = Wallets(options.wallets, random.Random(options.seed))
+    rng: random.Random = random.Random(options.seed)
+
+    def calls() -> Iterator[Callable[[], None]]:
+        for _ in range(options.blocks):
+            tx: Transaction = Transaction()
+            owners: list[int] = []
+            for index in range(options.sign_inputs):
+                tx.add_input(rng.randbytes(32), index)
+                owners.append(rng.randrange(len(wallets)))
+            tx.add_output(1.0, wallets.public_keys[0])
+            keys = [wallets.private_keys[owner] for owner in owners]
+            yield lambda: tx.sign_all(keys)
+
+    return measure("sign", calls(), options.sign_inputs, options.memory)
+
+
+def bench_import_chain(options: argparse.Namespace) -> dict[str, Any]:
+    """chain_io.import_chain d'un export de <blocks> blocs, signatures vérifiées
+    d'avance dans un processus par coeur."""
+    generator: ChainGenerator = _generator(options)
+    blockchain: Blockchain = Blockchain(generator.genesis)
+    for block in generator.blocks(options.blocks, options.txs):
+        _expect(blockchain.add_block(block))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path: str = os.path.join(directory, "chain.iftc")
+        export_chain(blockchain, path)
+        chain: Blockchain = Blockchain(read_genesis(path))
+        with ProcessPoolExecutor(os.cpu_count()) as executor:
+            return measure(
+                "import_chain",
+                [
+                    lambda: _expect(
+                        import_chain(chain, path, executor)["blocks"] == options.blocks
+                    )
+                ],
+                options.blocks * options.txs,
+                options.memory,
+            )
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "add_block": bench_add_block,
+    "add_block_assume_valid": bench_add_block_assume_valid,
+    "handle_transactions": bench_handle_transactions,
+    "add_transaction": bench_add_transaction,
+    "create_block": bench_create_block,
+    "get_balance": bench_get_balance,
+    "fork": bench_fork,
+    "sign": bench_sign,
+    "import_chain": bench_import_chain,
+}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options: argparse.Namespace) -> dict[str, Any]:
+    """Exécute les scénarios choisis et renvoie le rapport complet."""
+    names: list[str] = options.only or list(SCENARIOS)
+    results: list[dict[str, Any]] = []
+    for name in names:
+        results.append(SCENARIOS[name](options))
+
+    return {
+        "environment": {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "crypto_backend": crypto.get_backend().name,
+        },
+        "parameters": {
+            key: value
+            for key, value in vars(options).items()
+            if key not in ("output", "only")
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Benchmarks de la chaîne de blocs."
+    )
+    parser.add_argument("--wallets", type=int, default=50)
+    parser.add_argument("--blocks", type=int, default=20)
+    parser.add_argument("--txs", type=int, default=50, help="transactions par bloc")
+    parser.add_argument("--fan-in", type=int, default=1)
+    parser.add_argument("--fan-out", type=int, default=2)
+    parser.add_argument("--fork-depth", type=int, default=5)
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="répétitions de get_balance"
+    )
+    parser.add_argument(
+        "--sign-inputs", type=int, default=200, help="entrées par transaction signée"
+    )
+    parser.add_argument("--merkle", action="store_true", help="blocs au format Merkle")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=list(SCENARIOS))
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="ne pas mesurer le pic de mémoire (tracemalloc ralentit les mesures)",
+    )
+    parser.add_argument("--output", help="fichier JSON du rapport (sinon stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    options: argparse.Namespace = parse_args(argv)
+    report: dict[str, Any] = run(options)
+    text: str = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for result in report["results"]:
+        print(
+            f"{result['name']:>20}: {result['throughput']:10.1f} /s, "
+            f"p50 {result['p50_ms']:8.2f} ms, p99 {result['p99_ms']:8.2f} ms",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Mesure la mémoire occupée par UTXO dans un UTXOPool.
+
+Deux cas sont mesurés :
+    - memory : sorties créées en mémoire, qui partagent les objets clé publique
+      de quelques adresses ;
+    - loaded : sorties décodées depuis leur forme brute, comme au chargement du
+      pool UTXO depuis le stockage.
+
+Usage : python -m benchmarks.utxo_memory [nombre d'UTXOs]
+"""
+
+from __future__ import annotations
+
+import gc
+import os
+import sys
+import tracemalloc
+from typing import Callable
+
+from blockchain import codec
+from blockchain.crypto import KeyPairGenerator, PublicKey
+from blockchain.transaction import Transaction
+from blockchain.utxo import UTXO
+from blockchain.utxo_pool import UTXOPool
+
+ADDRESSES: int = 100
+OUTPUTS_PER_TX: int = 2
+
+
+def measure(build: Callable[[], UTXOPool]) -> int:
+    """Renvoie le nombre d'octets alloués par <build> et encore utilisés."""
+    gc.collect()
+    tracemalloc.start()
+    pool: UTXOPool = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del pool
+    return size
+
+
+def main(count: int) -> None:
+    keys: list[PublicKey] = [
+        KeyPairGenerator.generate_key_pair()[1] for _ in range(ADDRESSES)
+    ]
+    raw_keys: list[bytes] = [pk.to_string() for pk in keys]
+    tx_hashes: list[bytes] = [os.urandom(32) for _ in range(count // OUTPUTS_PER_TX)]
+
+    def build_memory() -> UTXOPool:
+        pool: UTXOPool = UTXOPool()
+        for i, tx_hash in enumerate(tx_hashes):
+            for index in range(OUTPUTS_PER_TX):
+                output = Transaction.Output(1.0, keys[(i + index) % ADDRESSES])
+                pool.add_utxo(UTXO(tx_hash, index), output)
+        return pool
+
+    def build_loaded() -> UTXOPool:
+        pool: UTXOPool = UTXOPool()
+        for i, tx_hash in enumerate(tx_hashes):
+            for index in range(OUTPUTS_PER_TX):
+                raw: bytes = raw_keys[(i + index) % ADDRESSES]
+                pool.add_utxo(UTXO(tx_hash, index), codec.decode_output(1.0, raw))
+        return pool
+
+    utxos: int = len(tx_hashes) * OUTPUTS_PER_TX
+    for name, build in (("memory", build_memory), ("loaded", build_loaded)):
+        size: int = measure(build)
+        print(f"{name:>6}: {utxos} UTXOs, {size / utxos:.0f} octets par UTXO")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
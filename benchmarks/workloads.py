@@ -0,0 +1,137 @@
+"""
+Générateurs de charges synthétiques pour les benchmarks.
+
+Les charges sont reproductibles pour une graine donnée : les clés sont dérivées
+de la graine et les choix faits par un random.Random. Seules les signatures
+varient d'une exécution à l'autre (elles sont aléatoires).
+"""
+
+from __future__ import annotations
+
+import random
+from collections import deque
+
+from blockchain.block import Block
+from blockchain.crypto import SECP256k1, PrivateKey, PublicKey
+from blockchain.transaction import Transaction
+from blockchain.utxo import UTXO
+
+# Sortie dépensable suivie par le générateur : (UTXO, valeur, index du portefeuille)
+Spendable = tuple[UTXO, float, int]
+
+
+class Wallets:
+    """<count> paires de clés dérivées de <rng>."""
+
+    def __init__(self, count: int, rng: random.Random):
+        self.private_keys: list[PrivateKey] = [
+            PrivateKey.from_secret_exponent(
+                rng.randrange(1, SECP256k1.order), curve=SECP256k1
+            )
+            for _ in range(count)
+        ]
+        self.public_keys: list[PublicKey] = [
+            sk.get_verifying_key() for sk in self.private_keys
+        ]
+
+    def __len__(self) -> int:
+        return len(self.private_keys)
+
+
+class ChainGenerator:
+    """
+    Génère des blocs valides qui s'enchaînent à partir d'un bloc de genèse payé au
+    portefeuille 0.
+
+    Chaque transaction dépense <fan_in> sorties (les plus anciennes d'abord) et
+    crée <fan_out> sorties vers des portefeuilles tirés au hasard, sans frais. La
+    coinbase de chaque bloc est payée à une clé neuve et n'est pas dépensée : deux
+    coinbases payées à la même adresse ont le même hash.
+    """
+
+    def __init__(
+        self,
+        wallets: Wallets,
+        rng: random.Random,
+        fan_in: int = 1,
+        fan_out: int = 2,
+        merkle: bool = False,
+    ):
+        self.wallets: Wallets = wallets
+        self.rng: random.Random = rng
+        self.fan_in: int = fan_in
+        self.fan_out: int = fan_out
+        self.merkle: bool = merkle
+
+        self.genesis: Block = Block(wallets.public_keys[0], merkle=merkle)
+        self.genesis.finalize()
+        self.tip: Block = self.genesis
+        coinbase: Transaction = self.genesis.coinbase
+        self.spendable: deque[Spendable] = deque(
+            [(UTXO(coinbase.hash, 0), coinbase.outputs[0].value, 0)]
+        )
+
+    def fork(self) -> ChainGenerator:
+        """Renvoie un générateur indépendant qui continue à partir du même bloc."""
+        other: ChainGenerator = ChainGenerator.__new__(ChainGenerator)
+        other.__dict__.update(self.__dict__)
+        other.rng = random.Random(self.rng.random())
+        other.spendable = deque(self.spendable)
+        return other
+
+    def _miner(self) -> PublicKey:
+        sk: PrivateKey = PrivateKey.from_secret_exponent(
+            self.rng.randrange(1, SECP256k1.order), curve=SECP256k1
+        )
+        return sk.get_verifying_key()
+
+    def next_transaction(self) -> Transaction | None:
+        """Renvoie une nouvelle transaction signée, None s'il n'y a plus de sortie
+        à dépenser."""
+        if not self.spendable:
+            return None
+
+        tx: Transaction = Transaction()
+        owners: list[int] = []
+        total: float = 0
+        for _ in range(min(self.fan_in, len(self.spendable))):
+            utxo, value, owner = self.spendable.popleft()
+            tx.add_input(utxo.tx_hash, utxo.index)
+            owners.append(owner)
+            total += value
+
+        # Légèrement moins que le total, pour que les arrondis ne le dépassent pas
+        value = total / self.fan_out * (1 - 1e-9)
+        receivers: list[int] = [
+            self.rng.randrange(len(self.wallets)) for _ in range(self.fan_out)
+        ]
+        for receiver in receivers:
+            tx.add_output(value, self.wallets.public_keys[receiver])
+        tx.sign_all([self.wallets.private_keys[owner] for owner in owners])
+
+        for index, receiver in enumerate(receivers):
+            self.spendable.append((UTXO(tx.hash, index), value, receiver))
+        return tx
+
+    def transactions(self, count: int) -> list[Transaction]:
+        """Renvoie jusqu'à <count> nouvelles transactions, dans un ordre valide."""
+        txs: list[Transaction] = []
+        for _ in range(count):
+            tx: Transaction | None = self.next_transaction()
+            if tx is None:
+                break
+            txs.append(tx)
+        return txs
+
+    def next_block(self, tx_count: int) -> Block:
+        """Renvoie un nouveau bloc de <tx_count> transactions au-dessus du dernier."""
+        assert self.tip.hash is not None
+        block: Block = Block(self._miner(), self.tip.hash, merkle=self.merkle)
+        for tx in self.transactions(tx_count):
+            block.add_transaction(tx)
+        block.finalize()
+        self.tip = block
+        return block
+
+    def blocks(self, count: int, tx_count: int) -> list[Block]:
+        return [self.next_block(tx_count) for _ in range(count)]
@@ -1,8 +1,16 @@
 import hashlib
+import struct
+import time
 
+from blockchain.merkle import MerkleTree, ProofStep
 from blockchain.transaction import Transaction
 from blockchain.crypto import PublicKey
 
+# Champs de preuve de travail : horodatage (u64), cible (256 bits), puis nonce (u64)
+WORK = struct.Struct(">Q32s")
+NONCE = struct.Struct(">Q")
+MAX_TARGET: int = 2**256 - 1
+
 
 class Block:
     """
@@ -13,20 +21,89 @@ class Block:
         coinbase (Transaction): Transaction coinbase.
         transactions (list): Ensemble de transactions du bloc.
         hash (bytes): hash du bloc.
+        merkle_tree (MerkleTree): Arbre de Merkle des hashs de la coinbase et des
+            transactions, None pour le format de bloc d'origine.
+        target (int): Cible de la preuve de travail (le hash, lu comme un entier
+            big-endian, doit lui être inférieur ou égal), None sans preuve de
+            travail.
+        timestamp (int): Horodatage du bloc en secondes, avec preuve de travail.
+        nonce (int): Nonce de la preuve de travail.
     """
 
     COINBASE: float = 25.0  # Récompense de bloc
 
-    def __init__(self, address: PublicKey, prev_block_hash: bytes = None):
+    def __init__(
+        self,
+        address: PublicKey,
+        prev_block_hash: bytes = None,
+        merkle: bool = False,
+        target: int | None = None,
+        timestamp: int | None = None,
+    ):
         """
         Args:
             address (PublicKey): L'adresse à laquelle la transaction coinbase sera attribuée.
             prev_block_hash (bytes, optional): Hash du bloc précédent. None s'il s'agit du bloc de genèse.
+            merkle (bool, optional): Si True, le hash du bloc porte sur la racine de Merkle
+                des hashs de transactions (coinbase comprise) plutôt que sur les
+                transactions sérialisées. Les transactions doivent alors être ajoutées
+                avec add_transaction une fois signées.
+            target (int, optional): Cible de la preuve de travail ; None pour un bloc
+                sans preuve de travail, dont le hash ne dépend que du contenu.
+            timestamp (int, optional): Horodatage du bloc avec preuve de travail,
+                l'heure actuelle par défaut.
         """
         self.prev_block_hash: bytes | None = prev_block_hash
         self.coinbase: Transaction = Transaction.create_coinbase(self.COINBASE, address)
         self.transactions: list[Transaction] = []
         self.hash: bytes | None = None  # le hash du bloc lui-même
+        self.target: int | None = target
+        self.timestamp: int = 0
+        self.nonce: int = 0
+        if target is not None:
+            self.timestamp = int(time.time()) if timestamp is None else timestamp
+
+        self.merkle_tree: MerkleTree | None = None
+        # Position de chaque transaction dans l'arbre de Merkle (0 pour la coinbase)
+        self._tx_positions: dict[bytes, int] = {}
+        if merkle:
+            self.merkle_tree = MerkleTree([self.coinbase.hash])
+            self._tx_positions[self.coinbase.hash] = 0
+
+    @classmethod
+    def restore(
+        cls,
+        prev_block_hash: bytes | None,
+        coinbase: Transaction,
+        transactions: list[Transaction],
+        block_hash: bytes,
+        merkle: bool = False,
+        target: int | None = None,
+        timestamp: int = 0,
+        nonce: int = 0,
+    ) -> "Block":
+        """
+        Reconstruit un bloc déjà finalisé à partir de ses parties (par exemple lues
+        depuis le stockage), sans recalculer son hash.
+        """
+        block: Block = cls.__new__(cls)
+        block.prev_block_hash = prev_block_hash
+        block.coinbase = coinbase
+        block.transactions = []
+        block.hash = None
+        block.target = target
+        block.timestamp = timestamp
+        block.nonce = nonce
+        block.merkle_tree = None
+        block._tx_positions = {}
+        if merkle:
+            block.merkle_tree = MerkleTree([coinbase.hash])
+            block._tx_positions[coinbase.hash] = 0
+
+        for tx in transactions:
+            block.add_transaction(tx)
+        block.hash = block_hash
+        return block
 
     def get_transaction(self, index: int) -> Transaction:
         """Renvoie la transaction du bloc se trouvant à l'index <index>."""
@@ -35,19 +112,78 @@ class Block:
     def add_transaction(self, tx: Transaction) -> None:
         """Ajoute une nouvelle transaction <tx> au bloc."""
         self.transactions.append(tx)
+        if self.merkle_tree is not None:
+            self._tx_positions.setdefault(tx.hash, len(self.merkle_tree))
+            self.merkle_tree.append(tx.hash)
+
+    def get_merkle_root(self) -> bytes:
+        """Renvoie la racine de Merkle du bloc."""
+        assert self.merkle_tree is not None, "Bloc sans arbre de Merkle!"
+        return self.merkle_tree.root()
+
+    def get_inclusion_proof(self, tx_hash: bytes) -> list[ProofStep]:
+        """
+        Renvoie la preuve que la transaction de hash <tx_hash> fait partie du bloc,
+        à vérifier avec MerkleTree.verify_proof(tx_hash, preuve, racine de Merkle).
+        """
+        assert self.merkle_tree is not None, "Bloc sans arbre de Merkle!"
+        position: int | None = self._tx_positions.get(tx_hash)
+        if position is None:
+            raise ValueError("Transaction absente du bloc!")
+        return self.merkle_tree.get_proof(position)
 
     def to_bytes(self) -> bytes:
         """Renvoie une représentation en bytes du bloc."""
-        raw_block: bytes = b""
+        if self.target is None:
+            return self.get_header_prefix()
+        return self.get_header_prefix() + NONCE.pack(self.nonce)
+
+    def get_header_prefix(self) -> bytes:
+        """
+        Renvoie la représentation en bytes du bloc sans le nonce, qui la termine
+        avec preuve de travail : un mineur hache ce préfixe une seule fois.
+        """
+        parts: list[bytes] = []
 
-        if self.prev_block_hash is not None:
-            raw_block += self.prev_block_hash
+        if self.merkle_tree is not None:
+            if self.prev_block_hash is not None:
+                parts.append(self.prev_block_hash)
+            parts.append(self.merkle_tree.root())
+        else:
+            if self.prev_block_hash is not None:
+                parts.append(self.prev_block_hash)
 
-        for transaction in self.transactions:
-            raw_block += transaction.to_bytes()
+            for transaction in self.transactions:
+                parts.append(transaction.to_bytes())
 
-        return raw_block
+        if self.target is not None:
+            parts.append(WORK.pack(self.timestamp, self.target.to_bytes(32, "big")))
+        return b"".join(parts)
+
+    def get_work_data(self) -> bytes:
+        """Renvoie les champs de preuve de travail tels qu'ils terminent
+        to_bytes (vide sans preuve de travail)."""
+        if self.target is None:
+            return b""
+        return WORK.pack(self.timestamp, self.target.to_bytes(32, "big")) + NONCE.pack(
+            self.nonce
+        )
+
+    def has_valid_work(self) -> bool:
+        """Renvoie True si le hash du bloc correspond à son contenu et atteint sa
+        cible de preuve de travail."""
+        if self.target is None or self.hash is None:
+            return False
+        return hashlib.sha256(self.to_bytes()).digest() == self.hash and meets_target(
+            self.hash, self.target
+        )
 
     def finalize(self) -> None:
-        """Finalise le bloc en lui assignant un hash."""
+        """Finalise le bloc en lui assignant un hash (sans chercher de nonce : voir
+        mining.Miner)."""
         self.hash = hashlib.sha256(self.to_bytes()).digest()
+
+
+def meets_target(block_hash: bytes, target: int) -> bool:
+    """Renvoie True si <block_hash>, lu comme un entier big-endian, est <= <target>."""
+    return int.from_bytes(block_hash, "big") <= target
@@ -1,16 +1,36 @@
+import time
+
 from blockchain.blockchain import Blockchain
 from blockchain.block import Block
+from blockchain.block_template import BlockTemplate
 from blockchain.crypto import PublicKey
+from blockchain.mining import Miner, MiningResult
 from blockchain.transaction import Transaction
-from blockchain.transaction_handler import TransactionHandler
 from blockchain.transaction_pool import TransactionPool
-from blockchain.utxo_pool import UTXOPool
 
 
 class BlockHandler:
-    def __init__(self, blockchain: Blockchain):
-        """Suppose que la blockchain <blockchain> a un bloc de genèse."""
+    def __init__(
+        self,
+        blockchain: Blockchain,
+        max_block_size: int = TransactionPool.MAX_BLOCK_SIZE,
+        miner: Miner | None = None,
+    ):
+        """
+        Suppose que la blockchain <blockchain> a un bloc de genèse.
+        Les blocs créés contiennent au plus <max_block_size> octets de transactions.
+        Si la chaîne exige une preuve de travail, les blocs sont minés par <miner>
+        (par défaut, un mineur qui utilise tous les processeurs).
+
+        Les transactions du prochain bloc sont tenues à jour dans un gabarit
+        (BlockTemplate) à chaque transaction ou bloc traité.
+        """
         self.blockchain: Blockchain = blockchain
+        self.max_block_size: int = max_block_size
+        self.template: BlockTemplate = BlockTemplate(blockchain, max_block_size)
+        self.miner: Miner | None = miner
+        # Résultat du dernier minage (nombre de hashs, durée, hashrate)
+        self.last_mining: MiningResult | None = None
 
     def process_block(self, block: Block) -> bool:
         """
@@ -22,28 +42,50 @@ class BlockHandler:
         Returns:
             bool: True si le bloc est valide et a été ajouté à la chaîne de blocs, False sinon.
         """
-        return self.blockchain.add_block(block)
+        accepted: bool = self.blockchain.add_block(block)
+        self.template.update()
+        return accepted
 
     def create_block(self, address: PublicKey) -> Block | None:
-        """Crée un nouveau bloc sur le bloc de hauteur maximale"""
-        parent: Block = self.blockchain.get_max_height_block()
+        """
+        Crée un nouveau bloc sur le bloc de hauteur maximale, avec les transactions
+        du gabarit, qui sont déjà validées.
+        """
+        self.template.update()
+        parent_node: Blockchain.BlockNode = self.blockchain.max_height_node
+        parent: Block = parent_node.block
         assert parent.hash is not None, "Bloc parent invalide!"
-        parent_hash: bytes = parent.hash
-        current: Block = Block(address, parent_hash)
-        utxo_pool: UTXOPool = self.blockchain.get_max_height_utxo_pool()
-        tx_handler: TransactionHandler = TransactionHandler(utxo_pool)
-        transaction_pool: TransactionPool = self.blockchain.tx_pool
-        transactions: list[Transaction] = transaction_pool.get_transactions()
-        valid_txs: list[Transaction] = tx_handler.handle_transactions(transactions)
-
-        # valider et ajouter toutes les transactions
-        for transaction in valid_txs:
+        current: Block = Block(
+            address,
+            parent.hash,
+            target=self.blockchain.get_next_target(parent_node),
+            timestamp=max(int(time.time()), parent.timestamp),
+        )
+        for transaction in self.template.transactions.values():
             current.add_transaction(transaction)
 
-        current.finalize()
+        if current.target is None:
+            current.finalize()
+        elif not self._mine(current):
+            return None
+
+        if not self.blockchain.add_block(current, self.template.utxo_pool):
+            return None
+        self.template.update()
+        return current
 
-        return current if self.blockchain.add_block(current) else None
+    def _mine(self, block: Block) -> bool:
+        """Cherche le nonce de <block> ; renvoie False si aucun ne convient."""
+        if self.miner is None:
+            self.miner = Miner()
+        with self.blockchain.metrics.span("mining"):
+            result: MiningResult = self.miner.mine(block)
+        self.blockchain.metrics.increment("mining_hashes", result.hashes)
+        self.last_mining = result
+        return result.found
 
-    def process_transaction(self, transaction: Transaction) -> None:
-        """Traite une transaction"""
-        self.blockchain.add_transaction(transaction)
+    def process_transaction(self, transaction: Transaction) -> bool:
+        """Traite une transaction. Renvoie True si elle a été admise dans le memory pool."""
+        accepted: bool = self.blockchain.add_transaction(transaction)
+        self.template.update()
+        return accepted
@@ -0,0 +1,157 @@
+"""
+Gabarit de bloc maintenu au fil des transactions et des blocs reçus.
+
+Le gabarit garde les transactions du prochain bloc, déjà validées au-dessus du
+sommet de la chaîne, et le pool UTXO qui en résulte. Chaque transaction admise
+dans le memory pool y est ajoutée si elle est valide et tient dans le bloc ; quand
+le sommet avance d'un bloc, les transactions confirmées ou en conflit avec lui en
+sont retirées en revalidant le gabarit seul. BlockHandler.create_block n'a plus
+qu'à recopier le gabarit, et add_block réutilise son pool UTXO sans revalider les
+transactions, après avoir vérifié que ses UTXOs créés et dépensés sont ceux du bloc.
+
+Les transactions sont ajoutées par ordre d'arrivée. Le gabarit n'est reconstruit
+par frais décroissants (TransactionPool.get_block_template) qu'après une
+réorganisation, ou au bloc suivant si une transaction a été écartée faute de place.
+
+    template = BlockTemplate(blockchain)
+    blockchain.add_transaction(tx)
+    template.update()
+    for tx in template.transactions.values():
+        block.add_transaction(tx)
+    blockchain.add_block(block, template.utxo_pool)
+"""
+
+from __future__ import annotations
+
+from blockchain.blockchain import Blockchain
+from blockchain.transaction import Transaction
+from blockchain.transaction_handler import TransactionHandler
+from blockchain.transaction_pool import TransactionPool
+from blockchain.utxo_pool import UTXOPool
+
+
+class BlockTemplate:
+    """
+    Transactions du prochain bloc, validées au-dessus du sommet de <blockchain>.
+
+    Attributes:
+        max_block_size (int): Taille maximale des transactions du bloc, en octets.
+        node (Blockchain.BlockNode | None): Sommet sur lequel le gabarit est
+            construit, None avant la première mise à jour.
+        transactions (dict): Transactions choisies, par hash, dans l'ordre du bloc.
+        size (int): Taille totale des transactions choisies, en octets.
+        full (bool): True si une transaction a été écartée faute de place.
+    """
+
+    def __init__(
+        self,
+        blockchain: Blockchain,
+        max_block_size: int = TransactionPool.MAX_BLOCK_SIZE,
+    ):
+        self.blockchain: Blockchain = blockchain
+        self.max_block_size: int = max_block_size
+        self.node: Blockchain.BlockNode | None = None
+        self.transactions: dict[bytes, Transaction] = {}
+        self.size: int = 0
+        self.full: bool = False
+        # Applique les transactions choisies sur une couche au-dessus du sommet
+        self._handler: TransactionHandler | None = None
+        # Séquence du memory pool à partir de laquelle les transactions sont nouvelles
+        self._sequence: int = 0
+        # Nombre de retraits du memory pool à la dernière mise à jour
+        self._removals: int = 0
+
+    @property
+    def utxo_pool(self) -> UTXOPool:
+        """Pool UTXO du sommet après les transactions du gabarit."""
+        assert self._handler is not None, "Gabarit jamais mis à jour!"
+        return self._handler.utxo_pool
+
+    def update(self) -> None:
+        """
+        Met le gabarit à jour après des transactions ou des blocs reçus. Le coût
+        est proportionnel aux nouvelles transactions du memory pool, plus la taille
+        du gabarit quand le sommet a avancé d'un bloc ou que des transactions du
+        gabarit ont quitté le memory pool.
+        """
+        tx_pool: TransactionPool = self.blockchain.tx_pool
+        tip: Blockchain.BlockNode = self.blockchain.max_height_node
+        if tip is not self.node:
+            if self.node is not None and tip.parent is self.node and not self.full:
+                self._revalidate(tip, "advance")
+            else:
+                self._rebuild(tip)
+        elif tx_pool.removals != self._removals:
+            self._revalidate(tip, "removal")
+        self._removals = tx_pool.removals
+
+        recent: list[Transaction] = tx_pool.get_transactions_since(self._sequence)
+        self._sequence = tx_pool.sequence
+        for tx in recent:
+            self._add(tx)
+
+    def _reset(self, tip: Blockchain.BlockNode) -> None:
+        """Vide le gabarit et le place au-dessus de <tip>."""
+        assert tip.utxo_pool is not None, "Sommet élagué!"
+        self.node = tip
+        self._handler = TransactionHandler(
+            tip.utxo_pool,
+            self.blockchain.verifier,
+            self.blockchain.signature_cache,
+            self.blockchain.metrics,
+        )
+        self.transactions = {}
+        self.size = 0
+        self.full = False
+
+    def _apply(self, txs: list[Transaction]) -> None:
+        """Ajoute au gabarit les transactions valides de <txs>, dans l'ordre."""
+        assert self._handler is not None
+        entries: dict[bytes, TransactionPool.Entry] = self.blockchain.tx_pool.entries
+        for tx in self._handler.handle_transactions(txs):
+            self.transactions[tx.hash] = tx
+            self.size += entries[tx.hash].size
+
+    def _revalidate(self, tip: Blockchain.BlockNode, event: str) -> None:
+        """
+        Replace le gabarit au-dessus de <tip> en ne gardant que ses transactions
+        encore dans le memory pool et valides : les transactions confirmées et
+        celles en conflit avec le sommet sont écartées avec leurs descendants.
+        """
+        tx_pool: TransactionPool = self.blockchain.tx_pool
+        kept: list[Transaction] = [
+            tx for tx_hash, tx in self.transactions.items() if tx_hash in tx_pool.pool
+        ]
+        full: bool = self.full
+        self._reset(tip)
+        self._apply(kept)
+        self.full = full
+        self.blockchain.metrics.increment("block_template", event=event)
+
+    def _rebuild(self, tip: Blockchain.BlockNode) -> None:
+        """Reconstruit le gabarit au-dessus de <tip> à partir de tout le memory
+        pool, par frais décroissants."""
+        tx_pool: TransactionPool = self.blockchain.tx_pool
+        self._reset(tip)
+        self._apply(tx_pool.get_block_template(self.max_block_size))
+        self.full = tx_pool.size > self.max_block_size
+        self._sequence = tx_pool.sequence
+        self.blockchain.metrics.increment("block_template", event="rebuild")
+
+    def _add(self, tx: Transaction) -> None:
+        """Ajoute <tx> puis, récursivement, ses enfants du memory pool, s'ils sont
+        valides et tiennent dans le gabarit."""
+        entries: dict[bytes, TransactionPool.Entry] = self.blockchain.tx_pool.entries
+        stack: list[bytes] = [tx.hash]
+        while stack:
+            tx_hash: bytes = stack.pop()
+            entry: TransactionPool.Entry | None = entries.get(tx_hash)
+            if entry is None or tx_hash in self.transactions:
+                continue
+            if self.size + entry.size > self.max_block_size:
+                self.full = True
+                continue
+            self._apply([entry.tx])
+            if tx_hash in self.transactions:
+                # Les enfants arrivés avant tx peuvent maintenant être validés
+                stack.extend(entry.children)
@@ -1,6 +1,15 @@
 from __future__ import annotations
 
+import sys
+import time
+from collections import Counter
+
 from blockchain.block import Block
+from blockchain.crypto import BatchVerifier, PublicKey, SignatureCache
+from blockchain.history import Cursor, HistoryEntry, HistoryIndex, Location
+from blockchain.metrics import Metrics
+from blockchain.mining import ProofOfWork, get_work
+from blockchain.storage import BlockStore, UTXOEntry
 from blockchain.transaction import Transaction
 from blockchain.transaction_handler import TransactionHandler
 from blockchain.transaction_pool import TransactionPool
@@ -8,39 +17,291 @@ from blockchain.utxo import UTXO
 from blockchain.utxo_pool import UTXOPool
 
 
+def _clear_lowest_bit(n: int) -> int:
+    return n & (n - 1)
+
+
+def _skip_height(height: int) -> int:
+    """
+    Renvoie la hauteur de l'ancêtre visé par le pointeur skip d'un noeud de hauteur
+    <height>, choisie comme dans Bitcoin pour que tout ancêtre soit atteint en
+    O(log n) sauts. Les hauteurs commencent à 1 (genèse).
+    """
+    # Bitcoin numérote les hauteurs à partir de 0
+    zero_based: int = height - 1
+    if zero_based < 2:
+        return 1
+    if zero_based & 1:
+        return _clear_lowest_bit(_clear_lowest_bit(zero_based - 1)) + 2
+    return _clear_lowest_bit(zero_based) + 1
+
+
 class Blockchain:
     CUT_OFF_AGE: int = 10
+    # Nombre maximal de transactions orphelines gardées en attente de leurs parents
+    MAX_ORPHANS: int = 100
+    # Profondeur maximale d'une chaîne de couches UTXO avant d'en faire un instantané complet
+    SNAPSHOT_INTERVAL: int = 16
 
     class BlockNode:
+        __slots__ = (
+            "_block",
+            "_store",
+            "hash",
+            "parent",
+            "children",
+            "utxo_pool",
+            "height",
+            "chain_work",
+            "skip",
+        )
+
         def __init__(
-            self, block: Block, parent: Blockchain.BlockNode | None, utxo_pool: UTXOPool
+            self,
+            block: Block | None,
+            parent: Blockchain.BlockNode | None,
+            utxo_pool: UTXOPool | None,
+            block_hash: bytes | None = None,
+            store: BlockStore | None = None,
+            target: int | None = None,
         ):
-            self.block: Block = block
+            # Bloc du noeud ; s'il est None, il est lu depuis <store> au premier accès
+            self._block: Block | None = block
+            self._store: BlockStore | None = store
+            node_hash: bytes | None = block_hash if block is None else block.hash
+            assert node_hash is not None, "Bloc non finalisé!"
+            self.hash: bytes = node_hash
             self.parent: Blockchain.BlockNode | None = None
             self.children: list[Blockchain.BlockNode] = []
             # pool utxo pour créer un nouveau bloc au-dessus de ce bloc
-            self.utxo_pool: UTXOPool = utxo_pool
+            # (une couche delta au-dessus du pool du parent) ; None une fois élagué
+            self.utxo_pool: UTXOPool | None = utxo_pool
             self.height: int = 1
+            # Travail cumulé depuis la genèse (la hauteur sans preuve de travail)
+            self.chain_work: int = get_work(target if block is None else block.target)
+            # Ancêtre lointain (voir _skip_height) pour trouver un ancêtre en O(log n)
+            self.skip: Blockchain.BlockNode | None = None
             if parent is not None:
                 self.height = parent.height + 1
                 self.parent = parent
                 self.parent.children.append(self)
+                self.chain_work += parent.chain_work
+                self.skip = parent.get_ancestor(_skip_height(self.height))
+
+        @property
+        def block(self) -> Block:
+            if self._block is None:
+                assert self._store is not None, "Bloc absent du stockage!"
+                self._block = self._store.read_block(self.hash)
+            return self._block
+
+        def unload(self) -> None:
+            """Libère le bloc s'il peut être relu depuis le stockage."""
+            if self._store is not None:
+                self._block = None
 
-    def __init__(self, genesis_block: Block):
+        def get_ancestor(self, height: int) -> Blockchain.BlockNode | None:
+            """
+            Renvoie l'ancêtre de hauteur <height> de ce noeud (lui-même à sa propre
+            hauteur), None si <height> est hors de [1, hauteur du noeud]. Suit les
+            pointeurs skip quand ils ne dépassent pas <height> : O(log n) sauts.
+            """
+            if not 1 <= height <= self.height:
+                return None
+            node: Blockchain.BlockNode = self
+            while node.height > height:
+                skip_height: int = _skip_height(node.height)
+                previous_skip: int = _skip_height(node.height - 1)
+                # Comme CBlockIndex::GetAncestor de Bitcoin : le skip du parent est
+                # préféré s'il mène plus près de <height> sans la dépasser
+                if node.skip is not None and (
+                    skip_height == height
+                    or (
+                        skip_height > height
+                        and not (
+                            previous_skip < skip_height - 2 and previous_skip >= height
+                        )
+                    )
+                ):
+                    node = node.skip
+                else:
+                    assert node.parent is not None
+                    node = node.parent
+            return node
+
+    def __init__(
+        self,
+        genesis_block: Block,
+        signature_workers: int = 0,
+        auto_prune: bool = True,
+        store: BlockStore | None = None,
+        metrics: Metrics | None = None,
+        proof_of_work: ProofOfWork | None = None,
+        history: HistoryIndex | None = None,
+        assume_valid: bytes | None = None,
+    ):
         """
         Crée une chaîne de blocs vide avec juste un bloc de genèse.
+
+        Si <signature_workers> > 0, les signatures d'un bloc sont vérifiées en lot
+        après les autres vérifications, dans un pool de <signature_workers>
+        processus (dans le processus courant si <signature_workers> vaut 1).
+
+        Si <auto_prune> est True, prune est appelé à chaque changement du bloc de
+        hauteur maximale.
+
+        Si <store> n'est pas None, chaque bloc accepté y est enregistré, et la
+        chaîne peut être rouverte avec Blockchain.open. <store> doit être vide.
+
+        <metrics> reçoit la durée des étapes de add_block et les compteurs de blocs
+        et de transactions acceptés ou refusés (désactivé par défaut).
+
+        Si <proof_of_work> n'est pas None, chaque bloc doit porter la cible donnée
+        par get_next_target et l'atteindre ; la cible du bloc de genèse est la
+        cible initiale.
+
+        Si <history> n'est pas None, chaque bloc accepté y est indexé, ce qui
+        permet find_transaction et get_address_history. <history> doit être vide.
+
+        Si <assume_valid> n'est pas None, c'est le hash d'un bloc de référence
+        (assume-valid) : les signatures de ce bloc et de ses ancêtres enregistrés
+        par add_assumed_headers ne sont pas vérifiées (voir add_assumed_headers).
         """
         assert genesis_block.hash is not None, "Bloc de genèse invalide!"
+        if store is not None and not store.is_empty():
+            raise ValueError("Stockage non vide, utiliser Blockchain.open!")
+        if proof_of_work is not None and genesis_block.target is None:
+            raise ValueError("Bloc de genèse sans cible de preuve de travail!")
 
-        self.blockchain: dict[str, Blockchain.BlockNode] = {}
         utxo_pool: UTXOPool = UTXOPool()
         self.add_coinbase_to_utxo_pool(genesis_block, utxo_pool)
+        if store is not None:
+            store.commit_block(
+                genesis_block,
+                1,
+                list(utxo_pool.items()),
+                [],
+                connected=[genesis_block.hash],
+                tip=genesis_block.hash,
+            )
         genesis_node: Blockchain.BlockNode = Blockchain.BlockNode(
-            genesis_block, None, utxo_pool
+            genesis_block, None, utxo_pool, store=store
         )
-        self.blockchain[genesis_block.hash.hex()] = genesis_node
+        self._setup(
+            genesis_node,
+            signature_workers,
+            auto_prune,
+            store,
+            metrics,
+            proof_of_work,
+            history,
+            assume_valid,
+        )
+        if history is not None:
+            history.add_block(genesis_block, 1, None)
+        if store is None:
+            self._confirmed[genesis_block.coinbase.hash] = 1
+
+    def _setup(
+        self,
+        tip: Blockchain.BlockNode,
+        signature_workers: int,
+        auto_prune: bool,
+        store: BlockStore | None,
+        metrics: Metrics | None = None,
+        proof_of_work: ProofOfWork | None = None,
+        history: HistoryIndex | None = None,
+        assume_valid: bytes | None = None,
+    ) -> None:
+        """Initialise l'état d'une chaîne dont <tip> est le bloc de hauteur maximale
+        et dont la racine est le seul noeud non élagué."""
+        root: Blockchain.BlockNode | None = tip.get_ancestor(1)
+        assert root is not None
+
+        self.blockchain: dict[str, Blockchain.BlockNode] = {root.hash.hex(): root}
+        # Noeuds non encore élagués, par hauteur
+        self.heights: dict[int, list[Blockchain.BlockNode]] = {1: [root]}
+        # Les noeuds de hauteur inférieure ont déjà été élagués
+        self.pruned_height: int = 1
+        self.auto_prune: bool = auto_prune
+        self.store: BlockStore | None = store
+        self.metrics: Metrics = metrics or Metrics()
+        self.proof_of_work: ProofOfWork | None = proof_of_work
         self.tx_pool: TransactionPool = TransactionPool()
-        self.max_height_node: Blockchain.BlockNode = genesis_node
+        self.max_height_node: Blockchain.BlockNode = tip
+        self.verifier: BatchVerifier | None = (
+            BatchVerifier(signature_workers) if signature_workers > 0 else None
+        )
+        # Signatures déjà vérifiées, partagées par toutes les validations du noeud
+        self.signature_cache: SignatureCache = SignatureCache()
+        # Index de l'historique, non disponible pour une chaîne rouverte
+        self.history: HistoryIndex | None = history
+        # Bloc de référence assume-valid et en-têtes (hash -> hash du parent) de
+        # ses ancêtres dont les signatures sont présumées valides
+        self.assume_valid: bytes | None = assume_valid
+        self._assumed: dict[bytes, bytes | None] = {}
+        # Transactions orphelines, hors du memory pool, par ordre d'arrivée, et
+        # orphelines qui attendent chaque transaction inconnue
+        self.orphans: dict[bytes, Transaction] = {}
+        self._orphans_by_parent: dict[bytes, set[bytes]] = {}
+        # Nombre de blocs de la branche principale qui contiennent chaque
+        # transaction ; sans stockage seulement (voir is_confirmed)
+        self._confirmed: dict[bytes, int] = {}
+
+    @classmethod
+    def open(
+        cls,
+        store: BlockStore,
+        signature_workers: int = 0,
+        auto_prune: bool = True,
+        metrics: Metrics | None = None,
+        proof_of_work: ProofOfWork | None = None,
+        assume_valid: bytes | None = None,
+    ) -> Blockchain:
+        """
+        Rouvre la chaîne enregistrée dans <store> sans revalider l'historique :
+        l'arbre des blocs et le pool UTXO du bloc de hauteur maximale sont lus
+        directement. Les blocs sont lus depuis <store> à la demande, et le pool UTXO
+        d'un autre noeud est reconstruit à partir des deltas enregistrés quand un
+        bloc est ajouté au-dessus de lui. Le memory pool n'est pas enregistré.
+        """
+        tip_hash: bytes | None = store.get_tip()
+        if tip_hash is None:
+            raise ValueError("Stockage vide!")
+
+        nodes: dict[bytes, Blockchain.BlockNode] = {}
+        for block_hash, prev_block_hash, height, target in store.load_headers():
+            parent: Blockchain.BlockNode | None = (
+                None if prev_block_hash is None else nodes[prev_block_hash]
+            )
+            nodes[block_hash] = Blockchain.BlockNode(
+                None, parent, None, block_hash, store, target
+            )
+            assert nodes[block_hash].height == height, "Stockage incohérent!"
+
+        tip: Blockchain.BlockNode = nodes[tip_hash]
+        utxo_pool: UTXOPool = UTXOPool()
+        for utxo, output in store.load_utxos():
+            utxo_pool.add_utxo(utxo, output)
+        tip.utxo_pool = utxo_pool
+
+        chain: Blockchain = cls.__new__(cls)
+        chain._setup(
+            tip,
+            signature_workers,
+            auto_prune,
+            store,
+            metrics,
+            proof_of_work,
+            assume_valid=assume_valid,
+        )
+        for node in nodes.values():
+            if node.parent is not None:
+                chain.blockchain[node.hash.hex()] = node
+                chain.heights.setdefault(node.height, []).append(node)
+        if auto_prune:
+            chain.prune()
+        return chain
 
     def get_max_height_block(self) -> Block:
         """Renvoie le bloc de hauteur maximale."""
@@ -51,14 +312,156 @@ class Blockchain:
         """Renvoie le pool utxo pour miner un nouveau bloc
         au-dessus du bloc de hauteur maximale."""
         # TODO: Votre code ici
+        assert self.max_height_node.utxo_pool is not None
         return self.max_height_node.utxo_pool
 
-    def add_transaction(self, tx: Transaction) -> None:
-        """Ajoute une transaction au memory pool."""
+    def add_assumed_headers(self, headers: list[tuple[bytes, bytes | None]]) -> int:
+        """
+        Enregistre les en-têtes (hash, hash du parent) d'une chaîne menant au bloc
+        de référence assume_valid, dans l'ordre des hauteurs. Les blocs
+        enregistrés, jusqu'au bloc de référence inclus, sont ensuite ajoutés par
+        add_block sans vérifier leurs signatures, pourvu que leur parent soit
+        celui de l'en-tête ; les autres règles (sorties dépensées, montants,
+        double dépense) restent vérifiées. La vérification complète reprend
+        après le bloc de référence.
+
+        Le hash de assume_valid doit venir d'une source de confiance, et chaque
+        bloc ajouté doit avoir pour hash celui de son contenu, signatures
+        comprises (voir sync.BlockHeader.matches) : les ancêtres du bloc de
+        référence sont alors fixés par les hashs des parents.
+
+        Returns:
+            int: Nombre d'en-têtes enregistrés, 0 si le bloc de référence n'est
+                pas dans <headers> ou si assume_valid est None.
+
+        Raises:
+            ValueError: Si un en-tête n'a pas pour parent l'en-tête précédent.
+        """
+        for (previous, _), (_, prev_block_hash) in zip(headers, headers[1:]):
+            if prev_block_hash != previous:
+                raise ValueError("En-têtes non chaînés!")
+        hashes: list[bytes] = [block_hash for block_hash, _ in headers]
+        if self.assume_valid is None or self.assume_valid not in hashes:
+            return 0
+        assumed: list[tuple[bytes, bytes | None]] = headers[
+            : hashes.index(self.assume_valid) + 1
+        ]
+        self._assumed.update(assumed)
+        return len(assumed)
+
+    def add_transaction(self, tx: Transaction) -> bool:
+        """
+        Ajoute une transaction au memory pool si elle est valide par rapport au
+        pool UTXO du bloc de hauteur maximale, complété par les sorties des
+        transactions du memory pool. Les conflits avec le memory pool sont
+        résolus par TransactionPool.add_transaction.
+
+        Une transaction qui dépense une sortie d'une transaction confirmée absente
+        du pool UTXO (déjà dépensée ou inexistante) est refusée. Une transaction
+        qui dépense la sortie d'une transaction inconnue est gardée comme
+        orpheline, hors du memory pool (voir MAX_ORPHANS), et n'y est admise qu'à
+        l'arrivée de ses parents dans le memory pool ou dans un bloc.
+
+        Returns:
+            bool: True si la transaction est dans le memory pool, False sinon.
+        """
         # TODO: Votre code ici
-        self.tx_pool.add_transaction(tx)
+        if tx.hash in self.tx_pool.pool:
+            return True
+
+        utxo_pool: UTXOPool = self.get_max_height_utxo_pool()
+        missing: set[bytes] = set()
+        for input_ in tx.inputs:
+            if (
+                UTXO(input_.prev_tx_hash, input_.output_index) in utxo_pool
+                or input_.prev_tx_hash in self.tx_pool.pool
+            ):
+                continue
+            if self.is_confirmed(input_.prev_tx_hash):
+                return self._reject_transaction("spent")
+            missing.add(input_.prev_tx_hash)
+        if missing:
+            self._add_orphan(tx, missing)
+            self.metrics.increment("transactions", result="orphan")
+            return False
+
+        if not self._is_valid_pool_transaction(tx, utxo_pool):
+            return self._reject_transaction("invalid")
+
+        if not self.tx_pool.add_transaction(tx, utxo_pool):
+            return self._reject_transaction("pool")
+
+        self.metrics.increment("transactions", result="accepted")
+        self._promote_orphans(tx.hash)
+        return True
+
+    def is_confirmed(self, tx_hash: bytes) -> bool:
+        """Renvoie True si la transaction <tx_hash> est dans un bloc de la branche
+        principale. Avec un stockage, l'index des transactions du stockage est
+        consulté ; sinon, un compteur tenu à jour par reorganize_tx_pool."""
+        if self.store is None:
+            return tx_hash in self._confirmed
+        for block_hash, _, _ in self.store.locate_transaction(tx_hash):
+            node: Blockchain.BlockNode | None = self.blockchain.get(block_hash.hex())
+            if node is not None and self.is_on_main_chain(node.height, node.hash):
+                return True
+        return False
+
+    def _add_orphan(self, tx: Transaction, missing: set[bytes]) -> None:
+        """Garde <tx> comme orpheline en attente des transactions <missing>, en
+        évinçant la plus ancienne au-delà de MAX_ORPHANS."""
+        if tx.hash in self.orphans:
+            return
+        self.orphans[tx.hash] = tx
+        for parent_hash in missing:
+            self._orphans_by_parent.setdefault(parent_hash, set()).add(tx.hash)
+        while len(self.orphans) > self.MAX_ORPHANS:
+            self._remove_orphan(next(iter(self.orphans)))
+
+    def _remove_orphan(self, tx_hash: bytes) -> Transaction:
+        tx: Transaction = self.orphans.pop(tx_hash)
+        for input_ in tx.inputs:
+            waiting: set[bytes] | None = self._orphans_by_parent.get(
+                input_.prev_tx_hash
+            )
+            if waiting is not None:
+                waiting.discard(tx_hash)
+                if not waiting:
+                    del self._orphans_by_parent[input_.prev_tx_hash]
+        return tx
 
-    def add_block(self, block: Block) -> bool:
+    def _promote_orphans(self, parent_hash: bytes) -> None:
+        """Soumet de nouveau à add_transaction les orphelines qui attendaient la
+        transaction <parent_hash>, admise dans le memory pool ou confirmée."""
+        for tx_hash in list(self._orphans_by_parent.pop(parent_hash, ())):
+            if tx_hash in self.orphans:
+                self.add_transaction(self._remove_orphan(tx_hash))
+
+    def _reject_transaction(self, reason: str) -> bool:
+        """Compte une transaction refusée pour la raison <reason> ; renvoie False."""
+        self.metrics.increment("transactions", result="rejected", reason=reason)
+        return False
+
+    def _is_valid_pool_transaction(self, tx: Transaction, utxo_pool: UTXOPool) -> bool:
+        """Renvoie True si <tx> est valide par rapport à <utxo_pool> complété par
+        les sorties des transactions du memory pool."""
+        handler: TransactionHandler = TransactionHandler(
+            utxo_pool, signature_cache=self.signature_cache
+        )
+        # Rend visibles les sorties des transactions du pool dépensées par tx
+        for input_ in tx.inputs:
+            parent: Transaction | None = self.tx_pool.get_transaction(
+                input_.prev_tx_hash
+            )
+            if parent is not None and input_.output_index < parent.num_outputs():
+                utxo: UTXO = UTXO(input_.prev_tx_hash, input_.output_index)
+                handler.utxo_pool.add_utxo(utxo, parent.get_output(input_.output_index))
+
+        return handler.is_valid_transaction(tx)
+
+    def add_block(
+        self, block: Block, verified_utxo_pool: UTXOPool | None = None
+    ) -> bool:
         """
         Ajoute <block> à la chaîne de blocs s'il est valide.
         Pour que le bloc soit considéré comme valide, toutes les transactions
@@ -69,60 +472,527 @@ class Blockchain:
         (hauteur de bloc 2) si la hauteur de la blockchain est <= CUT_OFF_AGE + 1.
         Dès que la hauteur > CUT_OFF_AGE + 1, vous ne pouvez pas créer de nouveau bloc à hauteur 2.
 
+        Le bloc devient le sommet de la chaîne (max_height_node) si sa branche a
+        plus de travail cumulé que celle du sommet actuel, c'est-à-dire, sans
+        preuve de travail, si elle est plus haute.
+
+        Si <verified_utxo_pool> est fourni, c'est une couche au-dessus du pool UTXO
+        du parent où les transactions du bloc ont déjà été validées et appliquées
+        (voir BlockTemplate). Si les UTXOs qu'elle crée et dépense sont exactement
+        ceux des transactions du bloc, elles ne sont pas revérifiées et la couche
+        devient le pool UTXO du bloc ; elle ne doit plus être modifiée. Sinon, le
+        bloc est validé normalement.
+
         Returns:
             bool: True si le bloc a été ajouté avec succès, False sinon.
         """
         assert block.hash is not None, "Bloc invalide!"
+        metrics: Metrics = self.metrics
 
         # Vérifie si le bloc est un bloc de genèse
         prev_block_hash: bytes | None = block.prev_block_hash
         if prev_block_hash is None:
-            return False
+            return self._reject_block("genesis")
 
         # Vérifie si le bloc parent existe
-        parent_block_node: Blockchain.BlockNode | None = self.blockchain.get(
-            prev_block_hash.hex()
-        )
+        with metrics.span("add_block_stage", stage="parent_lookup"):
+            parent_block_node: Blockchain.BlockNode | None = self.blockchain.get(
+                prev_block_hash.hex()
+            )
         if parent_block_node is None:
-            return False
+            return self._reject_block("unknown_parent")
 
         # Vérification de la hauteur
         proposed_height: int = parent_block_node.height + 1
         if proposed_height <= self.max_height_node.height - self.CUT_OFF_AGE:
-            return False
+            return self._reject_block("too_old")
+
+        if self.proof_of_work is not None:
+            with metrics.span("add_block_stage", stage="work"):
+                invalid_work: str | None = self._check_work(block, parent_block_node)
+            if invalid_work is not None:
+                return self._reject_block(invalid_work)
+
+        if parent_block_node.utxo_pool is None:
+            if self.store is None:
+                return self._reject_block("pruned_parent")
+            with metrics.span("add_block_stage", stage="utxo_restore"):
+                parent_block_node.utxo_pool = self._restore_utxo_pool(parent_block_node)
 
         # Vérifie si toutes les transactions dans le bloc sont valides
         txs: list[Transaction] = block.transactions
 
         if len(txs) == 0:
-            return False
-
-        handler: TransactionHandler = TransactionHandler(parent_block_node.utxo_pool)
+            return self._reject_block("empty")
 
-        valid_txs: list[Transaction] = handler.handle_transactions(txs)
-        print(f"[add_block] Nb de tsx: {len(txs)}")
-        print(f"[add_block] Nb de tsx valides: {len(valid_txs)}")
-        print("BREAK ==========")
+        # Ancêtre du bloc de référence assume-valid : signatures non vérifiées
+        assumed: bool = (
+            block.hash in self._assumed and self._assumed[block.hash] == prev_block_hash
+        )
+        utxo_pool: UTXOPool
+        if (
+            verified_utxo_pool is not None
+            and verified_utxo_pool.parent is parent_block_node.utxo_pool
+            and self._layer_matches(verified_utxo_pool, txs)
+        ):
+            utxo_pool = verified_utxo_pool
+        else:
+            with metrics.span("add_block_stage", stage="utxo_copy"):
+                handler: TransactionHandler = TransactionHandler(
+                    parent_block_node.utxo_pool,
+                    self.verifier,
+                    self.signature_cache,
+                    metrics,
+                    verify_signatures=not assumed,
+                )
 
-        if len(valid_txs) != len(txs):
-            return False
+            with metrics.span("add_block_stage", stage="transactions"):
+                valid_txs: list[Transaction] = handler.handle_transactions(
+                    txs, stop_on_invalid=True
+                )
 
-        utxo_pool: UTXOPool = handler.utxo_pool
-        self.add_coinbase_to_utxo_pool(block, utxo_pool)
+            if len(valid_txs) != len(txs):
+                return self._reject_block("invalid_transaction")
+            utxo_pool = handler.utxo_pool
 
-        # Retrait des transactions du pool
-        for tx in block.transactions:
-            self.tx_pool.remove_transaction(tx.hash)
+        with metrics.span("add_block_stage", stage="coinbase"):
+            self.add_coinbase_to_utxo_pool(block, utxo_pool)
+        if self.store is not None:
+            with metrics.span("add_block_stage", stage="store"):
+                self._store_block(block, parent_block_node, utxo_pool)
+        if utxo_pool.depth >= self.SNAPSHOT_INTERVAL:
+            with metrics.span("add_block_stage", stage="utxo_snapshot"):
+                utxo_pool = utxo_pool.flatten()
 
         node: Blockchain.BlockNode = Blockchain.BlockNode(
-            block, parent_block_node, utxo_pool
+            block, parent_block_node, utxo_pool, store=self.store
         )
         self.blockchain[block.hash.hex()] = node
-        if proposed_height > self.max_height_node.height:
+        self.heights.setdefault(node.height, []).append(node)
+        if self.history is not None:
+            with metrics.span("add_block_stage", stage="history"):
+                self.history.add_block(block, node.height, parent_block_node.utxo_pool)
+        # Choix de la branche : le travail cumulé (la hauteur sans preuve de
+        # travail) ; à égalité, le premier bloc reçu reste le sommet
+        if node.chain_work > self.max_height_node.chain_work:
+            old_tip: Blockchain.BlockNode = self.max_height_node
             self.max_height_node = node
+            with metrics.span("add_block_stage", stage="mempool"):
+                self.reorganize_tx_pool(old_tip, node)
+            if self.auto_prune:
+                with metrics.span("add_block_stage", stage="prune"):
+                    self.prune()
+
+        if assumed:
+            del self._assumed[block.hash]
+            metrics.increment("assumed_valid_blocks")
+            if block.hash == self.assume_valid:
+                # Bloc de référence atteint : vérification complète des suivants
+                self._assumed.clear()
 
+        metrics.increment("blocks", result="accepted")
+        metrics.increment("block_transactions", len(txs))
         return True
 
+    def get_next_target(self, parent: Blockchain.BlockNode) -> int | None:
+        """
+        Renvoie la cible de preuve de travail d'un bloc ajouté au-dessus de
+        <parent> (None sans preuve de travail) : celle de <parent>, recalculée tous
+        les proof_of_work.retarget_interval blocs d'après l'horodatage des blocs de
+        l'intervalle précédent.
+        """
+        if self.proof_of_work is None:
+            return None
+        parent_block: Block = parent.block
+        assert parent_block.target is not None, "Bloc sans cible!"
+        interval: int = self.proof_of_work.retarget_interval
+        if parent.height % interval != 0:
+            return parent_block.target
+
+        first: Blockchain.BlockNode | None = parent.get_ancestor(
+            parent.height - interval + 1
+        )
+        assert first is not None
+        return self.proof_of_work.retarget(
+            parent_block.target, parent_block.timestamp - first.block.timestamp
+        )
+
+    def _check_work(self, block: Block, parent: Blockchain.BlockNode) -> str | None:
+        """Renvoie la raison du refus de <block> au-dessus de <parent> selon les
+        règles de preuve de travail, None s'il les respecte."""
+        assert self.proof_of_work is not None
+        if block.target is None or block.target != self.get_next_target(parent):
+            return "bad_target"
+        if block.timestamp < parent.block.timestamp or (
+            block.timestamp > time.time() + self.proof_of_work.max_future_time
+        ):
+            return "bad_timestamp"
+        if not block.has_valid_work():
+            return "invalid_work"
+        return None
+
+    def _reject_block(self, reason: str) -> bool:
+        """Compte un bloc refusé pour la raison <reason> ; renvoie False."""
+        self.metrics.increment("blocks", result="rejected", reason=reason)
+        return False
+
+    def _store_block(
+        self, block: Block, parent: Blockchain.BlockNode, utxo_pool: UTXOPool
+    ) -> None:
+        """Enregistre <block>, ajouté au-dessus de <parent>, dont <utxo_pool> est la
+        couche au-dessus du pool de <parent>, et change le sommet du stockage si
+        la branche de <block> a plus de travail cumulé."""
+        assert self.store is not None and block.hash is not None
+        created, spent = self._layer_delta(utxo_pool)
+        disconnected: list[bytes] = []
+        connected: list[bytes] = []
+        tip: bytes | None = None
+        if parent.chain_work + get_work(block.target) > self.max_height_node.chain_work:
+            old, new = self.get_fork_path(self.max_height_node, parent)
+            disconnected = [node.hash for node in old]
+            connected = [node.hash for node in new] + [block.hash]
+            tip = block.hash
+        self.store.commit_block(
+            block, parent.height + 1, created, spent, disconnected, connected, tip
+        )
+
+    @staticmethod
+    def _layer_matches(layer: UTXOPool, txs: list[Transaction]) -> bool:
+        """
+        Renvoie True si la couche <layer> crée exactement les sorties de <txs>
+        non dépensées par <txs>, et dépense exactement les UTXOs de sa couche
+        parente que les entrées de <txs> dépensent.
+        """
+        created: dict[UTXO, Transaction.Output] = {}
+        spent: set[UTXO] = set()
+        for tx in txs:
+            for input_ in tx.inputs:
+                utxo: UTXO = UTXO(input_.prev_tx_hash, input_.output_index)
+                if created.pop(utxo, None) is None:
+                    spent.add(utxo)
+            for index, output in enumerate(tx.outputs):
+                created[UTXO(tx.hash, index)] = output
+        return (
+            layer.spent == spent
+            and layer.pool.keys() == created.keys()
+            and all(layer.pool[utxo] is output for utxo, output in created.items())
+        )
+
+    @staticmethod
+    def _layer_delta(layer: UTXOPool) -> tuple[list[UTXOEntry], list[UTXOEntry]]:
+        """
+        Renvoie les UTXOs créés par la couche <layer> et ceux de sa couche parente
+        qu'elle dépense ou remplace, avec leurs sorties.
+        """
+        assert layer.parent is not None
+        parent: UTXOPool = layer.parent
+        created: list[UTXOEntry] = list(layer.pool.items())
+        spent: list[UTXOEntry] = [
+            (utxo, parent.get_tx_output(utxo)) for utxo in layer.spent
+        ]
+        spent.extend(
+            (utxo, parent.get_tx_output(utxo))
+            for utxo in layer.pool
+            if utxo not in layer.spent and utxo in parent
+        )
+        return created, spent
+
+    def _restore_utxo_pool(self, node: Blockchain.BlockNode) -> UTXOPool:
+        """Reconstruit le pool UTXO de <node> à partir de celui du bloc de hauteur
+        maximale et des deltas enregistrés des blocs qui les séparent."""
+        assert self.store is not None
+        disconnected, connected = self.get_fork_path(self.max_height_node, node)
+        utxo_pool: UTXOPool = UTXOPool(self.get_max_height_utxo_pool())
+        for current in disconnected:
+            created, spent = self.store.get_delta(current.hash)
+            for utxo, _ in created:
+                utxo_pool.remove_utxo(utxo)
+            for utxo, output in spent:
+                utxo_pool.add_utxo(utxo, output)
+        for current in connected:
+            created, spent = self.store.get_delta(current.hash)
+            for utxo, _ in spent:
+                utxo_pool.remove_utxo(utxo)
+            for utxo, output in created:
+                utxo_pool.add_utxo(utxo, output)
+        return utxo_pool
+
+    def prune(self, prune_forks: bool = True) -> dict[str, int]:
+        """
+        Élague les noeuds qui ne pourront plus jamais être le parent d'un bloc
+        acceptable, c'est-à-dire ceux de hauteur < max_height - CUT_OFF_AGE.
+
+        Leur pool UTXO est abandonné ; le noeud garde son hash, et son bloc s'il ne
+        peut pas être relu depuis le stockage. Les pools des noeuds de hauteur
+        max_height - CUT_OFF_AGE deviennent des instantanés complets, pour que les
+        couches au-dessus ne retiennent plus les pools abandonnés. Si <prune_forks>
+        est True, les branches abandonnées dont aucun noeud n'atteint cette hauteur
+        sont retirées de la chaîne. Seules les hauteurs passées sous l'horizon depuis le dernier
+        appel sont parcourues.
+
+        Returns:
+            dict: Nombre de pools abandonnés ("pools_dropped") et de noeuds
+            retirés ("nodes_removed").
+        """
+        horizon: int = self.max_height_node.height - self.CUT_OFF_AGE
+        report: dict[str, int] = {"pools_dropped": 0, "nodes_removed": 0}
+        if horizon <= self.pruned_height:
+            return report
+
+        for height in range(self.pruned_height, horizon):
+            main_node: Blockchain.BlockNode | None = self.max_height_node.get_ancestor(
+                height
+            )
+            for node in self.heights.pop(height, []):
+                if node.hash.hex() not in self.blockchain:
+                    continue  # déjà retiré avec sa branche
+                if node.utxo_pool is not None:
+                    node.utxo_pool = None
+                    report["pools_dropped"] += 1
+                node.unload()
+                if (
+                    prune_forks
+                    and node is not main_node
+                    and not self._reaches_height(node, horizon)
+                ):
+                    parent: Blockchain.BlockNode | None = node.parent
+                    report["nodes_removed"] += self._remove_branch(node)
+                    report["nodes_removed"] += self._remove_abandoned_ancestors(parent)
+
+        # Le pool parent abandonné, s'il n'est partagé par aucun autre noeud gardé,
+        # est repris par son enfant plutôt que copié
+        retained: list[UTXOPool] = [
+            node.utxo_pool
+            for node in self.heights.get(horizon, [])
+            if node.utxo_pool is not None
+        ]
+        parents: Counter[int] = Counter(id(pool.parent) for pool in retained)
+        for pool in retained:
+            pool.detach(reuse_parent=parents[id(pool.parent)] == 1)
+
+        self.pruned_height = horizon
+        return report
+
+    @staticmethod
+    def _reaches_height(node: Blockchain.BlockNode, height: int) -> bool:
+        """Renvoie True si <node> ou l'un de ses descendants est de hauteur >= <height>."""
+        stack: list[Blockchain.BlockNode] = [node]
+        while stack:
+            current: Blockchain.BlockNode = stack.pop()
+            if current.height >= height:
+                return True
+            stack.extend(current.children)
+        return False
+
+    def _remove_abandoned_ancestors(self, node: Blockchain.BlockNode | None) -> int:
+        """
+        Retire <node> et ses ancêtres tant qu'ils n'ont plus d'enfant et ne sont
+        pas sur la branche principale ; renvoie leur nombre. Ces noeuds, passés
+        sous l'horizon quand leur branche l'atteignait encore, ne seraient plus
+        jamais parcourus par prune.
+        """
+        removed: int = 0
+        while (
+            node is not None
+            and not node.children
+            and self.max_height_node.get_ancestor(node.height) is not node
+        ):
+            parent: Blockchain.BlockNode | None = node.parent
+            removed += self._remove_branch(node)
+            node = parent
+        return removed
+
+    def _remove_branch(self, node: Blockchain.BlockNode) -> int:
+        """Retire <node> et ses descendants de la chaîne ; renvoie leur nombre."""
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        removed: int = 0
+        stack: list[Blockchain.BlockNode] = [node]
+        while stack:
+            current: Blockchain.BlockNode = stack.pop()
+            del self.blockchain[current.hash.hex()]
+            current.utxo_pool = None
+            if self.history is not None:
+                self.history.remove_block(current.hash)
+            removed += 1
+            stack.extend(current.children)
+        return removed
+
+    def memory_usage(self) -> dict[str, int]:
+        """
+        Renvoie des mesures de la mémoire occupée par la chaîne : nombre de noeuds,
+        de noeuds ayant encore un pool UTXO, de couches UTXO distinctes, d'entrées
+        dans ces couches et taille approximative en octets de leurs conteneurs.
+        """
+        layers: dict[int, UTXOPool] = {}
+        pools: int = 0
+        for node in self.blockchain.values():
+            layer: UTXOPool | None = node.utxo_pool
+            pools += layer is not None
+            while layer is not None and id(layer) not in layers:
+                layers[id(layer)] = layer
+                layer = layer.parent
+
+        return {
+            "block_nodes": len(self.blockchain),
+            "utxo_pools": pools,
+            "utxo_layers": len(layers),
+            "utxo_entries": sum(len(l.pool) + len(l.spent) for l in layers.values()),
+            "utxo_bytes": sum(
+                sys.getsizeof(l.pool)
+                + sys.getsizeof(l.spent)
+                + sys.getsizeof(l.by_address)
+                + sum(sys.getsizeof(utxos) for utxos in l.by_address.values())
+                + sys.getsizeof(l.balances)
+                for l in layers.values()
+            ),
+        }
+
+    def is_on_main_chain(self, height: int, block_hash: bytes) -> bool:
+        """Renvoie True si le bloc <block_hash>, de hauteur <height>, est un ancêtre
+        du bloc de hauteur maximale (ou ce bloc lui-même)."""
+        node: Blockchain.BlockNode | None = self.max_height_node.get_ancestor(height)
+        return node is not None and node.hash == block_hash
+
+    def find_transaction(self, tx_hash: bytes) -> tuple[bytes, int] | None:
+        """
+        Renvoie (hash du bloc, position) de la transaction <tx_hash> dans la
+        branche principale, None si elle n'y est pas. La position est 0 pour la
+        coinbase et i + 1 pour block.transactions[i].
+        """
+        if self.history is None:
+            raise ValueError("Index d'historique désactivé!")
+        location: Location | None = self.history.find_transaction(
+            tx_hash, self.is_on_main_chain
+        )
+        return None if location is None else (location[2], location[1])
+
+    def get_address_history(
+        self, address: PublicKey, limit: int = 50, before: Cursor | None = None
+    ) -> tuple[list[HistoryEntry], Cursor | None]:
+        """
+        Renvoie une page d'au plus <limit> transactions de la branche principale
+        qui concernent <address>, de la plus récente à la plus ancienne, et le
+        curseur à passer en <before> pour la page suivante (None à la fin). Voir
+        HistoryIndex.get_history.
+        """
+        if self.history is None:
+            raise ValueError("Index d'historique désactivé!")
+        return self.history.get_history(
+            address.to_string(), self.is_on_main_chain, limit, before
+        )
+
+    @staticmethod
+    def get_common_ancestor(
+        a: Blockchain.BlockNode, b: Blockchain.BlockNode
+    ) -> Blockchain.BlockNode | None:
+        """
+        Renvoie le plus haut ancêtre commun de <a> et <b> (un noeud est son propre
+        ancêtre), None s'ils ne sont pas dans le même arbre. Recherche dichotomique
+        sur la hauteur avec get_ancestor : O(log² n).
+        """
+        low: int = 1
+        high: int = min(a.height, b.height)
+        if a.get_ancestor(high) is b.get_ancestor(high):
+            return a.get_ancestor(high)
+        if a.get_ancestor(low) is not b.get_ancestor(low):
+            return None
+        # L'ancêtre commun est à une hauteur de [low, high[
+        while high - low > 1:
+            middle: int = (low + high) // 2
+            if a.get_ancestor(middle) is b.get_ancestor(middle):
+                low = middle
+            else:
+                high = middle
+        return a.get_ancestor(low)
+
+    @staticmethod
+    def get_fork_path(
+        old_tip: Blockchain.BlockNode, new_tip: Blockchain.BlockNode
+    ) -> tuple[list[Blockchain.BlockNode], list[Blockchain.BlockNode]]:
+        """
+        Renvoie les noeuds à déconnecter (de <old_tip> vers l'ancêtre commun) et
+        les noeuds à connecter (de l'ancêtre commun vers <new_tip>) pour passer de
+        <old_tip> à <new_tip>, l'ancêtre commun étant exclu des deux listes.
+        """
+        ancestor: Blockchain.BlockNode | None = Blockchain.get_common_ancestor(
+            old_tip, new_tip
+        )
+        assert ancestor is not None, "Noeuds sans ancêtre commun!"
+        disconnected: list[Blockchain.BlockNode] = []
+        connected: list[Blockchain.BlockNode] = []
+        node: Blockchain.BlockNode | None = old_tip
+        while node is not ancestor:
+            assert node is not None
+            disconnected.append(node)
+            node = node.parent
+        node = new_tip
+        while node is not ancestor:
+            assert node is not None
+            connected.append(node)
+            node = node.parent
+        connected.reverse()
+        return disconnected, connected
+
+    def reorganize_tx_pool(
+        self, old_tip: Blockchain.BlockNode, new_tip: Blockchain.BlockNode
+    ) -> None:
+        """
+        Met à jour le memory pool quand le bloc de hauteur maximale passe de
+        <old_tip> à <new_tip> : retire les transactions confirmées par les blocs
+        connectés et celles qui entrent en conflit avec eux, remet dans le pool
+        les transactions des blocs déconnectés qui sont encore valides, puis
+        soumet les orphelines qui attendaient une transaction confirmée. Le coût
+        est proportionnel à la taille de la réorganisation, pas à celle du pool.
+        """
+        disconnected, connected = self.get_fork_path(old_tip, new_tip)
+        if self.store is None:
+            for node in disconnected:
+                for tx in [node.block.coinbase] + node.block.transactions:
+                    self._confirmed[tx.hash] -= 1
+                    if not self._confirmed[tx.hash]:
+                        del self._confirmed[tx.hash]
+            for node in connected:
+                for tx in [node.block.coinbase] + node.block.transactions:
+                    self._confirmed[tx.hash] = self._confirmed.get(tx.hash, 0) + 1
+
+        confirmed: set[bytes] = set()
+        for node in connected:
+            for tx in node.block.transactions:
+                confirmed.add(tx.hash)
+                if tx.hash in self.tx_pool.pool:
+                    self.tx_pool.remove_transaction(tx.hash)
+            for tx in node.block.transactions:
+                for input_ in tx.inputs:
+                    spender: bytes | None = self.tx_pool.spenders.get(
+                        UTXO(input_.prev_tx_hash, input_.output_index)
+                    )
+                    if spender is not None:
+                        self.tx_pool.remove_with_descendants(spender)
+
+        # Du plus ancien au plus récent, pour que les parents précèdent les enfants
+        for node in reversed(disconnected):
+            for tx in node.block.transactions:
+                if tx.hash not in confirmed:
+                    self.add_transaction(tx)
+            abandoned: list[Transaction] = [node.block.coinbase] + [
+                tx for tx in node.block.transactions if tx.hash not in confirmed
+            ]
+            # Les transactions du pool qui dépensent une sortie disparue sont retirées
+            utxo_pool: UTXOPool = self.get_max_height_utxo_pool()
+            for tx in abandoned:
+                if tx.hash in self.tx_pool.pool:
+                    continue
+                for i in range(tx.num_outputs()):
+                    utxo: UTXO = UTXO(tx.hash, i)
+                    spender = self.tx_pool.spenders.get(utxo)
+                    if spender is not None and utxo not in utxo_pool:
+                        self.tx_pool.remove_with_descendants(spender)
+
+        for node in connected:
+            for tx in [node.block.coinbase] + node.block.transactions:
+                self._promote_orphans(tx.hash)
+
     @staticmethod
     def add_coinbase_to_utxo_pool(block: Block, utxo_pool: UTXOPool) -> None:
         coinbase: Transaction = block.coinbase
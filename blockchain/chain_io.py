@@ -0,0 +1,304 @@
+"""
+Export et import en flux de la branche principale d'une chaîne, dans un fichier
+compact.
+
+Fichier : MAGIC, version (u8), puis un enregistrement par bloc, de la genèse au
+sommet :
+    longueur du bloc (u32), bloc encodé par codec.encode_block,
+    nombre d'adresses (u32), adresse brute (64 octets) de la sortie dépensée par
+    chaque entrée des transactions du bloc (coinbase exclue), dans l'ordre.
+
+Les adresses dépensées permettent de vérifier les signatures d'un bloc sans
+connaître le pool UTXO de son parent. L'import est un pipeline : un fil lit les
+enregistrements, l'exécuteur recalcule les hashs de chaque bloc et vérifie ses
+signatures, et les blocs sont ajoutés dans l'ordre avec add_block. Les signatures
+valides sont ajoutées au cache de signatures de la chaîne, que add_block consulte ;
+une adresse fausse dans le fichier ne donne qu'une clé de cache qui ne sert
+jamais, et la signature est alors revérifiée par add_block. Les files entre les
+étapes sont bornées : la mémoire ne dépend pas de la longueur de la chaîne.
+
+    export_chain(blockchain, "chain.iftc")
+
+    blockchain = Blockchain(read_genesis("chain.iftc"))
+    with ProcessPoolExecutor() as executor:
+        report = import_chain(blockchain, "chain.iftc", executor)
+
+Usage : python -m blockchain.chain_io export STOCKAGE FICHIER
+        python -m blockchain.chain_io import FICHIER STOCKAGE [--workers N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import struct
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from queue import Full, Queue
+from typing import BinaryIO, Generator, Iterator
+
+from blockchain import codec, crypto
+from blockchain.block import Block
+from blockchain.blockchain import Blockchain
+from blockchain.crypto import SignatureKey
+from blockchain.storage import BlockStore
+from blockchain.utxo import UTXO
+
+MAGIC: bytes = b"IFTCHAIN"
+VERSION: int = 1
+FILE_HEADER = struct.Struct(">8sB")
+COUNT = struct.Struct(">I")
+
+# Enregistrement d'un bloc : (bloc encodé, adresses brutes des sorties dépensées)
+Record = tuple[bytes, bytes]
+
+
+def export_chain(blockchain: Blockchain, path: str | os.PathLike[str]) -> int:
+    """
+    Écrit dans le fichier <path> la branche principale de <blockchain>, de la
+    genèse au sommet. Les blocs élagués sont relus depuis le stockage un à un ;
+    la mémoire utilisée est celle de l'adresse de chaque sortie non dépensée.
+
+    Returns:
+        int: Nombre de blocs écrits, genèse comprise.
+    """
+    tip: Blockchain.BlockNode = blockchain.max_height_node
+    # Adresse brute de chaque sortie non encore dépensée de la branche
+    addresses: dict[UTXO, bytes] = {}
+    with open(path, "wb") as f:
+        f.write(FILE_HEADER.pack(MAGIC, VERSION))
+        for height in range(1, tip.height + 1):
+            node: Blockchain.BlockNode | None = tip.get_ancestor(height)
+            assert node is not None
+            block: Block = node.block
+            if height < blockchain.pruned_height:
+                node.unload()
+
+            spent: list[bytes] = []
+            for tx in block.transactions + [block.coinbase]:
+                if not tx.is_coinbase():
+                    for input_ in tx.inputs:
+                        utxo: UTXO = UTXO(input_.prev_tx_hash, input_.output_index)
+                        spent.append(addresses.pop(utxo))
+                for index, output in enumerate(tx.outputs):
+                    addresses[UTXO(tx.hash, index)] = output.get_raw_address()
+
+            data: bytes = codec.encode_block(block)
+            f.write(COUNT.pack(len(data)))
+            f.write(data)
+            f.write(COUNT.pack(len(spent)))
+            f.write(b"".join(spent))
+    return tip.height
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data: bytes = f.read(size)
+    if len(data) != size:
+        raise ValueError("Fichier tronqué!")
+    return data
+
+
+def read_records(path: str | os.PathLike[str]) -> Iterator[Record]:
+    """Renvoie les enregistrements du fichier <path>, dans l'ordre des hauteurs.
+    Lève ValueError si le fichier n'est pas un export ou est tronqué."""
+    with open(path, "rb") as f:
+        magic, version = FILE_HEADER.unpack(_read_exact(f, FILE_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Format de fichier inconnu!")
+        while True:
+            prefix: bytes = f.read(COUNT.size)
+            if not prefix:
+                return
+            if len(prefix) != COUNT.size:
+                raise ValueError("Fichier tronqué!")
+            data: bytes = _read_exact(f, COUNT.unpack(prefix)[0])
+            (count,) = COUNT.unpack(_read_exact(f, COUNT.size))
+            yield data, _read_exact(f, count * codec.ADDRESS_SIZE)
+
+
+def read_genesis(path: str | os.PathLike[str]) -> Block:
+    """Renvoie le bloc de genèse du fichier <path>, pour créer la chaîne où
+    l'importer."""
+    for data, _ in read_records(path):
+        block: Block = codec.decode_block(data, verify=True)
+        if block.prev_block_hash is not None:
+            raise ValueError("Le fichier ne commence pas par une genèse!")
+        return block
+    raise ValueError("Fichier vide!")
+
+
+def _prefetch(records: Iterator[Record], size: int) -> Generator[Record, None, None]:
+    """
+    Lit <records> dans un fil séparé, au plus <size> enregistrements d'avance.
+    Une exception du lecteur est relevée à la place de l'enregistrement suivant ;
+    le lecteur s'arrête quand le générateur renvoyé est fermé.
+    """
+    queue: Queue[Record | BaseException | None] = Queue(size)
+    stop: threading.Event = threading.Event()
+
+    def put(item: Record | BaseException | None) -> None:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def read() -> None:
+        try:
+            for record in records:
+                put(record)
+                if stop.is_set():
+                    return
+        except BaseException as error:
+            put(error)
+        else:
+            put(None)
+
+    reader: threading.Thread = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            item: Record | BaseException | None = queue.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Un lecteur qui attend une place dans la file s'arrête au plus tard
+        # après le délai de put
+        stop.set()
+        reader.join()
+
+
+def _verify_record(data: bytes, addresses: bytes, backend: str) -> list[SignatureKey]:
+    """
+    Exécuté dans l'exécuteur : recalcule les hashs du bloc <data> (ValueError
+    s'ils ne correspondent pas) et renvoie les clés de cache des signatures
+    valides de ses entrées pour les adresses dépensées <addresses>.
+    """
+    if backend != crypto.get_backend().name:
+        crypto.set_backend(backend)
+    block: Block = codec.decode_block(data, verify=True)
+    keys: list[SignatureKey] = []
+    position: int = 0
+    for tx in block.transactions:
+        for index, input_ in enumerate(tx.inputs):
+            raw_address: bytes = addresses[position : position + codec.ADDRESS_SIZE]
+            position += codec.ADDRESS_SIZE
+            if len(raw_address) != codec.ADDRESS_SIZE:
+                raise ValueError("Adresses dépensées incomplètes!")
+            message: bytes = tx.get_raw_data_to_sign(index)
+            if crypto.verify_signature(raw_address, message, input_.signature):
+                keys.append(
+                    crypto.signature_key(raw_address, message, input_.signature)
+                )
+    return keys
+
+
+def import_chain(
+    blockchain: Blockchain,
+    path: str | os.PathLike[str],
+    executor: Executor | None = None,
+    window: int = 64,
+) -> dict[str, int]:
+    """
+    Ajoute à <blockchain> les blocs du fichier <path>, dans l'ordre, avec
+    add_block ; les blocs déjà connus (la genèse) sont ignorés.
+
+    Si <executor> n'est pas None, les hashs et les signatures de <window> blocs
+    au plus sont vérifiés d'avance dans <executor> (un ProcessPoolExecutor pour
+    utiliser tous les coeurs) pendant que les blocs précédents sont ajoutés.
+    Sinon, tout est vérifié par add_block.
+
+    Returns:
+        dict: Nombre de blocs ajoutés ("blocks"), de blocs déjà connus ("known")
+        et de blocs refusés ("failed", 0 ou 1 : l'import s'arrête au premier).
+
+    Raises:
+        ValueError: Si le fichier n'est pas un export valide.
+    """
+    report: dict[str, int] = {"blocks": 0, "known": 0, "failed": 0}
+    backend: str = crypto.get_backend().name
+    pending: deque[tuple[bytes, Future[list[SignatureKey]] | None]] = deque()
+
+    def apply(data: bytes, verified: Future[list[SignatureKey]] | None) -> bool:
+        if verified is None:
+            block: Block = codec.decode_block(data, verify=True)
+        else:
+            # Hashs déjà recalculés par l'exécuteur sur les mêmes octets
+            for key in verified.result():
+                blockchain.signature_cache.add(key)
+            block = codec.decode_block(data)
+        if blockchain.add_block(block):
+            report["blocks"] += 1
+            return True
+        report["failed"] = 1
+        return False
+
+    records: Generator[Record, None, None] = _prefetch(read_records(path), window)
+    try:
+        for data, addresses in records:
+            _, block_hash = codec.BLOCK_HEADER.unpack_from(data)
+            if block_hash.hex() in blockchain.blockchain:
+                report["known"] += 1
+                continue
+            if executor is None:
+                if not apply(data, None):
+                    return report
+                continue
+
+            pending.append(
+                (data, executor.submit(_verify_record, data, addresses, backend))
+            )
+            if len(pending) >= window and not apply(*pending.popleft()):
+                return report
+        while pending:
+            if not apply(*pending.popleft()):
+                return report
+    finally:
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+        records.close()
+    return report
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Export et import de la branche principale d'une chaîne."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser: argparse.ArgumentParser = commands.add_parser("export")
+    export_parser.add_argument("store", help="répertoire du stockage de la chaîne")
+    export_parser.add_argument("file")
+    import_parser: argparse.ArgumentParser = commands.add_parser("import")
+    import_parser.add_argument("file")
+    import_parser.add_argument("store", help="répertoire d'un stockage vide")
+    import_parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processus de vérification des signatures",
+    )
+    options: argparse.Namespace = parser.parse_args(argv)
+
+    if options.command == "export":
+        with BlockStore(options.store) as store:
+            count: int = export_chain(Blockchain.open(store), options.file)
+        print(f"{count} blocs exportés")
+        return
+
+    with BlockStore(options.store, synchronous=False) as store:
+        blockchain: Blockchain = Blockchain(read_genesis(options.file), store=store)
+        with ProcessPoolExecutor(max_workers=options.workers) as executor:
+            report: dict[str, int] = import_chain(blockchain, options.file, executor)
+    print(f"{report['blocks']} blocs importés, {report['failed']} refusé(s)")
+    if report["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
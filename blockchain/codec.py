@@ -0,0 +1,350 @@
+"""
+Encodage binaire compact des transactions et des blocs, pour le stockage.
+
+Contrairement à Transaction.to_bytes et Block.to_bytes (qui servent au calcul des
+hashs), ces encodages peuvent être décodés : chaque champ de taille variable est
+préfixé de sa longueur, et un bloc commence par une table des positions de ses
+transactions pour permettre de lire une transaction sans décoder les autres.
+
+Transaction :
+    flags (u8, bit 0 : coinbase), hash (32 octets),
+    nombre d'entrées (u32), nombre de sorties (u32),
+    pour chaque entrée : longueur du hash précédent (u8), hash précédent,
+        index de sortie (u32), longueur de la signature (u16), signature,
+    pour chaque sortie : valeur (f64), adresse brute (64 octets).
+
+Bloc :
+    flags (u8, bit 0 : a un bloc précédent, bit 1 : format Merkle, bit 2 : preuve
+    de travail), hash (32 octets), hash du bloc précédent (32 octets, si bit 0),
+    horodatage (u64), cible (32 octets) et nonce (u64) si bit 2,
+    nombre de transactions (u32),
+    table des positions (u32 par transaction, coinbase comprise, relatives au début
+    de l'encodage du bloc), puis les transactions, la coinbase en premier.
+
+TransactionView et BlockView lisent ces encodages sur place, sans construire
+d'objets Transaction ou Block.
+"""
+
+from __future__ import annotations
+
+import struct
+
+from blockchain.block import Block
+from blockchain.transaction import Transaction
+
+HASH_SIZE: int = 32
+ADDRESS_SIZE: int = 64
+
+TX_HEADER = struct.Struct(">B32sII")
+INPUT_INDEX = struct.Struct(">I")
+# Index de sortie maximal : Transaction.to_bytes l'encode sur 2 octets
+MAX_OUTPUT_INDEX: int = 0xFFFF
+SIGNATURE_SIZE = struct.Struct(">H")
+OUTPUT = struct.Struct(">d64s")
+OUTPUT_VALUE = struct.Struct(">d")
+BLOCK_HEADER = struct.Struct(">B32s")
+COUNT = struct.Struct(">I")
+WORK_DATA = struct.Struct(">Q32sQ")
+
+TX_COINBASE: int = 0x01
+BLOCK_HAS_PREV: int = 0x01
+BLOCK_MERKLE: int = 0x02
+BLOCK_WORK: int = 0x04
+
+
+def encode_transaction(tx: Transaction) -> bytes:
+    """Renvoie l'encodage de <tx>, qui doit avoir un hash."""
+    assert tx.hash is not None, "Transaction sans hash!"
+    parts: list[bytes] = [
+        TX_HEADER.pack(
+            TX_COINBASE if tx.is_coinbase() else 0,
+            tx.hash,
+            tx.num_inputs(),
+            tx.num_outputs(),
+        )
+    ]
+    for input_ in tx.inputs:
+        prev_tx_hash: bytes = input_.prev_tx_hash or b""
+        signature: bytes = input_.signature or b""
+        parts.append(bytes((len(prev_tx_hash),)))
+        parts.append(prev_tx_hash)
+        parts.append(INPUT_INDEX.pack(input_.output_index))
+        parts.append(SIGNATURE_SIZE.pack(len(signature)))
+        parts.append(signature)
+    for output in tx.outputs:
+        parts.append(OUTPUT.pack(output.value, output.get_raw_address()))
+    return b"".join(parts)
+
+
+def decode_output(value: float, raw_address: bytes) -> Transaction.Output:
+    """Renvoie la sortie de valeur <value> et d'adresse brute <raw_address> ; la
+    clé publique n'est décodée qu'au premier accès à son adresse."""
+    return Transaction.Output(value, bytes(raw_address))
+
+
+def decode_transaction(
+    data: bytes | memoryview, offset: int = 0, verify: bool = False
+) -> tuple[Transaction, int]:
+    """Décode la transaction qui commence à <offset> dans <data> ; renvoie la
+    transaction et la position qui suit son encodage.
+
+    Si <verify> est True (données reçues d'un pair), le hash est recalculé et
+    ValueError est levée s'il ne correspond pas au hash encodé. ValueError est
+    aussi levée si une entrée n'a pas de signature ou un index de sortie qui ne
+    tient pas sur 2 octets."""
+    flags, tx_hash, num_inputs, num_outputs = TX_HEADER.unpack_from(data, offset)
+    offset += TX_HEADER.size
+
+    tx: Transaction = Transaction()
+    tx.coinbase = bool(flags & TX_COINBASE)
+    for _ in range(num_inputs):
+        hash_size: int = data[offset]
+        offset += 1
+        prev_tx_hash: bytes = bytes(data[offset : offset + hash_size])
+        offset += hash_size
+        (output_index,) = INPUT_INDEX.unpack_from(data, offset)
+        offset += INPUT_INDEX.size
+        (signature_size,) = SIGNATURE_SIZE.unpack_from(data, offset)
+        offset += SIGNATURE_SIZE.size
+        signature: bytes = bytes(data[offset : offset + signature_size])
+        offset += signature_size
+
+        if not signature:
+            raise ValueError("Entrée sans signature!")
+        if output_index > MAX_OUTPUT_INDEX:
+            raise ValueError(f"Index de sortie {output_index} invalide!")
+
+        input_: Transaction.Input = Transaction.Input(prev_tx_hash, output_index)
+        input_.add_signature(signature)
+        tx.inputs.append(input_)
+    for _ in range(num_outputs):
+        value, raw_address = OUTPUT.unpack_from(data, offset)
+        offset += OUTPUT.size
+        tx.outputs.append(decode_output(value, raw_address))
+
+    tx.hash = bytes(tx_hash)
+    if verify:
+        tx.generate_hash()
+        if tx.hash != tx_hash:
+            raise ValueError("Hash de transaction invalide!")
+    return tx, offset
+
+
+def encode_block(block: Block) -> bytes:
+    """Renvoie l'encodage de <block>, qui doit être finalisé."""
+    assert block.hash is not None, "Bloc non finalisé!"
+    flags: int = 0
+    header: list[bytes] = []
+    if block.prev_block_hash is not None:
+        flags |= BLOCK_HAS_PREV
+        header.append(block.prev_block_hash)
+    if block.merkle_tree is not None:
+        flags |= BLOCK_MERKLE
+    if block.target is not None:
+        flags |= BLOCK_WORK
+        header.append(block.get_work_data())
+    header.insert(0, BLOCK_HEADER.pack(flags, block.hash))
+
+    txs: list[bytes] = [encode_transaction(block.coinbase)] + [
+        encode_transaction(tx) for tx in block.transactions
+    ]
+    header.append(COUNT.pack(len(txs)))
+
+    position: int = sum(len(part) for part in header) + COUNT.size * len(txs)
+    offsets: list[bytes] = []
+    for tx_data in txs:
+        offsets.append(COUNT.pack(position))
+        position += len(tx_data)
+
+    return b"".join(header + offsets + txs)
+
+
+def decode_block(data: bytes | memoryview, verify: bool = False) -> Block:
+    """
+    Décode un bloc encodé par encode_block.
+
+    Si <verify> est True, les hashs du bloc et de ses transactions sont recalculés
+    et ValueError est levée si l'un d'eux ne correspond pas à l'encodage.
+    """
+    flags, block_hash = BLOCK_HEADER.unpack_from(data, 0)
+    offset: int = BLOCK_HEADER.size
+    prev_block_hash: bytes | None = None
+    if flags & BLOCK_HAS_PREV:
+        prev_block_hash = bytes(data[offset : offset + HASH_SIZE])
+        offset += HASH_SIZE
+    target: int | None = None
+    timestamp: int = 0
+    nonce: int = 0
+    if flags & BLOCK_WORK:
+        timestamp, raw_target, nonce = WORK_DATA.unpack_from(data, offset)
+        target = int.from_bytes(raw_target, "big")
+        offset += WORK_DATA.size
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size + COUNT.size * count
+
+    if count == 0:
+        raise ValueError("Bloc sans coinbase!")
+    txs: list[Transaction] = []
+    for _ in range(count):
+        tx, offset = decode_transaction(data, offset, verify)
+        txs.append(tx)
+
+    block: Block = Block.restore(
+        prev_block_hash,
+        txs[0],
+        txs[1:],
+        bytes(block_hash),
+        merkle=bool(flags & BLOCK_MERKLE),
+        target=target,
+        timestamp=timestamp,
+        nonce=nonce,
+    )
+    if verify:
+        block.finalize()
+        if block.hash != block_hash:
+            raise ValueError("Hash de bloc invalide!")
+    return block
+
+
+class TransactionView:
+    """
+    Vue en lecture seule sur une transaction encodée, sans la décoder : les champs
+    sont lus à la demande dans <data> (typiquement un memoryview sur un fichier de
+    blocs projeté en mémoire). Les hashs, adresses et signatures renvoyés sont des
+    memoryview sur <data>, à copier avec bytes() pour les conserver.
+    """
+
+    __slots__ = ("data", "offset", "_num_inputs", "_num_outputs", "_input_offsets")
+
+    def __init__(self, data: memoryview, offset: int = 0):
+        self.data: memoryview = data
+        self.offset: int = offset
+        _, _, self._num_inputs, self._num_outputs = TX_HEADER.unpack_from(data, offset)
+        # Position de chaque entrée, puis de la première sortie ; calculées au
+        # premier accès à une entrée ou à une sortie
+        self._input_offsets: list[int] | None = None
+
+    @property
+    def hash(self) -> bytes:
+        return bytes(self.data[self.offset + 1 : self.offset + 1 + HASH_SIZE])
+
+    def is_coinbase(self) -> bool:
+        return bool(self.data[self.offset] & TX_COINBASE)
+
+    def num_inputs(self) -> int:
+        return self._num_inputs
+
+    def num_outputs(self) -> int:
+        return self._num_outputs
+
+    def _get_input_offsets(self) -> list[int]:
+        if self._input_offsets is None:
+            offsets: list[int] = []
+            offset: int = self.offset + TX_HEADER.size
+            for _ in range(self._num_inputs):
+                offsets.append(offset)
+                offset += 1 + self.data[offset] + INPUT_INDEX.size
+                (signature_size,) = SIGNATURE_SIZE.unpack_from(self.data, offset)
+                offset += SIGNATURE_SIZE.size + signature_size
+            offsets.append(offset)
+            self._input_offsets = offsets
+        return self._input_offsets
+
+    def get_input(self, index: int) -> tuple[memoryview, int, memoryview]:
+        """Renvoie (hash de la transaction précédente, index de sortie, signature)
+        de l'entrée <index>."""
+        if not 0 <= index < self._num_inputs:
+            raise ValueError(f"Index {index} invalide!")
+        offset: int = self._get_input_offsets()[index]
+        hash_size: int = self.data[offset]
+        offset += 1
+        prev_tx_hash: memoryview = self.data[offset : offset + hash_size]
+        offset += hash_size
+        (output_index,) = INPUT_INDEX.unpack_from(self.data, offset)
+        offset += INPUT_INDEX.size
+        (signature_size,) = SIGNATURE_SIZE.unpack_from(self.data, offset)
+        offset += SIGNATURE_SIZE.size
+        return prev_tx_hash, output_index, self.data[offset : offset + signature_size]
+
+    def get_output(self, index: int) -> tuple[float, memoryview]:
+        """Renvoie (valeur, adresse brute) de la sortie <index>."""
+        if not 0 <= index < self._num_outputs:
+            raise ValueError(f"Index {index} invalide!")
+        offset: int = self._get_input_offsets()[-1] + index * OUTPUT.size
+        (value,) = OUTPUT_VALUE.unpack_from(self.data, offset)
+        return value, self.data[offset + OUTPUT_VALUE.size : offset + OUTPUT.size]
+
+    def __len__(self) -> int:
+        """Taille de l'encodage de la transaction, en octets."""
+        return (
+            self._get_input_offsets()[-1]
+            + self._num_outputs * OUTPUT.size
+            - self.offset
+        )
+
+    def to_transaction(self) -> Transaction:
+        """Décode la transaction complète."""
+        return decode_transaction(self.data, self.offset)[0]
+
+
+class BlockView:
+    """
+    Vue en lecture seule sur un bloc encodé par encode_block. Les transactions sont
+    accessibles en O(1) par leur index grâce à la table des positions, sous forme
+    de TransactionView.
+    """
+
+    __slots__ = ("data", "_count", "_table")
+
+    def __init__(self, data: memoryview):
+        self.data: memoryview = data
+        offset: int = BLOCK_HEADER.size
+        if data[0] & BLOCK_HAS_PREV:
+            offset += HASH_SIZE
+        if data[0] & BLOCK_WORK:
+            offset += WORK_DATA.size
+        (self._count,) = COUNT.unpack_from(data, offset)
+        # Position de la table des positions des transactions
+        self._table: int = offset + COUNT.size
+
+    @property
+    def hash(self) -> bytes:
+        return bytes(self.data[1 : 1 + HASH_SIZE])
+
+    @property
+    def prev_block_hash(self) -> bytes | None:
+        if not self.data[0] & BLOCK_HAS_PREV:
+            return None
+        return bytes(self.data[BLOCK_HEADER.size : BLOCK_HEADER.size + HASH_SIZE])
+
+    def is_merkle(self) -> bool:
+        return bool(self.data[0] & BLOCK_MERKLE)
+
+    def _transaction_at(self, position: int) -> TransactionView:
+        (offset,) = COUNT.unpack_from(self.data, self._table + COUNT.size * position)
+        return TransactionView(self.data, offset)
+
+    @property
+    def coinbase(self) -> TransactionView:
+        return self._transaction_at(0)
+
+    def num_transactions(self) -> int:
+        """Nombre de transactions du bloc, coinbase exclue."""
+        return self._count - 1
+
+    def get_transaction(self, index: int) -> TransactionView:
+        """Renvoie la transaction du bloc se trouvant à l'index <index> (coinbase exclue)."""
+        if not 0 <= index < self._count - 1:
+            raise ValueError(f"Index {index} invalide!")
+        return self._transaction_at(index + 1)
+
+    def transaction_offsets(self) -> list[int]:
+        """Positions des transactions (coinbase comprise) relatives au début du bloc."""
+        return [
+            COUNT.unpack_from(self.data, self._table + COUNT.size * i)[0]
+            for i in range(self._count)
+        ]
+
+    def to_block(self) -> Block:
+        """Décode le bloc complet."""
+        return decode_block(self.data)
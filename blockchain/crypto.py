@@ -1,4 +1,15 @@
-from ecdsa import SigningKey, SECP256k1, VerifyingKey
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Any, Protocol
+
+from ecdsa import BadSignatureError, SigningKey, SECP256k1, VerifyingKey
+from ecdsa.errors import MalformedPointError
+from ecdsa.util import MalformedSignature
 
 
 # Alias de la classe SigningKey
@@ -11,6 +22,15 @@ class PublicKey(VerifyingKey):
     pass
 
 
+# Vérification de signature à faire : (clé publique, éventuellement sous forme
+# brute de 64 octets, message, signature)
+SignatureCheck = tuple[PublicKey | bytes, bytes, bytes | None]
+
+# Clé d'une signature vérifiée : condensé de la clé publique brute, du message
+# signé et de la signature (voir signature_key)
+SignatureKey = bytes
+
+
 class KeyPairGenerator:
     @classmethod
     def generate_key_pair(cls) -> tuple[PrivateKey, PublicKey]:
@@ -19,5 +39,516 @@ class KeyPairGenerator:
         return sk, pk
 
 
-def verify_signature(pk: PublicKey, message: bytes, signature: bytes) -> bool:
-    return pk.verify(signature, message)
+def decode_public_key(raw: bytes) -> PublicKey:
+    """Renvoie la clé publique dont la forme brute (64 octets) est <raw>."""
+    return PublicKey.from_string(raw, curve=SECP256k1)
+
+
+# ===== Implémentations d'ECDSA =====#
+#
+# Les signatures suivent la sémantique d'ecdsa : condensé SHA-1 du message,
+# signature brute r || s de 64 octets, s haut ou bas indifféremment. Les clés
+# restent des objets ecdsa ; un backend ne sert qu'à signer et vérifier, à partir
+# de la forme brute des clés.
+
+
+class CryptoBackend(Protocol):
+    name: str
+
+    def load_public_key(self, raw: bytes) -> Any:
+        """Renvoie l'objet clé publique du backend pour la clé brute <raw>, None
+        si <raw> n'est pas une clé valide."""
+        ...
+
+    def verify(self, key: Any, message: bytes, signature: bytes) -> bool: ...
+
+    def sign(self, sk: PrivateKey, message: bytes) -> bytes: ...
+
+
+_ORDER: int = SECP256k1.order
+
+
+def _split_signature(signature: bytes) -> tuple[int, int] | None:
+    """Renvoie (r, s) de la signature brute <signature>, None si elle est mal formée."""
+    if len(signature) != 64:
+        return None
+    r: int = int.from_bytes(signature[:32], "big")
+    s: int = int.from_bytes(signature[32:], "big")
+    if not (0 < r < _ORDER and 0 < s < _ORDER):
+        return None
+    return r, s
+
+
+def _join_signature(r: int, s: int) -> bytes:
+    return r.to_bytes(32, "big") + s.to_bytes(32, "big")
+
+
+class EcdsaBackend:
+    """Implémentation Python pure (ecdsa), toujours disponible."""
+
+    name: str = "ecdsa"
+
+    def load_public_key(self, raw: bytes) -> Any:
+        try:
+            return decode_public_key(raw)
+        except (MalformedPointError, AssertionError, ValueError):
+            return None
+
+    def verify(self, key: Any, message: bytes, signature: bytes) -> bool:
+        try:
+            return key.verify(signature, message)
+        except (BadSignatureError, MalformedSignature):
+            return False
+
+    def sign(self, sk: PrivateKey, message: bytes) -> bytes:
+        return sk.sign(message)
+
+
+class CryptographyBackend:
+    """Implémentation OpenSSL, via le paquet cryptography s'il est installé."""
+
+    name: str = "cryptography"
+
+    def __init__(self) -> None:
+        from cryptography.exceptions import InvalidSignature  # type: ignore[import-not-found]
+        from cryptography.hazmat.primitives import hashes  # type: ignore[import-not-found]
+        from cryptography.hazmat.primitives.asymmetric import (  # type: ignore[import-not-found]
+            ec,
+            utils,
+        )
+
+        self._ec = ec
+        self._utils = utils
+        self._invalid = InvalidSignature
+        self._curve = ec.SECP256K1()
+        self._algorithm = ec.ECDSA(hashes.SHA1())
+
+    def load_public_key(self, raw: bytes) -> Any:
+        try:
+            return self._ec.EllipticCurvePublicKey.from_encoded_point(
+                self._curve, b"\x04" + raw
+            )
+        except ValueError:
+            return None
+
+    def verify(self, key: Any, message: bytes, signature: bytes) -> bool:
+        rs: tuple[int, int] | None = _split_signature(signature)
+        if rs is None:
+            return False
+        try:
+            key.verify(self._utils.encode_dss_signature(*rs), message, self._algorithm)
+        except self._invalid:
+            return False
+        return True
+
+    def sign(self, sk: PrivateKey, message: bytes) -> bytes:
+        private_key = self._ec.derive_private_key(
+            int.from_bytes(sk.to_string(), "big"), self._curve
+        )
+        der: bytes = private_key.sign(message, self._algorithm)
+        return _join_signature(*self._utils.decode_dss_signature(der))
+
+
+class CoincurveBackend:
+    """
+    Implémentation libsecp256k1, via le paquet coincurve s'il est installé.
+    libsecp256k1 n'accepte que des signatures à s bas et des condensés de 32
+    octets : s est normalisé avant la vérification, et le condensé SHA-1 est
+    complété par des zéros en tête (même entier, donc même signature). Comme avec
+    ecdsa, les signatures sont aléatoires : de l'entropie est ajoutée au nonce
+    déterministe, sinon signer deux fois la même transaction donnerait le même hash.
+    """
+
+    name: str = "coincurve"
+
+    def __init__(self) -> None:
+        import coincurve  # type: ignore[import-not-found]
+        from coincurve import ecdsa
+        from coincurve.utils import DEFAULT_NONCE  # type: ignore[import-not-found]
+
+        self._coincurve = coincurve
+        self._ecdsa = ecdsa
+        # Fonction de nonce par défaut (RFC 6979), qui accepte de l'entropie en plus
+        self._nonce_function = DEFAULT_NONCE[0]
+
+    @staticmethod
+    def _digest(message: bytes) -> bytes:
+        return bytes(12) + hashlib.sha1(message).digest()
+
+    def load_public_key(self, raw: bytes) -> Any:
+        try:
+            return self._coincurve.PublicKey(b"\x04" + raw)
+        except ValueError:
+            return None
+
+    def verify(self, key: Any, message: bytes, signature: bytes) -> bool:
+        rs: tuple[int, int] | None = _split_signature(signature)
+        if rs is None:
+            return False
+        r, s = rs
+        compact: bytes = _join_signature(r, min(s, _ORDER - s))
+        der: bytes = self._ecdsa.cdata_to_der(self._ecdsa.deserialize_compact(compact))
+        return key.verify(der, self._digest(message), hasher=None)
+
+    def sign(self, sk: PrivateKey, message: bytes) -> bytes:
+        private_key = self._coincurve.PrivateKey(sk.to_string())
+        der: bytes = private_key.sign(
+            self._digest(message),
+            hasher=None,
+            custom_nonce=(self._nonce_function, os.urandom(32)),
+        )
+        return self._ecdsa.serialize_compact(self._ecdsa.der_to_cdata(der))
+
+
+# Backends par ordre de préférence
+BACKENDS: dict[str, type[CryptoBackend]] = {
+    "coincurve": CoincurveBackend,
+    "cryptography": CryptographyBackend,
+    "ecdsa": EcdsaBackend,
+}
+
+
+class PublicKeyCache:
+    """
+    Cache LRU borné des clés publiques décodées par un backend, par forme brute.
+    Le cache peut être partagé par plusieurs threads (exécuteur par défaut de
+    node.Node).
+
+    Attributes:
+        hits (int): Nombre de clés trouvées dans le cache.
+        misses (int): Nombre de clés décodées.
+    """
+
+    MAX_SIZE: int = 10_000
+
+    def __init__(self, backend: CryptoBackend, max_size: int = MAX_SIZE):
+        self.backend: CryptoBackend = backend
+        self.max_size: int = max_size
+        # Clé brute -> clé du backend (None si invalide)
+        self._entries: OrderedDict[bytes, Any] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, raw: bytes) -> Any:
+        """Renvoie la clé du backend pour la clé brute <raw> (None si invalide)."""
+        with self._lock:
+            if raw in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(raw)
+                return self._entries[raw]
+
+            self.misses += 1
+            key: Any = self.backend.load_public_key(raw)
+            self._entries[raw] = key
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return key
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _load_backend(name: str | None) -> CryptoBackend:
+    """Renvoie le backend <name>, ou le premier backend installé si <name> est None."""
+    if name is not None:
+        return BACKENDS[name]()
+    for backend in BACKENDS.values():
+        try:
+            return backend()
+        except ImportError:
+            continue
+    raise ImportError("Aucun backend ECDSA disponible!")
+
+
+_backend: CryptoBackend = _load_backend(os.environ.get("IFTCOIN_CRYPTO_BACKEND"))
+public_keys: PublicKeyCache = PublicKeyCache(_backend)
+
+
+def get_backend() -> CryptoBackend:
+    return _backend
+
+
+def set_backend(name: str | None = None) -> CryptoBackend:
+    """
+    Choisit le backend <name> ("coincurve", "cryptography" ou "ecdsa") pour les
+    signatures et vérifications suivantes, ou le premier installé si <name> est
+    None. Lève ImportError si le backend n'est pas installé.
+    """
+    global _backend, public_keys
+    _backend = _load_backend(name)
+    public_keys = PublicKeyCache(_backend)
+    return _backend
+
+
+def _raw_public_key(pk: PublicKey | bytes) -> bytes:
+    return pk if isinstance(pk, bytes) else pk.to_string()
+
+
+def sign(sk: PrivateKey, message: bytes) -> bytes:
+    """Renvoie la signature brute (64 octets) de <message> par <sk>."""
+    return _backend.sign(sk, message)
+
+
+def verify_signature(
+    pk: PublicKey | bytes, message: bytes, signature: bytes | None
+) -> bool:
+    """Renvoie True si <signature> est une signature de <message> par la clé <pk>,
+    donnée comme objet ou sous forme brute (64 octets)."""
+    if signature is None:
+        return False
+
+    key: Any = public_keys.get(_raw_public_key(pk))
+    if key is None:
+        return False
+    return _backend.verify(key, message, signature)
+
+
+def find_invalid_raw(
+    checks: list[tuple[bytes, bytes, bytes | None]], backend: str | None = None
+) -> int:
+    """
+    Renvoie l'index de la première signature invalide de <checks>, dont les clés
+    publiques sont sous forme brute, ou -1 si elles sont toutes valides. Peut être
+    exécutée dans un processus (avec le backend <backend>) ou un thread d'un
+    exécuteur.
+    """
+    if backend is not None and backend != _backend.name:
+        set_backend(backend)
+    for i, (raw_pk, message, signature) in enumerate(checks):
+        if not verify_signature(raw_pk, message, signature):
+            return i
+    return -1
+
+
+def _find_all_invalid_raw(
+    checks: list[tuple[bytes, bytes, bytes | None]], backend: str | None = None
+) -> list[int]:
+    """Exécuté dans un processus du pool : renvoie les index de toutes les
+    signatures invalides de <checks>, dont les clés publiques sont sous forme
+    brute."""
+    if backend is not None and backend != _backend.name:
+        set_backend(backend)
+    return [
+        i
+        for i, (raw_pk, message, signature) in enumerate(checks)
+        if not verify_signature(raw_pk, message, signature)
+    ]
+
+
+class BatchVerifier:
+    """
+    Vérifie des lots de signatures, en parallèle dans un pool de processus si
+    <workers> > 1. Les clés publiques sont envoyées aux processus sous forme brute
+    (64 octets) et le lot est découpé en morceaux de <chunk_size> vérifications.
+    """
+
+    CHUNK_SIZE: int = 32
+
+    def __init__(self, workers: int = 1, chunk_size: int = CHUNK_SIZE):
+        self.workers: int = workers
+        self.chunk_size: int = chunk_size
+        self._executor: ProcessPoolExecutor | None = None
+
+    def find_invalid(self, checks: list[SignatureCheck]) -> int | None:
+        """
+        Renvoie l'index d'une signature invalide de <checks>, ou None si elles
+        sont toutes valides. Le traitement s'arrête dès qu'une signature invalide
+        est trouvée.
+        """
+        if self.workers <= 1 or len(checks) <= self.chunk_size:
+            for i, (pk, message, signature) in enumerate(checks):
+                if not verify_signature(pk, message, signature):
+                    return i
+            return None
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        futures: dict[Future, int] = {}
+        for start in range(0, len(checks), self.chunk_size):
+            chunk = [
+                (_raw_public_key(pk), message, signature)
+                for pk, message, signature in checks[start : start + self.chunk_size]
+            ]
+            future: Future = self._executor.submit(
+                find_invalid_raw, chunk, _backend.name
+            )
+            futures[future] = start
+
+        try:
+            for future in as_completed(futures):
+                index: int = future.result()
+                if index >= 0:
+                    return futures[future] + index
+        finally:
+            for future in futures:
+                future.cancel()
+
+        return None
+
+    def find_all_invalid(self, checks: list[SignatureCheck]) -> list[int]:
+        """Renvoie les index, dans l'ordre, de toutes les signatures invalides de
+        <checks> ; chaque signature est vérifiée une seule fois."""
+        if self.workers <= 1 or len(checks) <= self.chunk_size:
+            return _find_all_invalid_raw(
+                [
+                    (_raw_public_key(pk), message, signature)
+                    for pk, message, signature in checks
+                ]
+            )
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        futures: list[tuple[int, Future]] = []
+        for start in range(0, len(checks), self.chunk_size):
+            chunk = [
+                (_raw_public_key(pk), message, signature)
+                for pk, message, signature in checks[start : start + self.chunk_size]
+            ]
+            futures.append(
+                (
+                    start,
+                    self._executor.submit(_find_all_invalid_raw, chunk, _backend.name),
+                )
+            )
+        return [start + index for start, future in futures for index in future.result()]
+
+    def close(self) -> None:
+        """Arrête le pool de processus."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def _sign_raw(
+    raw_sk: bytes, messages: list[bytes], backend: str | None = None
+) -> list[bytes]:
+    """Exécuté dans un processus du pool : renvoie les signatures de <messages>
+    par la clé privée brute (32 octets) <raw_sk>."""
+    if backend is not None and backend != _backend.name:
+        set_backend(backend)
+    sk: PrivateKey = PrivateKey.from_string(raw_sk, curve=SECP256k1)
+    return [sign(sk, message) for message in messages]
+
+
+class BatchSigner:
+    """
+    Signe des lots de messages, en parallèle dans un pool de processus si
+    <workers> > 1. Les messages sont groupés par clé privée : chaque morceau de
+    <chunk_size> messages n'envoie sa clé (sous forme brute, 32 octets) qu'une
+    fois.
+    """
+
+    CHUNK_SIZE: int = 32
+
+    def __init__(self, workers: int = 1, chunk_size: int = CHUNK_SIZE):
+        self.workers: int = workers
+        self.chunk_size: int = chunk_size
+        self._executor: ProcessPoolExecutor | None = None
+
+    def sign(self, requests: list[tuple[PrivateKey, bytes]]) -> list[bytes]:
+        """Renvoie la signature de chaque (clé privée, message) de <requests>,
+        dans l'ordre."""
+        if self.workers <= 1 or len(requests) <= self.chunk_size:
+            return [sign(sk, message) for sk, message in requests]
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        # Index des messages de chaque clé, par clé brute
+        groups: dict[bytes, list[int]] = {}
+        for i, (sk, _) in enumerate(requests):
+            groups.setdefault(sk.to_string(), []).append(i)
+
+        futures: dict[Future, list[int]] = {}
+        for raw_sk, indexes in groups.items():
+            for start in range(0, len(indexes), self.chunk_size):
+                chunk: list[int] = indexes[start : start + self.chunk_size]
+                future: Future = self._executor.submit(
+                    _sign_raw, raw_sk, [requests[i][1] for i in chunk], _backend.name
+                )
+                futures[future] = chunk
+
+        signatures: list[bytes] = [b""] * len(requests)
+        try:
+            for future in as_completed(futures):
+                for i, signature in zip(futures[future], future.result()):
+                    signatures[i] = signature
+        finally:
+            for future in futures:
+                future.cancel()
+        return signatures
+
+    def close(self) -> None:
+        """Arrête le pool de processus."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def signature_key(
+    raw_pk: bytes, message: bytes, signature: bytes | None
+) -> SignatureKey:
+    """
+    Renvoie la clé de cache de la vérification de <signature> pour <message> par
+    la clé publique brute <raw_pk>. La clé porte sur tout ce qui est vérifié, et
+    non sur le hash annoncé par la transaction : une transaction qui réutilise le
+    hash d'une autre avec un autre contenu n'a pas la même clé.
+    """
+    digest = hashlib.sha256(raw_pk)
+    digest.update(message)
+    digest.update(signature or b"")
+    return digest.digest()
+
+
+class SignatureCache:
+    """
+    Cache LRU borné des signatures d'entrées déjà vérifiées avec succès.
+
+    Attributes:
+        max_size (int): Nombre maximal d'entrées conservées.
+        hits (int): Nombre de recherches ayant trouvé la signature.
+        misses (int): Nombre de recherches ne l'ayant pas trouvée.
+        evictions (int): Nombre d'entrées retirées pour respecter <max_size>.
+    """
+
+    MAX_SIZE: int = 100_000
+
+    def __init__(self, max_size: int = MAX_SIZE):
+        self.max_size: int = max_size
+        self._entries: OrderedDict[SignatureKey, None] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def contains(self, key: SignatureKey) -> bool:
+        """Renvoie True si la signature <key> a déjà été vérifiée."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def add(self, key: SignatureKey) -> None:
+        """Enregistre la signature <key> comme vérifiée."""
+        self._entries[key] = None
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        """Renvoie les compteurs du cache."""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,215 @@
+"""
+Index secondaire de l'historique : bloc de chaque transaction et transactions de
+chaque adresse, pour les requêtes de type explorateur.
+
+L'index est tenu à jour par Blockchain.add_block et couvre toutes les branches ;
+les requêtes ne renvoient que les entrées de la branche principale, vérifiées
+par BlockNode.get_ancestor. Les entrées d'une branche retirée par prune sont
+supprimées.
+
+    blockchain = Blockchain(genesis_block, history=HistoryIndex())
+    blockchain.find_transaction(tx.hash)  # (hash du bloc, position)
+    page, cursor = blockchain.get_address_history(pk, limit=50)
+    page, cursor = blockchain.get_address_history(pk, limit=50, before=cursor)
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, insort
+from typing import Callable
+
+from blockchain.block import Block
+from blockchain.transaction import Transaction
+from blockchain.utxo import UTXO
+from blockchain.utxo_pool import UTXOPool
+
+# Sens d'une entrée : l'adresse dépense une sortie (entrée de la transaction) ou
+# en reçoit une (sortie de la transaction)
+SENT: str = "in"
+RECEIVED: str = "out"
+
+# Position d'une entrée dans l'historique d'une adresse : (hauteur, position de
+# la transaction dans son bloc, sens)
+Cursor = tuple[int, int, str]
+
+# Emplacement d'une transaction : (hauteur, position, hash du bloc)
+Location = tuple[int, int, bytes]
+
+
+class HistoryEntry:
+    """
+    Transaction d'un bloc qui concerne une adresse.
+
+    Attributes:
+        height (int): Hauteur du bloc.
+        position (int): Position de la transaction dans le bloc : 0 pour la
+            coinbase, i + 1 pour block.transactions[i].
+        tx_hash (bytes): Hash de la transaction.
+        block_hash (bytes): Hash du bloc.
+        direction (str): SENT si l'adresse dépense une sortie dans la
+            transaction, RECEIVED si elle en reçoit une.
+    """
+
+    __slots__ = ("height", "position", "tx_hash", "block_hash", "direction")
+
+    def __init__(
+        self,
+        height: int,
+        position: int,
+        tx_hash: bytes,
+        block_hash: bytes,
+        direction: str,
+    ):
+        self.height: int = height
+        self.position: int = position
+        self.tx_hash: bytes = tx_hash
+        self.block_hash: bytes = block_hash
+        self.direction: str = direction
+
+    @property
+    def cursor(self) -> Cursor:
+        return self.height, self.position, self.direction
+
+
+def _cursor(entry: HistoryEntry) -> Cursor:
+    return entry.cursor
+
+
+class HistoryIndex:
+    """
+    Index tx -> blocs et adresse -> historique, sur toutes les branches.
+
+    Attributes:
+        locations (dict): Emplacements de chaque hash de transaction, un par bloc
+            qui la contient.
+        addresses (dict): Historique de chaque adresse brute (64 octets), trié
+            par curseur.
+    """
+
+    def __init__(self) -> None:
+        self.locations: dict[bytes, list[Location]] = {}
+        self.addresses: dict[bytes, list[HistoryEntry]] = {}
+        # Hashs des transactions et adresses indexées pour chaque bloc
+        self._blocks: dict[bytes, tuple[list[bytes], set[bytes]]] = {}
+
+    def __contains__(self, block_hash: bytes) -> bool:
+        return block_hash in self._blocks
+
+    def add_block(
+        self, block: Block, height: int, parent_utxo_pool: UTXOPool | None
+    ) -> None:
+        """
+        Indexe <block>, de hauteur <height>. L'adresse des sorties dépensées est
+        lue dans <parent_utxo_pool>, le pool UTXO de son parent, ou dans les
+        transactions précédentes du bloc.
+        """
+        assert block.hash is not None, "Bloc invalide!"
+        if block.hash in self._blocks:
+            return
+        created: dict[bytes, Transaction] = {}
+        tx_hashes: list[bytes] = []
+        addresses: set[bytes] = set()
+        for position, tx in enumerate([block.coinbase] + block.transactions):
+            entries: dict[tuple[bytes, str], HistoryEntry] = {}
+            for input_ in tx.inputs:
+                address: bytes = self._spent_address(
+                    UTXO(input_.prev_tx_hash, input_.output_index),
+                    created,
+                    parent_utxo_pool,
+                )
+                entries.setdefault(
+                    (address, SENT),
+                    HistoryEntry(height, position, tx.hash, block.hash, SENT),
+                )
+            for output in tx.outputs:
+                entries.setdefault(
+                    (output.get_raw_address(), RECEIVED),
+                    HistoryEntry(height, position, tx.hash, block.hash, RECEIVED),
+                )
+
+            self.locations.setdefault(tx.hash, []).append(
+                (height, position, block.hash)
+            )
+            tx_hashes.append(tx.hash)
+            for (address, _), entry in entries.items():
+                insort(self.addresses.setdefault(address, []), entry, key=_cursor)
+                addresses.add(address)
+            created[tx.hash] = tx
+        self._blocks[block.hash] = (tx_hashes, addresses)
+
+    @staticmethod
+    def _spent_address(
+        utxo: UTXO, created: dict[bytes, Transaction], utxo_pool: UTXOPool | None
+    ) -> bytes:
+        tx: Transaction | None = created.get(utxo.tx_hash)
+        if tx is not None:
+            return tx.get_output(utxo.index).get_raw_address()
+        assert utxo_pool is not None, "Pool UTXO du parent requis!"
+        return utxo_pool.get_tx_output(utxo).get_raw_address()
+
+    def remove_block(self, block_hash: bytes) -> None:
+        """Retire de l'index les entrées du bloc <block_hash>."""
+        indexed: tuple[list[bytes], set[bytes]] | None = self._blocks.pop(
+            block_hash, None
+        )
+        if indexed is None:
+            return
+        tx_hashes, addresses = indexed
+        for tx_hash in tx_hashes:
+            kept: list[Location] = [
+                location
+                for location in self.locations[tx_hash]
+                if location[2] != block_hash
+            ]
+            if kept:
+                self.locations[tx_hash] = kept
+            else:
+                del self.locations[tx_hash]
+        for address in addresses:
+            history: list[HistoryEntry] = [
+                e for e in self.addresses[address] if e.block_hash != block_hash
+            ]
+            if history:
+                self.addresses[address] = history
+            else:
+                del self.addresses[address]
+
+    def find_transaction(
+        self, tx_hash: bytes, visible: Callable[[int, bytes], bool]
+    ) -> Location | None:
+        """Renvoie l'emplacement de la transaction <tx_hash> dans un bloc pour
+        lequel visible(hauteur, hash du bloc) est vrai, None s'il n'y en a pas."""
+        for location in self.locations.get(tx_hash, []):
+            if visible(location[0], location[2]):
+                return location
+        return None
+
+    def get_history(
+        self,
+        address: bytes,
+        visible: Callable[[int, bytes], bool],
+        limit: int,
+        before: Cursor | None = None,
+    ) -> tuple[list[HistoryEntry], Cursor | None]:
+        """
+        Renvoie au plus <limit> entrées visibles de l'adresse brute <address>, de
+        la plus récente à la plus ancienne, en commençant juste avant le curseur
+        <before> (par la fin si None), et le curseur de la page suivante (None
+        si l'historique est épuisé ; la page suivante peut être vide). Le coût
+        est proportionnel à la page, plus les entrées des branches abandonnées
+        qu'elle traverse.
+        """
+        history: list[HistoryEntry] = self.addresses.get(address, [])
+        index: int = len(history)
+        if before is not None:
+            index = bisect_left(history, before, key=_cursor)
+
+        page: list[HistoryEntry] = []
+        while index > 0 and len(page) < limit:
+            index -= 1
+            entry: HistoryEntry = history[index]
+            if visible(entry.height, entry.block_hash):
+                page.append(entry)
+        if len(page) < limit or index == 0:
+            return page, None
+        return page, page[-1].cursor
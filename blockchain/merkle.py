@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Iterable
+
+# Étape d'une preuve d'inclusion : (hash voisin, True si le voisin est à droite)
+ProofStep = tuple[bytes, bool]
+
+
+class MerkleTree:
+    """
+    Arbre de Merkle incrémental sur des hashs de transactions.
+
+    Tous les niveaux de l'arbre sont conservés, de sorte qu'ajouter une feuille ne
+    recalcule que les O(log n) noeuds du chemin vers la racine. Un noeud sans voisin
+    est remonté tel quel au niveau supérieur (il n'est pas dupliqué). Les noeuds
+    internes sont préfixés d'un octet pour ne pas pouvoir être confondus avec
+    des feuilles.
+
+    Attributes:
+        levels (list): levels[0] contient les feuilles, levels[-1] la racine.
+    """
+
+    EMPTY_ROOT: bytes = bytes(32)
+
+    def __init__(self, leaves: Iterable[bytes] = ()):
+        self.levels: list[list[bytes]] = [[]]
+        for leaf in leaves:
+            self.append(leaf)
+
+    @staticmethod
+    def hash_pair(left: bytes, right: bytes) -> bytes:
+        return hashlib.sha256(b"\x01" + left + right).digest()
+
+    def __len__(self) -> int:
+        return len(self.levels[0])
+
+    def append(self, leaf: bytes) -> None:
+        """Ajoute la feuille <leaf> et met à jour le chemin vers la racine."""
+        self.levels[0].append(leaf)
+        index: int = len(self.levels[0]) - 1
+        level: int = 0
+
+        while len(self.levels[level]) > 1:
+            nodes: list[bytes] = self.levels[level]
+            index //= 2
+            left: bytes = nodes[2 * index]
+            parent: bytes = (
+                self.hash_pair(left, nodes[2 * index + 1])
+                if 2 * index + 1 < len(nodes)
+                else left
+            )
+
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            upper: list[bytes] = self.levels[level + 1]
+            if index < len(upper):
+                upper[index] = parent
+            else:
+                upper.append(parent)
+            level += 1
+
+    def root(self) -> bytes:
+        """Renvoie la racine de l'arbre (EMPTY_ROOT s'il est vide)."""
+        top: list[bytes] = self.levels[-1]
+        return top[0] if top else self.EMPTY_ROOT
+
+    def get_proof(self, index: int) -> list[ProofStep]:
+        """Renvoie la preuve d'inclusion de la feuille d'index <index>."""
+        if not 0 <= index < len(self):
+            raise ValueError(f"Index {index} invalide!")
+
+        proof: list[ProofStep] = []
+        for nodes in self.levels[:-1]:
+            sibling: int = index ^ 1
+            if sibling < len(nodes):
+                proof.append((nodes[sibling], sibling > index))
+            index //= 2
+        return proof
+
+    @classmethod
+    def verify_proof(cls, leaf: bytes, proof: list[ProofStep], root: bytes) -> bool:
+        """Renvoie True si <proof> prouve que <leaf> est une feuille de l'arbre de racine <root>."""
+        node: bytes = leaf
+        for sibling, is_right in proof:
+            node = (
+                cls.hash_pair(node, sibling)
+                if is_right
+                else cls.hash_pair(sibling, node)
+            )
+        return node == root
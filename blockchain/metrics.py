@@ -0,0 +1,167 @@
+"""
+Instrumentation : durées des étapes (spans) et compteurs, envoyés à un sink.
+
+Sans sink, Metrics est désactivé : span renvoie un gestionnaire de contexte vide
+partagé et increment ne fait rien, sans lire l'horloge ni allouer.
+
+    metrics = Metrics(PrometheusSink())
+    blockchain = Blockchain(genesis_block, metrics=metrics)
+    ...
+    print(metrics.sink.render())
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import time
+from typing import ContextManager, Protocol
+
+# Étiquettes d'une mesure, triées par nom
+Labels = tuple[tuple[str, str], ...]
+
+_NULL_SPAN: ContextManager[None] = contextlib.nullcontext()
+
+
+class MetricsSink(Protocol):
+    def observe(self, name: str, seconds: float, labels: Labels) -> None:
+        """Enregistre la durée <seconds> d'un span <name>."""
+        ...
+
+    def increment(self, name: str, value: int, labels: Labels) -> None:
+        """Ajoute <value> au compteur <name>."""
+        ...
+
+
+class _Span:
+    __slots__ = ("sink", "name", "labels", "start")
+
+    def __init__(self, sink: MetricsSink, name: str, labels: Labels):
+        self.sink: MetricsSink = sink
+        self.name: str = name
+        self.labels: Labels = labels
+        self.start: float = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.sink.observe(self.name, time.perf_counter() - self.start, self.labels)
+
+
+class Metrics:
+    """
+    Point d'entrée de l'instrumentation, partagé par les composants d'un noeud.
+
+    Attributes:
+        sink (MetricsSink): Destination des mesures, None si désactivé.
+        enabled (bool): True si un sink est configuré.
+    """
+
+    def __init__(self, sink: MetricsSink | None = None):
+        self.sink: MetricsSink | None = sink
+        self.enabled: bool = sink is not None
+
+    def span(self, name: str, **labels: str) -> ContextManager[None]:
+        """Renvoie un gestionnaire de contexte qui mesure la durée de son bloc."""
+        if self.sink is None:
+            return _NULL_SPAN
+        return _Span(self.sink, name, tuple(sorted(labels.items())))
+
+    def increment(self, name: str, value: int = 1, **labels: str) -> None:
+        if self.sink is not None:
+            self.sink.increment(name, value, tuple(sorted(labels.items())))
+
+
+class LoggingSink:
+    """Écrit chaque mesure dans le logger <logger>, au niveau <level>."""
+
+    def __init__(
+        self,
+        logger: logging.Logger = logging.getLogger("blockchain.metrics"),
+        level: int = logging.DEBUG,
+    ):
+        self.logger: logging.Logger = logger
+        self.level: int = level
+
+    def observe(self, name: str, seconds: float, labels: Labels) -> None:
+        self.logger.log(self.level, "%s%s %.6fs", name, dict(labels), seconds)
+
+    def increment(self, name: str, value: int, labels: Labels) -> None:
+        self.logger.log(self.level, "%s%s +%d", name, dict(labels), value)
+
+
+class MemorySink:
+    """
+    Agrège les mesures en mémoire.
+
+    Attributes:
+        counters (dict): Valeur de chaque compteur, par (nom, étiquettes).
+        spans (dict): [nombre, durée totale, durée maximale] de chaque span, par
+            (nom, étiquettes).
+    """
+
+    def __init__(self) -> None:
+        self.counters: dict[tuple[str, Labels], int] = {}
+        self.spans: dict[tuple[str, Labels], list[float]] = {}
+
+    def observe(self, name: str, seconds: float, labels: Labels) -> None:
+        summary: list[float] | None = self.spans.get((name, labels))
+        if summary is None:
+            self.spans[(name, labels)] = [1, seconds, seconds]
+        else:
+            summary[0] += 1
+            summary[1] += seconds
+            summary[2] = max(summary[2], seconds)
+
+    def increment(self, name: str, value: int, labels: Labels) -> None:
+        self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def get_counter(self, name: str, **labels: str) -> int:
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def get_span(self, name: str, **labels: str) -> tuple[int, float]:
+        """Renvoie le nombre de spans <name> mesurés et leur durée totale."""
+        summary: list[float] = self.spans.get(
+            (name, tuple(sorted(labels.items()))), [0, 0.0, 0.0]
+        )
+        return int(summary[0]), summary[1]
+
+
+class PrometheusSink(MemorySink):
+    """Agrège les mesures en mémoire et les exporte au format texte de Prometheus."""
+
+    def __init__(self, namespace: str = "iftcoin"):
+        super().__init__()
+        self.namespace: str = namespace
+
+    @staticmethod
+    def _labels(labels: Labels) -> str:
+        if not labels:
+            return ""
+        escaped: list[str] = [
+            key
+            + '="'
+            + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            + '"'
+            for key, value in labels
+        ]
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        """Renvoie toutes les mesures au format d'exposition texte de Prometheus."""
+        lines: list[str] = []
+        for name in sorted({name for name, _ in self.counters}):
+            metric: str = f"{self.namespace}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, labels), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append(f"{metric}{self._labels(labels)} {value}")
+        for name in sorted({name for name, _ in self.spans}):
+            metric = f"{self.namespace}_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for (span, labels), (count, total, _) in sorted(self.spans.items()):
+                if span == name:
+                    lines.append(f"{metric}_count{self._labels(labels)} {int(count)}")
+                    lines.append(f"{metric}_sum{self._labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
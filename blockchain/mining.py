@@ -0,0 +1,204 @@
+"""
+Preuve de travail : règles de difficulté et mineur.
+
+Avec preuve de travail, le hash d'un bloc porte aussi sur son horodatage, sa cible
+et son nonce, placé en dernier (voir Block.get_header_prefix). Le mineur hache le
+préfixe fixe une seule fois et copie cet état SHA-256 intermédiaire pour chaque
+nonce essayé ; les plages de nonces sont réparties entre plusieurs processus.
+
+    blockchain = Blockchain(genesis_block, proof_of_work=ProofOfWork())
+    handler = BlockHandler(blockchain, miner=Miner(workers=4))
+    block = handler.create_block(address)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from blockchain.block import MAX_TARGET, NONCE, Block
+
+MAX_NONCE: int = 2**64 - 1
+
+
+class ProofOfWork:
+    """
+    Règles de preuve de travail d'une chaîne.
+
+    Attributes:
+        block_time (float): Durée visée entre deux blocs, en secondes.
+        retarget_interval (int): La cible est recalculée tous les
+            <retarget_interval> blocs, d'après la durée des précédents.
+        max_target (int): Cible la plus facile acceptée.
+        max_future_time (int): Avance maximale de l'horodatage d'un bloc sur
+            l'heure locale, en secondes.
+    """
+
+    def __init__(
+        self,
+        block_time: float = 10.0,
+        retarget_interval: int = 16,
+        max_target: int = MAX_TARGET,
+        max_future_time: int = 2 * 60 * 60,
+    ):
+        assert retarget_interval >= 2, "Intervalle de recalcul trop court!"
+        self.block_time: float = block_time
+        self.retarget_interval: int = retarget_interval
+        self.max_target: int = max_target
+        self.max_future_time: int = max_future_time
+
+    def retarget(self, target: int, elapsed: float) -> int:
+        """
+        Renvoie la cible qui suit <target> quand les <retarget_interval> derniers
+        blocs ont pris <elapsed> secondes. L'ajustement est limité à un facteur 4
+        dans chaque sens.
+        """
+        expected: float = self.block_time * (self.retarget_interval - 1)
+        elapsed = min(max(elapsed, expected / 4), expected * 4)
+        new_target: int = target * round(elapsed * 1000) // round(expected * 1000)
+        return min(max(new_target, 1), self.max_target)
+
+
+def get_work(target: int | None) -> int:
+    """
+    Renvoie le travail d'un bloc de cible <target> : le nombre moyen de hashs
+    nécessaires pour l'atteindre. Un bloc sans preuve de travail vaut 1, si bien
+    que le travail cumulé d'une chaîne sans preuve de travail est sa hauteur.
+    """
+    if target is None:
+        return 1
+    return 2**256 // (target + 1)
+
+
+def target_from_bits(bits: int) -> int:
+    """Renvoie la cible qui demande en moyenne 2**<bits> hashs."""
+    return MAX_TARGET >> bits
+
+
+def _search(prefix: bytes, target: int, start: int, count: int) -> tuple[int, int]:
+    """
+    Cherche un nonce de [<start>, <start> + <count>[ dont le hash avec <prefix>
+    atteint <target>. Renvoie (nonce, hashs calculés), avec nonce = -1 si aucun
+    ne convient. Exécuté dans un processus du pool.
+    """
+    midstate = hashlib.sha256(prefix)
+    pack = NONCE.pack
+    for nonce in range(start, min(start + count, MAX_NONCE + 1)):
+        sha = midstate.copy()
+        sha.update(pack(nonce))
+        if int.from_bytes(sha.digest(), "big") <= target:
+            return nonce, nonce - start + 1
+    return -1, count
+
+
+class MiningResult:
+    """
+    Résultat d'une recherche de nonce.
+
+    Attributes:
+        found (bool): True si un nonce a été trouvé.
+        hashes (int): Nombre de hashs calculés.
+        seconds (float): Durée de la recherche.
+    """
+
+    __slots__ = ("found", "hashes", "seconds")
+
+    def __init__(self, found: bool, hashes: int, seconds: float):
+        self.found: bool = found
+        self.hashes: int = hashes
+        self.seconds: float = seconds
+
+    @property
+    def hashrate(self) -> float:
+        """Hashs par seconde."""
+        return self.hashes / self.seconds if self.seconds > 0 else 0.0
+
+
+class Miner:
+    """
+    Cherche le nonce des blocs avec preuve de travail, dans <workers> processus
+    (dans le processus courant si <workers> <= 1), par plages de <chunk_size>
+    nonces.
+    """
+
+    CHUNK_SIZE: int = 1 << 16
+
+    def __init__(self, workers: int | None = None, chunk_size: int = CHUNK_SIZE):
+        self.workers: int = (os.cpu_count() or 1) if workers is None else workers
+        self.chunk_size: int = chunk_size
+        self._executor: ProcessPoolExecutor | None = None
+
+    def mine(self, block: Block, max_nonces: int = MAX_NONCE + 1) -> MiningResult:
+        """
+        Cherche parmi les <max_nonces> premiers nonces un nonce pour lequel le hash
+        de <block> atteint sa cible. S'il est trouvé, il est assigné au bloc, qui
+        est finalisé.
+        """
+        assert block.target is not None, "Bloc sans preuve de travail!"
+        prefix: bytes = block.get_header_prefix()
+        start_time: float = time.perf_counter()
+        nonce: int
+        hashes: int
+        if self.workers <= 1:
+            nonce, hashes = _search(prefix, block.target, 0, max_nonces)
+        else:
+            nonce, hashes = self._search_parallel(prefix, block.target, max_nonces)
+        result: MiningResult = MiningResult(
+            nonce >= 0, hashes, time.perf_counter() - start_time
+        )
+        if result.found:
+            block.nonce = nonce
+            block.finalize()
+        return result
+
+    def _search_parallel(
+        self, prefix: bytes, target: int, max_nonces: int
+    ) -> tuple[int, int]:
+        """Répartit les plages de nonces entre les processus, <workers> * 2 plages
+        au plus à la fois ; renvoie (nonce ou -1, hashs calculés)."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        pending: set[Future[tuple[int, int]]] = set()
+        next_start: int = 0
+        hashes: int = 0
+        found: int = -1
+        try:
+            while True:
+                while (
+                    found < 0
+                    and len(pending) < self.workers * 2
+                    and next_start < max_nonces
+                ):
+                    count: int = min(self.chunk_size, max_nonces - next_start)
+                    pending.add(
+                        self._executor.submit(
+                            _search, prefix, target, next_start, count
+                        )
+                    )
+                    next_start += count
+                if not pending:
+                    return found, hashes
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    nonce, count = future.result()
+                    hashes += count
+                    if nonce >= 0 and (found < 0 or nonce < found):
+                        found = nonce
+                if found >= 0:
+                    # Les plages pas encore commencées sont abandonnées
+                    for future in pending:
+                        future.cancel()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
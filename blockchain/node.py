@@ -0,0 +1,537 @@
+"""
+Service de noeud asyncio : reçoit des transactions et des blocs de plusieurs
+connexions à la fois (TCP ou socket Unix) et les applique à une Blockchain.
+
+Protocole : chaque message est une trame
+    type (u8), longueur de la charge utile (u32), charge utile.
+Requêtes :
+    MSG_TRANSACTION : transaction encodée par codec.encode_transaction ;
+    MSG_BLOCK : bloc encodé par codec.encode_block ;
+    MSG_TIP : charge vide ;
+    MSG_GET_HEADERS : nombre maximal d'en-têtes (u32) suivi des hashs (32 octets
+        chacun) du localisateur, voir sync.headers_after ;
+    MSG_GET_BLOCKS : hashs des blocs demandés (32 octets chacun).
+Chaque requête reçoit une réponse, dans l'ordre des requêtes de la connexion.
+Son type est un statut (STATUS_ACCEPTED, STATUS_REJECTED, STATUS_MALFORMED ou
+STATUS_ERROR). Sa charge utile est le hash du bloc de hauteur maximale pour
+MSG_TIP, les en-têtes encodés par BlockHeader.to_bytes pour MSG_GET_HEADERS, les
+blocs préfixés de leur longueur (u32) pour MSG_GET_BLOCKS, et vide sinon. Les
+requêtes de lecture d'en-têtes et de blocs ne passent pas par la file de
+l'écrivain. Un client peut envoyer plusieurs requêtes sans attendre les
+réponses.
+
+Chaque requête passe par une file bornée vers un écrivain unique, qui applique
+les requêtes à la chaîne une à une, dans l'ordre d'arrivée. Pendant qu'une
+requête attend dans la file, ses signatures sont vérifiées dans un exécuteur,
+hors de la boucle d'événements ; celles qui sont valides sont ajoutées au cache
+de signatures de la chaîne, que add_block et add_transaction consultent. Quand
+la file est pleine, les connexions arrêtent de lire jusqu'à ce qu'une place se
+libère.
+
+    async with Node(blockchain, ProcessPoolExecutor()) as node:
+        server = await node.serve_tcp("127.0.0.1", 8333)
+        await server.serve_forever()
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import struct
+from concurrent.futures import Executor
+
+from blockchain import codec, crypto
+from blockchain.block import Block
+from blockchain.block_handler import BlockHandler
+from blockchain.blockchain import Blockchain
+from blockchain.crypto import SignatureKey
+from blockchain.metrics import Metrics
+from blockchain.sync import (
+    HEADER as BLOCK_HEADER,
+    MAX_HEADERS,
+    BlockHeader,
+    blocks_by_hash,
+    headers_after,
+)
+from blockchain.transaction import Transaction
+from blockchain.transaction_pool import TransactionPool
+from blockchain.utxo import UTXO
+from blockchain.utxo_pool import UTXOPool
+
+HEADER = struct.Struct(">BI")
+
+MSG_TRANSACTION: int = 1
+MSG_BLOCK: int = 2
+MSG_TIP: int = 3
+MSG_GET_HEADERS: int = 4
+MSG_GET_BLOCKS: int = 5
+
+STATUS_ACCEPTED: int = 0
+STATUS_REJECTED: int = 1
+STATUS_MALFORMED: int = 2
+STATUS_ERROR: int = 3
+
+# Taille maximale d'une charge utile : un bloc plein, encodé, avec de la marge
+MAX_MESSAGE_SIZE: int = 4 * TransactionPool.MAX_BLOCK_SIZE
+
+# Réponse à une requête : (statut, charge utile)
+Reply = tuple[int, bytes]
+
+
+class _Job:
+    """Requête en attente dans la file de l'écrivain."""
+
+    __slots__ = ("kind", "item", "checked", "result")
+
+    def __init__(self, kind: int, item: Block | Transaction | None):
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self.kind: int = kind
+        self.item: Block | Transaction | None = item
+        # True si aucune signature vérifiée d'avance n'est invalide
+        self.checked: asyncio.Future[bool] = loop.create_future()
+        self.result: asyncio.Future[Reply] = loop.create_future()
+
+
+class Node:
+    """
+    Front-end asyncio d'une Blockchain.
+
+    Attributes:
+        blockchain (Blockchain): Chaîne modifiée par l'écrivain.
+        executor (Executor): Exécuteur des vérifications de signatures, None pour
+            l'exécuteur par défaut de la boucle (des threads). Un
+            ProcessPoolExecutor vérifie les signatures en parallèle.
+        metrics (Metrics): Instrumentation de la chaîne, partagée par le noeud.
+    """
+
+    QUEUE_SIZE: int = 256
+    # Nombre de réponses en attente par connexion avant d'arrêter de la lire
+    PIPELINE_DEPTH: int = 64
+
+    def __init__(
+        self,
+        blockchain: Blockchain,
+        executor: Executor | None = None,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        self.blockchain: Blockchain = blockchain
+        self.handler: BlockHandler = BlockHandler(blockchain)
+        self.executor: Executor | None = executor
+        self.metrics: Metrics = blockchain.metrics
+        self._queue: asyncio.Queue[_Job] = asyncio.Queue(queue_size)
+        self._writer: asyncio.Task[None] | None = None
+        self._checks: set[asyncio.Task[None]] = set()
+        self._servers: list[asyncio.Server] = []
+
+    async def __aenter__(self) -> Node:
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        """Démarre l'écrivain (fait automatiquement à la première requête)."""
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._write())
+
+    async def close(self) -> None:
+        """Ferme les serveurs, attend la fin des requêtes reçues et arrête
+        l'écrivain."""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+        if self._writer is not None:
+            await self._queue.join()
+            self._writer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._writer
+            self._writer = None
+
+    async def serve_tcp(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.Server:
+        """Accepte des connexions TCP sur <host>:<port> ; renvoie le serveur."""
+        self.start()
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        self._servers.append(server)
+        return server
+
+    async def serve_unix(self, path: str) -> asyncio.Server:
+        """Accepte des connexions sur le socket Unix <path> ; renvoie le serveur."""
+        self.start()
+        server = await asyncio.start_unix_server(self._handle_connection, path)
+        self._servers.append(server)
+        return server
+
+    # ===== Requêtes =====#
+
+    async def submit_transaction(self, tx: Transaction) -> bool:
+        """Renvoie True si <tx> a été admise dans le memory pool."""
+        job: _Job = await self._enqueue(MSG_TRANSACTION, tx)
+        return (await job.result)[0] == STATUS_ACCEPTED
+
+    async def submit_block(self, block: Block) -> bool:
+        """Renvoie True si <block> a été ajouté à la chaîne."""
+        job: _Job = await self._enqueue(MSG_BLOCK, block)
+        return (await job.result)[0] == STATUS_ACCEPTED
+
+    async def submit_blocks(self, blocks: list[Block]) -> list[bool]:
+        """
+        Place les blocs <blocks> dans la file, dans l'ordre, puis attend leur
+        résultat : les signatures des blocs sont vérifiées en parallèle pendant
+        que l'écrivain ajoute les précédents.
+        """
+        jobs: list[_Job] = [await self._enqueue(MSG_BLOCK, block) for block in blocks]
+        return [(await job.result)[0] == STATUS_ACCEPTED for job in jobs]
+
+    async def get_tip(self) -> bytes:
+        """Renvoie le hash du bloc de hauteur maximale, une fois les requêtes
+        précédentes appliquées."""
+        job: _Job = await self._enqueue(MSG_TIP, None)
+        return (await job.result)[1]
+
+    async def _enqueue(self, kind: int, item: Block | Transaction | None) -> _Job:
+        """
+        Place une requête dans la file de l'écrivain, en attendant une place si
+        elle est pleine, puis lance la vérification de ses signatures.
+        """
+        self.start()
+        job: _Job = _Job(kind, item)
+        if self._queue.full():
+            self.metrics.increment("node_backpressure")
+        await self._queue.put(job)
+
+        if item is None:
+            job.checked.set_result(True)
+        else:
+            txs: list[Transaction] = (
+                [item] if isinstance(item, Transaction) else item.transactions
+            )
+            task: asyncio.Task[None] = asyncio.get_running_loop().create_task(
+                self._check_signatures(job, txs)
+            )
+            self._checks.add(task)
+            task.add_done_callback(self._checks.discard)
+        return job
+
+    async def _check_signatures(self, job: _Job, txs: list[Transaction]) -> None:
+        """
+        Vérifie dans l'exécuteur les signatures de <txs> qui dépensent des sorties
+        connues et absentes du cache ; les signatures valides sont ajoutées au
+        cache de la chaîne.
+        """
+        try:
+            checks, keys = self._collect_checks(txs)
+            invalid: int = -1
+            if checks:
+                with self.metrics.span("node_signatures"):
+                    invalid = await asyncio.get_running_loop().run_in_executor(
+                        self.executor,
+                        crypto.find_invalid_raw,
+                        checks,
+                        crypto.get_backend().name,
+                    )
+            if invalid < 0:
+                for key in keys:
+                    self.blockchain.signature_cache.add(key)
+            job.checked.set_result(invalid < 0)
+        except Exception as error:
+            job.checked.set_exception(error)
+
+    def _collect_checks(
+        self, txs: list[Transaction]
+    ) -> tuple[list[tuple[bytes, bytes, bytes | None]], list[SignatureKey]]:
+        """
+        Renvoie les vérifications de signature des entrées de <txs> dont la sortie
+        dépensée est dans le pool UTXO du sommet ou créée par une transaction de
+        <txs>, et leurs clés de cache. Une signature valide pour une adresse l'est
+        sur toutes les branches : la clé de cache porte sur l'adresse, le message et
+        la signature.
+        """
+        utxo_pool: UTXOPool = self.blockchain.get_max_height_utxo_pool()
+        cache: crypto.SignatureCache = self.blockchain.signature_cache
+        created: dict[bytes, Transaction] = {tx.hash: tx for tx in txs}
+        checks: list[tuple[bytes, bytes, bytes | None]] = []
+        keys: list[SignatureKey] = []
+
+        for tx in txs:
+            for index, input_ in enumerate(tx.inputs):
+                utxo: UTXO = UTXO(input_.prev_tx_hash, input_.output_index)
+                output: Transaction.Output | None = None
+                if utxo in utxo_pool:
+                    output = utxo_pool.get_tx_output(utxo)
+                elif input_.prev_tx_hash in created:
+                    parent: Transaction = created[input_.prev_tx_hash]
+                    if 0 <= input_.output_index < parent.num_outputs():
+                        output = parent.outputs[input_.output_index]
+                if output is None:
+                    continue
+
+                raw_address: bytes = output.get_raw_address()
+                message: bytes = tx.get_raw_data_to_sign(index)
+                key: SignatureKey = crypto.signature_key(
+                    raw_address, message, input_.signature
+                )
+                if cache.contains(key):
+                    continue
+                checks.append((raw_address, message, input_.signature))
+                keys.append(key)
+        return checks, keys
+
+    async def _write(self) -> None:
+        """Écrivain unique : applique les requêtes de la file dans l'ordre."""
+        while True:
+            job: _Job = await self._queue.get()
+            try:
+                if await job.checked:
+                    job.result.set_result(self._apply(job))
+                else:
+                    self.metrics.increment(
+                        "blocks" if job.kind == MSG_BLOCK else "transactions",
+                        result="rejected",
+                        reason="invalid_signature",
+                    )
+                    job.result.set_result((STATUS_REJECTED, b""))
+            except Exception as error:
+                job.result.set_exception(error)
+            finally:
+                self._queue.task_done()
+
+    def _apply(self, job: _Job) -> Reply:
+        accepted: bool
+        if job.kind == MSG_TIP:
+            tip: bytes | None = self.blockchain.get_max_height_block().hash
+            assert tip is not None
+            return STATUS_ACCEPTED, tip
+        if isinstance(job.item, Block):
+            accepted = self.handler.process_block(job.item)
+        else:
+            assert isinstance(job.item, Transaction)
+            accepted = self.handler.process_transaction(job.item)
+        return (STATUS_ACCEPTED if accepted else STATUS_REJECTED), b""
+
+    # ===== Connexions =====#
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Lit les requêtes d'une connexion et les place dans la file ; une tâche à
+        part écrit les réponses dans l'ordre. La lecture s'arrête tant que la file
+        de l'écrivain ou les réponses en attente sont pleines.
+        """
+        replies: asyncio.Queue[asyncio.Future[Reply] | None] = asyncio.Queue(
+            self.PIPELINE_DEPTH
+        )
+        responder: asyncio.Task[None] = asyncio.get_running_loop().create_task(
+            self._respond(writer, replies)
+        )
+        try:
+            while True:
+                kind, size = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if size > MAX_MESSAGE_SIZE:
+                    # Impossible de resynchroniser la lecture : on ferme
+                    await replies.put(_reply(STATUS_MALFORMED))
+                    break
+                payload: bytes = await reader.readexactly(size)
+                await replies.put(await self._dispatch(kind, payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await replies.put(None)
+            await responder
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _dispatch(self, kind: int, payload: bytes) -> asyncio.Future[Reply]:
+        """Décode la requête <kind> et la place dans la file ; renvoie sa réponse
+        à venir."""
+        item: Block | Transaction | None
+        try:
+            if kind == MSG_TRANSACTION:
+                item, end = codec.decode_transaction(payload, verify=True)
+                if end != len(payload):
+                    raise ValueError("Données après la transaction!")
+            elif kind == MSG_BLOCK:
+                item = codec.decode_block(payload, verify=True)
+            elif kind == MSG_TIP:
+                item = None
+            elif kind == MSG_GET_HEADERS:
+                (limit,) = codec.COUNT.unpack_from(payload, 0)
+                headers: list[BlockHeader] = headers_after(
+                    self.blockchain,
+                    _split_hashes(payload[codec.COUNT.size :]),
+                    min(limit, MAX_HEADERS),
+                )
+                return _reply(
+                    STATUS_ACCEPTED, b"".join(header.to_bytes() for header in headers)
+                )
+            elif kind == MSG_GET_BLOCKS:
+                blocks: list[bytes] = [
+                    codec.encode_block(block)
+                    for block in blocks_by_hash(self.blockchain, _split_hashes(payload))
+                ]
+                return _reply(
+                    STATUS_ACCEPTED,
+                    b"".join(codec.COUNT.pack(len(data)) + data for data in blocks),
+                )
+            else:
+                raise ValueError(f"Type de message inconnu : {kind}")
+        except (ValueError, IndexError, struct.error):
+            return _reply(STATUS_MALFORMED)
+        return (await self._enqueue(kind, item)).result
+
+    @staticmethod
+    async def _respond(
+        writer: asyncio.StreamWriter,
+        replies: asyncio.Queue[asyncio.Future[Reply] | None],
+    ) -> None:
+        """Écrit les réponses de <replies> dans l'ordre, jusqu'à None. Si le client
+        est parti, les réponses restantes sont ignorées."""
+        connected: bool = True
+        while True:
+            reply: asyncio.Future[Reply] | None = await replies.get()
+            if reply is None:
+                return
+            try:
+                status, payload = await reply
+            except Exception:
+                status, payload = STATUS_ERROR, b""
+            if not connected:
+                continue
+            try:
+                writer.write(HEADER.pack(status, len(payload)) + payload)
+                await writer.drain()
+            except ConnectionError:
+                connected = False
+
+
+def _split_hashes(data: bytes) -> list[bytes]:
+    if len(data) % codec.HASH_SIZE:
+        raise ValueError("Liste de hashs invalide!")
+    return [data[i : i + codec.HASH_SIZE] for i in range(0, len(data), codec.HASH_SIZE)]
+
+
+def _reply(status: int, payload: bytes = b"") -> asyncio.Future[Reply]:
+    future: asyncio.Future[Reply] = asyncio.get_running_loop().create_future()
+    future.set_result((status, payload))
+    return future
+
+
+class NodeClient:
+    """
+    Client du protocole de Node. Les requêtes peuvent être envoyées en parallèle
+    (asyncio.gather) : elles partent dans l'ordre des appels et les réponses sont
+    associées dans le même ordre.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader: asyncio.StreamReader = reader
+        self._writer: asyncio.StreamWriter = writer
+        self._pending: list[asyncio.Future[Reply]] = []
+        self._receiver: asyncio.Task[None] = asyncio.get_running_loop().create_task(
+            self._receive()
+        )
+
+    @classmethod
+    async def connect(cls, host: str, port: int) -> NodeClient:
+        return cls(*await asyncio.open_connection(host, port))
+
+    @classmethod
+    async def connect_unix(cls, path: str) -> NodeClient:
+        return cls(*await asyncio.open_unix_connection(path))
+
+    async def __aenter__(self) -> NodeClient:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def send_transaction(self, tx: Transaction) -> bool:
+        """Renvoie True si le noeud a admis <tx> dans son memory pool."""
+        return await self._request(MSG_TRANSACTION, codec.encode_transaction(tx))
+
+    async def send_block(self, block: Block) -> bool:
+        """Renvoie True si le noeud a ajouté <block> à sa chaîne."""
+        return await self._request(MSG_BLOCK, codec.encode_block(block))
+
+    async def get_tip(self) -> bytes:
+        """Renvoie le hash du bloc de hauteur maximale du noeud."""
+        return (await self._send(MSG_TIP, b""))[1]
+
+    async def get_headers(
+        self, locator: list[bytes], limit: int = MAX_HEADERS
+    ) -> list[BlockHeader]:
+        """Renvoie les en-têtes de la chaîne principale du noeud qui suivent
+        <locator> (voir sync.Peer)."""
+        status, payload = await self._send(
+            MSG_GET_HEADERS, codec.COUNT.pack(limit) + b"".join(locator)
+        )
+        if status != STATUS_ACCEPTED or len(payload) % BLOCK_HEADER.size:
+            raise ValueError("Réponse invalide du noeud!")
+        return [
+            BlockHeader.from_bytes(payload, offset)
+            for offset in range(0, len(payload), BLOCK_HEADER.size)
+        ]
+
+    async def get_blocks(self, hashes: list[bytes]) -> list[Block]:
+        """Renvoie les blocs <hashes> connus du noeud, dont les hashs sont
+        vérifiés."""
+        status, payload = await self._send(MSG_GET_BLOCKS, b"".join(hashes))
+        if status != STATUS_ACCEPTED:
+            raise ValueError("Réponse invalide du noeud!")
+        blocks: list[Block] = []
+        offset: int = 0
+        try:
+            while offset < len(payload):
+                (size,) = codec.COUNT.unpack_from(payload, offset)
+                offset += codec.COUNT.size
+                blocks.append(
+                    codec.decode_block(payload[offset : offset + size], verify=True)
+                )
+                offset += size
+        except (IndexError, struct.error) as error:
+            raise ValueError("Réponse invalide du noeud!") from error
+        return blocks
+
+    async def _request(self, kind: int, payload: bytes) -> bool:
+        status: int = (await self._send(kind, payload))[0]
+        if status == STATUS_MALFORMED:
+            raise ValueError("Requête refusée par le noeud : message invalide!")
+        if status == STATUS_ERROR:
+            raise RuntimeError("Erreur interne du noeud!")
+        return status == STATUS_ACCEPTED
+
+    async def _send(self, kind: int, payload: bytes) -> Reply:
+        future: asyncio.Future[Reply] = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        self._writer.write(HEADER.pack(kind, len(payload)) + payload)
+        await self._writer.drain()
+        return await future
+
+    async def _receive(self) -> None:
+        try:
+            while True:
+                status, size = HEADER.unpack(
+                    await self._reader.readexactly(HEADER.size)
+                )
+                payload: bytes = await self._reader.readexactly(size)
+                self._pending.pop(0).set_result((status, payload))
+        except (asyncio.IncompleteReadError, ConnectionError) as error:
+            for future in self._pending:
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("Connexion au noeud fermée!")
+                        if isinstance(error, asyncio.IncompleteReadError)
+                        else error
+                    )
+            self._pending.clear()
+
+    async def close(self) -> None:
+        self._writer.close()
+        with contextlib.suppress(ConnectionError):
+            await self._writer.wait_closed()
+        self._receiver.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._receiver
@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import mmap
+import os
+import sqlite3
+import struct
+from typing import Iterable, Iterator
+
+from blockchain import codec
+from blockchain.block import Block
+from blockchain.transaction import Transaction
+from blockchain.utxo import UTXO
+
+# Paire (UTXO, sortie) enregistrée dans le stockage
+UTXOEntry = tuple[UTXO, Transaction.Output]
+
+_SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS blocks (
+    hash BLOB PRIMARY KEY,
+    prev_hash BLOB,
+    height INTEGER NOT NULL,
+    file INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    target BLOB
+);
+CREATE INDEX IF NOT EXISTS blocks_height ON blocks (height);
+CREATE TABLE IF NOT EXISTS transactions (
+    tx_hash BLOB NOT NULL,
+    block_hash BLOB NOT NULL,
+    file INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_hash ON transactions (tx_hash);
+CREATE TABLE IF NOT EXISTS deltas (
+    block_hash BLOB NOT NULL,
+    spent INTEGER NOT NULL,
+    tx_hash BLOB NOT NULL,
+    output_index INTEGER NOT NULL,
+    value REAL NOT NULL,
+    address BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deltas_block ON deltas (block_hash);
+CREATE TABLE IF NOT EXISTS utxos (
+    tx_hash BLOB NOT NULL,
+    output_index INTEGER NOT NULL,
+    value REAL NOT NULL,
+    address BLOB NOT NULL,
+    PRIMARY KEY (tx_hash, output_index)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+"""
+
+
+class BlockStore:
+    """
+    Stockage persistant d'une chaîne de blocs dans le répertoire <directory>.
+
+    Les blocs sont encodés (voir codec) et ajoutés à la fin de fichiers
+    blk00000.dat, blk00001.dat, ... qui ne sont jamais réécrits ; chaque
+    enregistrement est précédé de RECORD_MAGIC et de sa taille. Une base SQLite
+    (chain.sqlite) contient :
+        - blocks : l'arbre des blocs (hash, parent, hauteur, cible de preuve de
+          travail) et la position de chaque bloc dans les fichiers ;
+        - transactions : la position de chaque transaction dans les fichiers ;
+        - deltas : pour chaque bloc, les UTXOs créés et dépensés par le bloc, qui
+          permettent de reconstruire le pool UTXO de n'importe quel noeud à partir
+          de celui du bloc de hauteur maximale ;
+        - utxos : le pool UTXO du bloc de hauteur maximale ;
+        - meta : le hash du bloc de hauteur maximale.
+
+    Chaque bloc est enregistré par une seule transaction SQLite, après que son
+    encodage a été écrit et synchronisé sur disque : après un arrêt brutal, la base
+    reflète le dernier bloc entièrement enregistré, et les octets écrits au-delà du
+    dernier bloc indexé sont tronqués à l'ouverture.
+
+    Les fichiers de blocs sont lus par projection en mémoire (mmap) : les blocs et
+    transactions peuvent être lus sous forme de vues (codec.BlockView,
+    codec.TransactionView) sans copie ni construction d'objets.
+    """
+
+    BLOCK_FILE: str = "blk%05d.dat"
+    DATABASE_FILE: str = "chain.sqlite"
+    # Taille au-delà de laquelle un nouveau fichier de blocs est commencé
+    MAX_FILE_SIZE: int = 128 * 1024 * 1024
+    # En-tête de chaque enregistrement d'un fichier de blocs : marqueur, taille
+    RECORD = struct.Struct(">4sI")
+    RECORD_MAGIC: bytes = b"IFTB"
+
+    def __init__(self, directory: str | os.PathLike[str], synchronous: bool = True):
+        """
+        Ouvre (ou crée) le stockage du répertoire <directory>. Si <synchronous> est
+        False, les écritures ne sont pas synchronisées sur disque : plus rapide,
+        mais un arrêt brutal du système peut perdre les derniers blocs.
+        """
+        self.directory: str = os.fspath(directory)
+        self.synchronous: bool = synchronous
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.db: sqlite3.Connection = sqlite3.connect(
+            os.path.join(self.directory, self.DATABASE_FILE)
+        )
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute(f"PRAGMA synchronous = {'FULL' if synchronous else 'OFF'}")
+        with self.db:
+            self.db.executescript(_SCHEMA)
+
+        self.file_number: int = 0
+        self.file_size: int = 0
+        self._recover()
+        self._file = open(self._block_path(self.file_number), "ab")
+        # Projections en mémoire des fichiers de blocs, par numéro de fichier
+        self._maps: dict[int, memoryview] = {}
+
+    def _block_path(self, number: int) -> str:
+        return os.path.join(self.directory, self.BLOCK_FILE % number)
+
+    def _recover(self) -> None:
+        """Tronque ce qui a été écrit dans les fichiers de blocs après le dernier
+        bloc indexé (écriture interrompue avant la transaction SQLite)."""
+        row = self.db.execute(
+            "SELECT file, MAX(offset + length) FROM blocks "
+            "WHERE file = (SELECT MAX(file) FROM blocks)"
+        ).fetchone()
+        if row[0] is not None:
+            self.file_number, self.file_size = row
+
+        path: str = self._block_path(self.file_number)
+        if os.path.exists(path) and os.path.getsize(path) > self.file_size:
+            with open(path, "r+b") as f:
+                f.truncate(self.file_size)
+
+        number: int = self.file_number + 1
+        while os.path.exists(self._block_path(number)):
+            os.remove(self._block_path(number))
+            number += 1
+
+    def close(self) -> None:
+        """Ferme le stockage. Les vues encore utilisées gardent leur projection
+        ouverte jusqu'à leur destruction."""
+        self._maps.clear()
+        self._file.close()
+        self.db.close()
+
+    def __enter__(self) -> BlockStore:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def is_empty(self) -> bool:
+        return self.db.execute("SELECT 1 FROM blocks LIMIT 1").fetchone() is None
+
+    def get_tip(self) -> bytes | None:
+        """Renvoie le hash du bloc de hauteur maximale, None si le stockage est vide."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'tip'").fetchone()
+        return None if row is None else row[0]
+
+    def _append(self, data: bytes) -> tuple[int, int]:
+        """Ajoute l'enregistrement <data> au fichier de blocs courant ; renvoie
+        (fichier, position de <data>)."""
+        size: int = self.RECORD.size + len(data)
+        if self.file_size > 0 and self.file_size + size > self.MAX_FILE_SIZE:
+            self._file.close()
+            self.file_number += 1
+            self.file_size = 0
+            self._file = open(self._block_path(self.file_number), "ab")
+
+        offset: int = self.file_size + self.RECORD.size
+        self._file.write(self.RECORD.pack(self.RECORD_MAGIC, len(data)))
+        self._file.write(data)
+        self._file.flush()
+        if self.synchronous:
+            os.fsync(self._file.fileno())
+        self.file_size += size
+        return self.file_number, offset
+
+    def _map(self, file_number: int, end: int) -> memoryview:
+        """Renvoie une vue sur le fichier de blocs <file_number>, projeté en mémoire
+        au moins jusqu'à la position <end>."""
+        view: memoryview | None = self._maps.get(file_number)
+        if view is None or len(view) < end:
+            # Le fichier courant a grandi depuis sa projection : elle est refaite,
+            # l'ancienne reste valide pour les vues qui l'utilisent encore
+            with open(self._block_path(file_number), "rb") as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self._maps[file_number] = view
+        return view
+
+    def commit_block(
+        self,
+        block: Block,
+        height: int,
+        created: list[UTXOEntry],
+        spent: list[UTXOEntry],
+        disconnected: Iterable[bytes] = (),
+        connected: Iterable[bytes] = (),
+        tip: bytes | None = None,
+    ) -> None:
+        """
+        Enregistre atomiquement <block>, de hauteur <height>, avec les UTXOs qu'il
+        crée (<created>) et dépense (<spent>, avec leurs sorties).
+
+        Si <tip> n'est pas None, il devient le bloc de hauteur maximale : le pool
+        UTXO enregistré est mis à jour en déconnectant les blocs <disconnected>
+        (du plus récent au plus ancien) puis en connectant les blocs <connected>
+        (du plus ancien au plus récent, <block> compris s'il en fait partie).
+        """
+        assert block.hash is not None, "Bloc non finalisé!"
+        data: bytes = codec.encode_block(block)
+        file_number, offset = self._append(data)
+        tx_offsets: list[int] = codec.BlockView(memoryview(data)).transaction_offsets()
+        txs: list[Transaction] = [block.coinbase] + block.transactions
+
+        with self.db:
+            self.db.execute(
+                "INSERT INTO blocks (hash, prev_hash, height, file, offset, length, "
+                "target) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    block.hash,
+                    block.prev_block_hash,
+                    height,
+                    file_number,
+                    offset,
+                    len(data),
+                    None if block.target is None else block.target.to_bytes(32, "big"),
+                ),
+            )
+            self.db.executemany(
+                "INSERT INTO transactions VALUES (?, ?, ?, ?)",
+                [
+                    (tx.hash, block.hash, file_number, offset + tx_offset)
+                    for tx, tx_offset in zip(txs, tx_offsets)
+                ],
+            )
+            self.db.executemany(
+                "INSERT INTO deltas VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        block.hash,
+                        is_spent,
+                        utxo.tx_hash,
+                        utxo.index,
+                        output.value,
+                        output.get_raw_address(),
+                    )
+                    for is_spent, entries in ((0, created), (1, spent))
+                    for utxo, output in entries
+                ],
+            )
+            if tip is not None:
+                for block_hash in disconnected:
+                    self._apply_delta(block_hash, undo=True)
+                for block_hash in connected:
+                    self._apply_delta(block_hash, undo=False)
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('tip', ?)", (tip,))
+
+    def _apply_delta(self, block_hash: bytes, undo: bool) -> None:
+        """Connecte (ou déconnecte si <undo>) le bloc <block_hash> au pool UTXO
+        enregistré. Doit être appelé dans une transaction SQLite."""
+        rows = self.db.execute(
+            "SELECT spent, tx_hash, output_index, value, address FROM deltas "
+            "WHERE block_hash = ?",
+            (block_hash,),
+        ).fetchall()
+        removed: int = 0 if undo else 1
+        self.db.executemany(
+            "DELETE FROM utxos WHERE tx_hash = ? AND output_index = ?",
+            [
+                (tx_hash, index)
+                for spent, tx_hash, index, _, _ in rows
+                if spent == removed
+            ],
+        )
+        self.db.executemany(
+            "INSERT OR REPLACE INTO utxos VALUES (?, ?, ?, ?)",
+            [row[1:] for row in rows if row[0] != removed],
+        )
+
+    def load_headers(self) -> list[tuple[bytes, bytes | None, int, int | None]]:
+        """Renvoie (hash, hash du parent, hauteur, cible de preuve de travail ou None)
+        de chaque bloc, par hauteur croissante."""
+        return [
+            (
+                block_hash,
+                prev_hash,
+                height,
+                None if target is None else int.from_bytes(target, "big"),
+            )
+            for block_hash, prev_hash, height, target in self.db.execute(
+                "SELECT hash, prev_hash, height, target FROM blocks ORDER BY height"
+            )
+        ]
+
+    def load_utxos(self) -> Iterator[UTXOEntry]:
+        """Itère sur le pool UTXO du bloc de hauteur maximale."""
+        for tx_hash, index, value, address in self.db.execute(
+            "SELECT tx_hash, output_index, value, address FROM utxos"
+        ):
+            yield UTXO(tx_hash, index), codec.decode_output(value, address)
+
+    def get_delta(self, block_hash: bytes) -> tuple[list[UTXOEntry], list[UTXOEntry]]:
+        """Renvoie les UTXOs créés et dépensés par le bloc <block_hash>."""
+        created: list[UTXOEntry] = []
+        spent: list[UTXOEntry] = []
+        for is_spent, tx_hash, index, value, address in self.db.execute(
+            "SELECT spent, tx_hash, output_index, value, address FROM deltas "
+            "WHERE block_hash = ?",
+            (block_hash,),
+        ):
+            entries: list[UTXOEntry] = spent if is_spent else created
+            entries.append((UTXO(tx_hash, index), codec.decode_output(value, address)))
+        return created, spent
+
+    def read_block_view(self, block_hash: bytes) -> codec.BlockView:
+        """Renvoie une vue sur le bloc <block_hash>, sans copie."""
+        row = self.db.execute(
+            "SELECT file, offset, length FROM blocks WHERE hash = ?", (block_hash,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(block_hash)
+
+        file_number, offset, length = row
+        return codec.BlockView(
+            self._map(file_number, offset + length)[offset : offset + length]
+        )
+
+    def read_block(self, block_hash: bytes) -> Block:
+        """Lit le bloc <block_hash> depuis les fichiers de blocs."""
+        return self.read_block_view(block_hash).to_block()
+
+    def iter_blocks(self) -> Iterator[codec.BlockView]:
+        """Itère sur des vues de tous les blocs enregistrés, dans l'ordre des fichiers."""
+        for file_number, offset, length in self.db.execute(
+            "SELECT file, offset, length FROM blocks ORDER BY file, offset"
+        ).fetchall():
+            yield codec.BlockView(
+                self._map(file_number, offset + length)[offset : offset + length]
+            )
+
+    def locate_transaction(self, tx_hash: bytes) -> list[tuple[bytes, int, int]]:
+        """Renvoie (hash du bloc, fichier, position) de chaque enregistrement de la
+        transaction <tx_hash>, du plus ancien au plus récent. Une transaction peut
+        figurer dans plusieurs blocs de branches concurrentes."""
+        return self.db.execute(
+            "SELECT block_hash, file, offset FROM transactions WHERE tx_hash = ? "
+            "ORDER BY rowid",
+            (tx_hash,),
+        ).fetchall()
+
+    def read_transaction(self, tx_hash: bytes) -> codec.TransactionView | None:
+        """Renvoie une vue sur le dernier enregistrement de la transaction
+        <tx_hash>, None si elle est inconnue."""
+        locations: list[tuple[bytes, int, int]] = self.locate_transaction(tx_hash)
+        if not locations:
+            return None
+
+        _, file_number, offset = locations[-1]
+        # Une projection qui contient le début d'un enregistrement le contient en entier
+        view: memoryview = self._map(file_number, offset + codec.TX_HEADER.size)
+        return codec.TransactionView(view, offset)
@@ -0,0 +1,536 @@
+"""
+Synchronisation des blocs entre noeuds, en-têtes d'abord.
+
+Un noeud demande d'abord à ses pairs les en-têtes (hash, hash précédent, hauteur,
+racine de Merkle, champs de preuve de travail) des blocs qui suivent sa chaîne
+principale, les relie et choisit la chaîne qui a le plus de travail cumulé (la
+plus haute sans preuve de travail). Il télécharge ensuite les corps des blocs de
+cette chaîne par lots, en parallèle auprès de tous les pairs qui l'annoncent, et
+les valide dans l'ordre avec add_block.
+
+Un pair est un objet qui respecte le protocole Peer : LocalPeer pour une
+Blockchain du même processus, ou node.NodeClient pour un noeud joignable par
+TCP ou socket Unix.
+
+    report = await Synchronizer(blockchain, [LocalPeer(other), client]).run()
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import struct
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Protocol
+
+from blockchain.block import NONCE, WORK, Block, meets_target
+from blockchain.blockchain import Blockchain
+from blockchain.mining import ProofOfWork, get_work
+
+if TYPE_CHECKING:
+    from blockchain.node import Node
+
+# flags (u8), hash, hash précédent, hauteur (u32), racine de Merkle, preuve de
+# travail (Block.get_work_data)
+WORK_SIZE: int = WORK.size + NONCE.size
+HEADER = struct.Struct(f">B32s32sI32s{WORK_SIZE}s")
+HEADER_HAS_PREV: int = 1
+HEADER_MERKLE: int = 2
+HEADER_WORK: int = 4
+
+# Nombre maximal d'en-têtes ou de blocs renvoyés par une requête
+MAX_HEADERS: int = 2000
+MAX_BLOCKS: int = 64
+# Nombre maximal d'en-têtes demandés à un pair par synchronisation
+MAX_SYNC_HEADERS: int = 100_000
+
+
+class BlockHeader:
+    """
+    En-tête d'un bloc de la chaîne principale d'un pair.
+
+    Attributes:
+        hash (bytes): Hash du bloc.
+        prev_block_hash (bytes): Hash du bloc précédent, None pour la genèse.
+        height (int): Hauteur du bloc.
+        merkle_root (bytes): Racine de Merkle des transactions, None pour le
+            format de bloc d'origine. Le hash d'un bloc au format Merkle peut être
+            vérifié sur l'en-tête seul ; celui d'un bloc d'origine ne peut l'être
+            qu'une fois son corps reçu.
+        work (bytes): Champs de preuve de travail du bloc, tels qu'ils terminent
+            Block.to_bytes (vide sans preuve de travail).
+    """
+
+    __slots__ = ("hash", "prev_block_hash", "height", "merkle_root", "work")
+
+    def __init__(
+        self,
+        block_hash: bytes,
+        prev_block_hash: bytes | None,
+        height: int,
+        merkle_root: bytes | None = None,
+        work: bytes = b"",
+    ):
+        self.hash: bytes = block_hash
+        self.prev_block_hash: bytes | None = prev_block_hash
+        self.height: int = height
+        self.merkle_root: bytes | None = merkle_root
+        self.work: bytes = work
+
+    @classmethod
+    def from_block(cls, block: Block, height: int) -> BlockHeader:
+        assert block.hash is not None, "Bloc non finalisé!"
+        merkle_root: bytes | None = (
+            block.get_merkle_root() if block.merkle_tree is not None else None
+        )
+        return cls(
+            block.hash,
+            block.prev_block_hash,
+            height,
+            merkle_root,
+            block.get_work_data(),
+        )
+
+    @property
+    def target(self) -> int | None:
+        """Cible de preuve de travail du bloc, None sans preuve de travail."""
+        if not self.work:
+            return None
+        _, raw_target = WORK.unpack_from(self.work)
+        return int.from_bytes(raw_target, "big")
+
+    @property
+    def timestamp(self) -> int | None:
+        """Horodatage du bloc, None sans preuve de travail."""
+        if not self.work:
+            return None
+        timestamp, _ = WORK.unpack_from(self.work)
+        return timestamp
+
+    def is_valid(self) -> bool:
+        """
+        Renvoie False si le hash de l'en-tête n'atteint pas sa cible de preuve de
+        travail, ou, au format Merkle, ne correspond pas à son contenu.
+
+        Au format d'origine, le hash n'est que celui annoncé par le pair : il
+        atteint sa cible sans que le travail ait été fait. La cible elle-même est
+        vérifiée par Synchronizer selon les règles de la chaîne, et le hash une
+        fois le corps du bloc reçu (matches).
+        """
+        target: int | None = self.target
+        if target is not None and not meets_target(self.hash, target):
+            return False
+        if self.merkle_root is None:
+            return True
+        digest: bytes = hashlib.sha256(
+            (self.prev_block_hash or b"") + self.merkle_root + self.work
+        ).digest()
+        return digest == self.hash
+
+    def matches(self, block: Block) -> bool:
+        """
+        Renvoie True si <block> est le bloc de cet en-tête : les hashs de ses
+        transactions et son propre hash sont recalculés.
+        """
+        if block.prev_block_hash != self.prev_block_hash:
+            return False
+        if (block.merkle_tree is None) != (self.merkle_root is None):
+            return False
+        if block.get_work_data() != self.work:
+            return False
+        for tx in [block.coinbase] + block.transactions:
+            if hashlib.sha256(tx.to_bytes()).digest() != tx.hash:
+                return False
+        return hashlib.sha256(block.to_bytes()).digest() == self.hash
+
+    def to_bytes(self) -> bytes:
+        flags: int = 0
+        if self.prev_block_hash is not None:
+            flags |= HEADER_HAS_PREV
+        if self.merkle_root is not None:
+            flags |= HEADER_MERKLE
+        if self.work:
+            flags |= HEADER_WORK
+        return HEADER.pack(
+            flags,
+            self.hash,
+            self.prev_block_hash or bytes(32),
+            self.height,
+            self.merkle_root or bytes(32),
+            self.work,
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview, offset: int = 0) -> BlockHeader:
+        flags, block_hash, prev_block_hash, height, merkle_root, work = (
+            HEADER.unpack_from(data, offset)
+        )
+        return cls(
+            block_hash,
+            prev_block_hash if flags & HEADER_HAS_PREV else None,
+            height,
+            merkle_root if flags & HEADER_MERKLE else None,
+            work if flags & HEADER_WORK else b"",
+        )
+
+
+class Peer(Protocol):
+    async def get_headers(
+        self, locator: list[bytes], limit: int = MAX_HEADERS
+    ) -> list[BlockHeader]:
+        """Renvoie au plus <limit> en-têtes de la chaîne principale du pair qui
+        suivent le premier hash de <locator> qui s'y trouve."""
+        ...
+
+    async def get_blocks(self, hashes: list[bytes]) -> list[Block]:
+        """Renvoie les blocs <hashes> connus du pair, dans l'ordre."""
+        ...
+
+
+def headers_after(
+    blockchain: Blockchain, locator: list[bytes], limit: int = MAX_HEADERS
+) -> list[BlockHeader]:
+    """
+    Renvoie au plus <limit> en-têtes des blocs de la chaîne principale de
+    <blockchain> qui suivent le premier hash de <locator> qui en fait partie, ou
+    [] si aucun n'en fait partie.
+    """
+    tip: Blockchain.BlockNode = blockchain.max_height_node
+    start: Blockchain.BlockNode | None = None
+    for block_hash in locator:
+        node: Blockchain.BlockNode | None = blockchain.blockchain.get(block_hash.hex())
+        if node is not None and tip.get_ancestor(node.height) is node:
+            start = node
+            break
+    if start is None:
+        return []
+
+    nodes: list[Blockchain.BlockNode] = []
+    current: Blockchain.BlockNode | None = tip.get_ancestor(
+        min(tip.height, start.height + limit)
+    )
+    while current is not start:
+        assert current is not None
+        nodes.append(current)
+        current = current.parent
+    nodes.reverse()
+    return [BlockHeader.from_block(n.block, n.height) for n in nodes]
+
+
+def blocks_by_hash(blockchain: Blockchain, hashes: list[bytes]) -> list[Block]:
+    """Renvoie les blocs <hashes> présents dans <blockchain>, dans l'ordre."""
+    blocks: list[Block] = []
+    for block_hash in hashes[:MAX_BLOCKS]:
+        node: Blockchain.BlockNode | None = blockchain.blockchain.get(block_hash.hex())
+        if node is not None:
+            blocks.append(node.block)
+    return blocks
+
+
+def get_locator(blockchain: Blockchain) -> list[bytes]:
+    """
+    Renvoie les hashs de la chaîne principale de <blockchain> à envoyer à un pair
+    pour trouver le dernier bloc commun : les 10 derniers blocs, puis des blocs de
+    plus en plus espacés, et enfin le plus ancien bloc connu.
+    """
+    tip: Blockchain.BlockNode = blockchain.max_height_node
+    locator: list[bytes] = []
+    step: int = 1
+    height: int = tip.height
+    while height > 1:
+        node: Blockchain.BlockNode | None = tip.get_ancestor(height)
+        assert node is not None
+        locator.append(node.hash)
+        if len(locator) >= 10:
+            step *= 2
+        height -= step
+    root: Blockchain.BlockNode | None = tip.get_ancestor(1)
+    assert root is not None
+    locator.append(root.hash)
+    return locator
+
+
+class LocalPeer:
+    """Pair dont la chaîne <blockchain> est dans le même processus."""
+
+    def __init__(self, blockchain: Blockchain):
+        self.blockchain: Blockchain = blockchain
+
+    async def get_headers(
+        self, locator: list[bytes], limit: int = MAX_HEADERS
+    ) -> list[BlockHeader]:
+        return headers_after(self.blockchain, locator, limit)
+
+    async def get_blocks(self, hashes: list[bytes]) -> list[Block]:
+        return blocks_by_hash(self.blockchain, hashes)
+
+
+class Synchronizer:
+    """
+    Rattrape la meilleure chaîne annoncée par <peers>.
+
+    Si <node> est fourni, les blocs sont ajoutés par son écrivain (et leurs
+    signatures vérifiées dans son exécuteur) ; sinon directement avec
+    blockchain.add_block.
+
+    Attributes:
+        batch_size (int): Nombre de blocs demandés par requête.
+        window (int): Nombre maximal de lots téléchargés d'avance.
+        max_headers (int): Nombre maximal d'en-têtes demandés à chaque pair.
+    """
+
+    def __init__(
+        self,
+        blockchain: Blockchain,
+        peers: list[Peer],
+        node: Node | None = None,
+        batch_size: int = 16,
+        window: int = 8,
+        max_headers: int = MAX_SYNC_HEADERS,
+    ):
+        self.blockchain: Blockchain = blockchain
+        self.peers: list[Peer] = peers
+        self.node: Node | None = node
+        self.batch_size: int = min(batch_size, MAX_BLOCKS)
+        self.window: int = window
+        self.max_headers: int = max_headers
+
+    async def run(self) -> dict[str, int]:
+        """
+        Synchronise la chaîne.
+
+        Si des blocs de la meilleure chaîne sont introuvables ou refusés, les pairs
+        qui l'annoncent sont retirés de <peers> et la synchronisation reprend avec
+        la meilleure chaîne restante.
+
+        Returns:
+            dict: Nombre d'en-têtes à télécharger des chaînes essayées
+            ("headers"), de blocs ajoutés ("blocks") et de chaînes abandonnées
+            après un bloc refusé ou introuvable ("failed").
+        """
+        chains: list[list[BlockHeader]] = await asyncio.gather(
+            *(self._fetch_headers(peer) for peer in self.peers)
+        )
+        candidates: list[tuple[Peer, list[BlockHeader], int]] = [
+            (peer, chain, self._chain_work(chain))
+            for peer, chain in zip(self.peers, chains)
+        ]
+        report: dict[str, int] = {"headers": 0, "blocks": 0, "failed": 0}
+        while candidates:
+            _, best, work = max(candidates, key=lambda candidate: candidate[2])
+            if work <= self.blockchain.max_height_node.chain_work:
+                return report
+            if self.blockchain.assume_valid is not None:
+                # Les ancêtres du bloc de référence sont présumés valides ; chaque
+                # bloc téléchargé est comparé à son en-tête par BlockHeader.matches
+                self.blockchain.add_assumed_headers(
+                    [(header.hash, header.prev_block_hash) for header in best]
+                )
+
+            # Les blocs de la meilleure chaîne déjà connus ne sont pas retéléchargés
+            headers: list[BlockHeader] = [
+                header
+                for header in best
+                if header.hash.hex() not in self.blockchain.blockchain
+            ]
+            report["headers"] += len(headers)
+            sources: dict[bytes, list[Peer]] = {}
+            for peer, chain, _ in candidates:
+                for header in chain:
+                    sources.setdefault(header.hash, []).append(peer)
+
+            failed: list[bytes] = await self._download(headers, sources, report)
+            if not failed:
+                return report
+            # Les pairs qui annoncent tous les blocs en échec sont abandonnés
+            report["failed"] += 1
+            dropped: list[Peer] = [
+                peer
+                for peer, chain, _ in candidates
+                if set(failed) <= {header.hash for header in chain}
+            ]
+            candidates = [
+                candidate for candidate in candidates if candidate[0] not in dropped
+            ]
+            self.peers = [peer for peer in self.peers if peer not in dropped]
+        return report
+
+    async def _download(
+        self,
+        headers: list[BlockHeader],
+        sources: dict[bytes, list[Peer]],
+        report: dict[str, int],
+    ) -> list[bytes]:
+        """
+        Télécharge et ajoute les blocs de <headers>, dans l'ordre, en comptant les
+        blocs ajoutés dans <report>. Renvoie les hashs du lot introuvable ou du
+        bloc refusé qui a arrêté le téléchargement, une liste vide sinon.
+        """
+        batches: list[list[BlockHeader]] = [
+            headers[i : i + self.batch_size]
+            for i in range(0, len(headers), self.batch_size)
+        ]
+        pending: deque[asyncio.Task[list[Block] | None]] = deque()
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        try:
+            for index, batch in enumerate(batches):
+                # Les lots suivants sont téléchargés pendant la validation
+                while len(pending) < self.window and index + len(pending) < len(
+                    batches
+                ):
+                    ahead: int = index + len(pending)
+                    pending.append(
+                        loop.create_task(
+                            self._fetch_blocks(batches[ahead], sources, ahead)
+                        )
+                    )
+                blocks: list[Block] | None = await pending.popleft()
+                if blocks is None:
+                    return [header.hash for header in batch]
+                accepted: int = await self._add_blocks(blocks)
+                report["blocks"] += accepted
+                if accepted < len(blocks):
+                    return [batch[accepted].hash]
+        finally:
+            for task in pending:
+                task.cancel()
+        return []
+
+    async def _fetch_headers(self, peer: Peer) -> list[BlockHeader]:
+        """Renvoie la chaîne d'en-têtes de <peer> qui prolonge un bloc connu,
+        tronquée au premier en-tête invalide ou mal relié et à max_headers
+        en-têtes ; une synchronisation suivante reprend après le dernier."""
+        chain: list[BlockHeader] = []
+        locator: list[bytes] = get_locator(self.blockchain)
+        while True:
+            try:
+                headers: list[BlockHeader] = await peer.get_headers(locator)
+            except (ConnectionError, ValueError):
+                return chain
+            for header in headers:
+                if not self._links(chain, header):
+                    return chain
+                chain.append(header)
+            if len(headers) < MAX_HEADERS or len(chain) >= self.max_headers:
+                return chain[: self.max_headers]
+            locator = [chain[-1].hash]
+
+    def _chain_work(self, chain: list[BlockHeader]) -> int:
+        """Renvoie le travail cumulé du dernier en-tête de <chain>, 0 si elle est
+        vide."""
+        if not chain:
+            return 0
+        assert chain[0].prev_block_hash is not None
+        parent: Blockchain.BlockNode = self.blockchain.blockchain[
+            chain[0].prev_block_hash.hex()
+        ]
+        return parent.chain_work + sum(get_work(header.target) for header in chain)
+
+    def _links(self, chain: list[BlockHeader], header: BlockHeader) -> bool:
+        """Renvoie True si <header> est valide et prolonge <chain>, ou un bloc
+        connu si <chain> est vide, avec la cible et l'horodatage que les règles
+        de preuve de travail de la chaîne imposent."""
+        if not header.is_valid() or header.prev_block_hash is None:
+            return False
+        if chain:
+            previous: BlockHeader = chain[-1]
+            if (
+                header.prev_block_hash != previous.hash
+                or header.height != previous.height + 1
+            ):
+                return False
+        else:
+            parent: Blockchain.BlockNode | None = self.blockchain.blockchain.get(
+                header.prev_block_hash.hex()
+            )
+            if parent is None or header.height != parent.height + 1:
+                return False
+        return self._check_work(chain, header)
+
+    def _check_work(self, chain: list[BlockHeader], header: BlockHeader) -> bool:
+        """
+        Renvoie True si la cible de <header>, qui prolonge <chain>, est celle que
+        Blockchain.get_next_target donnerait, et si son horodatage respecte les
+        règles de Blockchain._check_work. Le travail annoncé par un en-tête au
+        format d'origine, dont le hash n'est pas vérifiable, est ainsi celui que
+        la chaîne exige.
+        """
+        proof_of_work: ProofOfWork | None = self.blockchain.proof_of_work
+        if proof_of_work is None:
+            return True
+        timestamp: int | None = header.timestamp
+        if timestamp is None:
+            return False
+        parent_timestamp, expected = self._work_at(chain, header, header.height - 1)
+        interval: int = proof_of_work.retarget_interval
+        if (header.height - 1) % interval == 0:
+            first_timestamp, _ = self._work_at(chain, header, header.height - interval)
+            expected = proof_of_work.retarget(
+                expected, parent_timestamp - first_timestamp
+            )
+        return (
+            header.target == expected
+            and parent_timestamp
+            <= timestamp
+            <= time.time() + proof_of_work.max_future_time
+        )
+
+    def _work_at(
+        self, chain: list[BlockHeader], header: BlockHeader, height: int
+    ) -> tuple[int, int]:
+        """Renvoie l'horodatage et la cible de l'ancêtre de hauteur <height> de
+        <header>, qui prolonge <chain> : un en-tête de <chain> ou un bloc connu."""
+        if chain and height >= chain[0].height:
+            ancestor: BlockHeader = chain[height - chain[0].height]
+            timestamp: int | None = ancestor.timestamp
+            target: int | None = ancestor.target
+        else:
+            first: BlockHeader = chain[0] if chain else header
+            assert first.prev_block_hash is not None
+            node: Blockchain.BlockNode | None = self.blockchain.blockchain[
+                first.prev_block_hash.hex()
+            ].get_ancestor(height)
+            assert node is not None
+            timestamp, target = node.block.timestamp, node.block.target
+        assert timestamp is not None and target is not None, "Bloc sans cible!"
+        return timestamp, target
+
+    async def _fetch_blocks(
+        self, batch: list[BlockHeader], sources: dict[bytes, list[Peer]], index: int
+    ) -> list[Block] | None:
+        """
+        Télécharge les blocs de <batch> auprès des pairs qui les annoncent, en
+        commençant par un pair choisi selon <index> pour répartir les lots. Renvoie
+        None si aucun pair ne fournit des blocs conformes aux en-têtes.
+        """
+        peers: list[Peer] = [
+            peer
+            for peer in sources[batch[0].hash]
+            if all(peer in sources[header.hash] for header in batch)
+        ]
+        for attempt in range(len(peers)):
+            peer: Peer = peers[(index + attempt) % len(peers)]
+            try:
+                blocks: list[Block] = await peer.get_blocks(
+                    [header.hash for header in batch]
+                )
+            except (ConnectionError, ValueError):
+                continue
+            if len(blocks) == len(batch) and all(
+                header.matches(block) for header, block in zip(batch, blocks)
+            ):
+                return blocks
+        return None
+
+    async def _add_blocks(self, blocks: list[Block]) -> int:
+        """Ajoute <blocks> dans l'ordre ; renvoie le nombre de blocs acceptés
+        avant le premier refus."""
+        if self.node is not None:
+            results: list[bool] = await self.node.submit_blocks(blocks)
+            return results.index(False) if False in results else len(results)
+
+        for accepted, block in enumerate(blocks):
+            if not self.blockchain.add_block(block):
+                return accepted
+        return len(blocks)
@@ -1,13 +1,67 @@
+import asyncio
+import gc
+import hashlib
+import random
 import secrets
+import struct
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from ecdsa import SigningKey, VerifyingKey
+import pytest
+from ecdsa import SECP256k1, SigningKey, VerifyingKey
 
-from blockchain.block import Block
+from benchmarks import run
+from benchmarks.workloads import ChainGenerator, Wallets
+from blockchain.block import NONCE, WORK, Block
 from blockchain.blockchain import Blockchain
 from blockchain.block_handler import BlockHandler
 from blockchain.transaction import Transaction
-from blockchain.crypto import KeyPairGenerator
-from blockchain.wallet import get_balance
+from blockchain.transaction_handler import TransactionHandler
+from blockchain.transaction_pool import TransactionPool
+from blockchain.utxo import UTXO
+from blockchain.utxo_pool import UTXOPool
+from blockchain.crypto import BatchSigner, KeyPairGenerator, SignatureCache
+from blockchain.merkle import MerkleTree
+from blockchain import codec, crypto
+from blockchain.storage import BlockStore
+from blockchain.wallet import (
+    TransactionBuilder,
+    get_balance,
+    get_balances,
+    get_history,
+    list_unspent,
+)
+from blockchain.chain_io import export_chain, import_chain, read_genesis
+from blockchain.history import RECEIVED, SENT, HistoryIndex
+from blockchain.metrics import MemorySink, Metrics, PrometheusSink
+from blockchain.mining import Miner, ProofOfWork, get_work, target_from_bits
+from blockchain.node import (
+    MSG_BLOCK,
+    MSG_TRANSACTION,
+    STATUS_MALFORMED,
+    Node,
+    NodeClient,
+)
+from blockchain.sync import (
+    MAX_HEADERS,
+    BlockHeader,
+    LocalPeer,
+    Synchronizer,
+    get_locator,
+)
+
+
+@pytest.fixture
+def merkle() -> bool:
+    """Format des blocs générés ; paramétré par les tests qui couvrent les deux."""
+    return False
+
+
+@pytest.fixture
+def generator(merkle: bool) -> ChainGenerator:
+    """Générateur de chaîne déterministe partagé par les tests : trois
+    portefeuilles, la genèse est payée au premier."""
+    return ChainGenerator(Wallets(3, random.Random(0)), random.Random(1), merkle=merkle)
 
 
 class TestIFTCoin:
@@ -134,7 +188,11 @@ class TestIFTCoin:
         tx4.add_input(tx3.hash, 0)  # Cette entrée n'a que 20 iftcoins
         tx4.sign(bob_sk, 0)
 
-        blockchain.add_transaction(tx4)
+        # La transaction invalide est refusée à l'admission dans le pool ;
+        # on l'y insère directement, sans validation
+        assert not blockchain.add_transaction(tx4)
+        assert not blockchain.tx_pool.pool
+        blockchain.tx_pool.add_transaction(tx4)
         block4.add_transaction(tx4)
         block4.finalize()
         assert not block_handler.process_block(block4)
@@ -182,3 +240,1444 @@ class TestIFTCoin:
 
         # On ne peut pas créer de bloc contenant 0 transactions
         assert block_handler.create_block(alice_pk) is None
+
+    def test_utxo_pool_layers(self):
+        _, pk = KeyPairGenerator.generate_key_pair()
+        base: UTXOPool = UTXOPool()
+        utxo_a, utxo_b, utxo_c = UTXO(b"a", 0), UTXO(b"b", 0), UTXO(b"c", 0)
+        base.add_utxo(utxo_a, Transaction.Output(1, pk))
+        base.add_utxo(utxo_b, Transaction.Output(2, pk))
+
+        # La couche ne copie rien et ne modifie pas son parent
+        layer: UTXOPool = UTXOPool.from_utxo_pool(base)
+        assert layer.parent is base and not layer.pool
+        layer.remove_utxo(utxo_a)
+        layer.add_utxo(utxo_c, Transaction.Output(3, pk))
+
+        assert utxo_a in base and utxo_a not in layer
+        assert utxo_c in layer and utxo_c not in base
+        assert layer.get_tx_output(utxo_b).value == 2
+        assert set(layer.get_all_utxo()) == {utxo_b, utxo_c}
+
+        with pytest.raises(KeyError):
+            layer.remove_utxo(utxo_a)
+
+        # Un instantané a le même contenu, sans parent
+        snapshot: UTXOPool = layer.flatten()
+        assert snapshot.parent is None and snapshot.depth == 0
+        assert set(snapshot.get_all_utxo()) == {utxo_b, utxo_c}
+
+    def test_batch_signature_verification(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        bob_sk, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block, signature_workers=2)
+        assert blockchain.verifier is not None
+        blockchain.verifier.chunk_size = 1  # force l'utilisation du pool
+
+        # tx1 est valide, tx2 (enfant de tx1) aussi, tx3 est signée par la mauvaise clé
+        tx1: Transaction = Transaction()
+        tx1.add_input(genesis_block.coinbase.hash, 0)
+        tx1.add_output(10, bob_pk)
+        tx1.add_output(15, alice_pk)
+        tx1.sign(alice_sk, 0)
+        tx2: Transaction = Transaction()
+        tx2.add_input(tx1.hash, 0)
+        tx2.add_output(10, alice_pk)
+        tx2.sign(bob_sk, 0)
+        tx3: Transaction = Transaction()
+        tx3.add_input(tx1.hash, 1)
+        tx3.add_output(15, bob_pk)
+        tx3.sign(bob_sk, 0)
+
+        try:
+            checks = [
+                (alice_pk, tx1.get_raw_data_to_sign(0), tx1.inputs[0].signature),
+                (alice_pk, tx3.get_raw_data_to_sign(0), tx3.inputs[0].signature),
+            ]
+            assert blockchain.verifier.find_invalid(checks[:1]) is None
+            assert blockchain.verifier.find_invalid(checks) == 1
+            assert blockchain.verifier.find_all_invalid(checks + checks) == [1, 3]
+
+            # Toutes les signatures invalides sont écartées en un passage ; seule
+            # tx5, qui dépense la même sortie que tx3, est vérifiée ensuite
+            tx4: Transaction = Transaction()
+            tx4.add_input(tx2.hash, 0)
+            tx4.add_output(10, bob_pk)
+            tx4.sign(bob_sk, 0)
+            tx5: Transaction = Transaction()
+            tx5.add_input(tx1.hash, 1)
+            tx5.add_output(15, bob_pk)
+            tx5.sign(alice_sk, 0)
+            sink = MemorySink()
+            handler: TransactionHandler = TransactionHandler(
+                blockchain.get_max_height_utxo_pool(),
+                blockchain.verifier,
+                metrics=Metrics(sink),
+            )
+            assert handler.handle_transactions([tx1, tx2, tx3, tx5, tx4]) == [
+                tx1,
+                tx2,
+                tx5,
+            ]
+            assert sink.get_counter("signatures") == 5
+
+            # Un bloc contenant une signature invalide est refusé
+            bad_block: Block = Block(bob_pk, genesis_block.hash)
+            for tx in (tx1, tx2, tx3):
+                bad_block.add_transaction(tx)
+            bad_block.finalize()
+            assert not blockchain.add_block(bad_block)
+
+            # create_block écarte la transaction invalide et garde les autres
+            # (tx3, refusée à l'admission, est insérée directement dans le pool)
+            block_handler: BlockHandler = BlockHandler(blockchain)
+            assert block_handler.process_transaction(tx1)
+            assert block_handler.process_transaction(tx2)
+            assert not block_handler.process_transaction(tx3)
+            blockchain.tx_pool.add_transaction(
+                tx3, blockchain.get_max_height_utxo_pool()
+            )
+            block: Block | None = block_handler.create_block(bob_pk)
+            assert block is not None and block.transactions == [tx1, tx2]
+            assert get_balance(blockchain, alice_pk) == 25
+            assert get_balance(blockchain, bob_pk) == 25
+        finally:
+            blockchain.verifier.close()
+
+    def test_batch_signing(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+        _, carol_pk = KeyPairGenerator.generate_key_pair()
+        _, miner_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block)
+        block_handler: BlockHandler = BlockHandler(blockchain)
+
+        # Alice découpe sa coinbase en 10 sorties de 2.5
+        split: Transaction = Transaction()
+        split.add_input(genesis_block.coinbase.hash, 0)
+        for _ in range(10):
+            split.add_output(2.5, alice_pk)
+        with pytest.raises(ValueError):
+            split.sign_all([alice_sk, alice_sk])
+        split.sign_all(alice_sk)
+        assert block_handler.process_transaction(split)
+        assert block_handler.create_block(miner_pk) is not None
+
+        # Deux paiements signés en un lot, dans des processus, sans UTXO commun
+        signer: BatchSigner = BatchSigner(workers=2, chunk_size=2)
+        builder: TransactionBuilder = TransactionBuilder(blockchain, [alice_sk], signer)
+        try:
+            pay_bob, pay_carol = builder.build_batch(
+                [[(bob_pk, 4)], [(carol_pk, 6)]], fee=0.5
+            )
+        finally:
+            signer.close()
+        assert (pay_bob.num_inputs(), pay_carol.num_inputs()) == (2, 3)
+        assert pay_bob.outputs[-1].value == 0.5 and pay_carol.outputs[-1].value == 1
+        for tx in (pay_bob, pay_carol):
+            assert tx.hash == hashlib.sha256(tx.to_bytes()).digest()
+            assert block_handler.process_transaction(tx)
+            assert blockchain.tx_pool.entries[tx.hash].fee == 0.5
+
+        # Les UTXOs dépensés par le memory pool ne sont plus proposés
+        assert len(builder.get_spendable()) == 5
+        with pytest.raises(ValueError):
+            builder.build([(bob_pk, 20)])
+        assert len(builder.reserved) == 5
+
+        assert block_handler.create_block(miner_pk) is not None
+        assert len(builder.get_spendable()) == 7
+        assert not builder.reserved
+        assert get_balances(blockchain, [alice_pk, bob_pk, carol_pk]) == [14, 4, 6]
+
+    def test_signature_cache(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block)
+        block_handler: BlockHandler = BlockHandler(blockchain)
+
+        tx1: Transaction = Transaction()
+        tx1.add_input(genesis_block.coinbase.hash, 0)
+        tx1.add_output(25, bob_pk)
+        tx1.sign(alice_sk, 0)
+        block_handler.process_transaction(tx1)
+
+        # Vérifiée à l'admission, puis retrouvée dans le cache par le gabarit ;
+        # add_block ne revérifie pas les transactions du gabarit
+        assert block_handler.create_block(alice_pk) is not None
+        stats = blockchain.signature_cache.stats()
+        assert stats["misses"] == 1 and stats["hits"] == 1 and stats["size"] == 1
+
+        # Une transaction qui reprend le hash et la signature de tx1 avec d'autres
+        # sorties n'est pas trouvée dans le cache : sa signature est vérifiée
+        forged: Transaction = Transaction()
+        forged.add_input(genesis_block.coinbase.hash, 0)
+        forged.add_output(25, alice_pk)
+        forged.add_signature(tx1.inputs[0].signature, 0)
+        forged.hash = tx1.hash
+        genesis_pool = blockchain.blockchain[genesis_block.hash.hex()].utxo_pool
+        handler: TransactionHandler = TransactionHandler(
+            genesis_pool, signature_cache=blockchain.signature_cache
+        )
+        assert not handler.is_valid_transaction(forged)
+        assert handler.is_valid_transaction(tx1)
+        assert blockchain.signature_cache.stats()["hits"] == 2
+
+        cache: SignatureCache = SignatureCache(max_size=1)
+        cache.add(b"a")
+        cache.add(b"b")
+        assert not cache.contains(b"a")
+        assert cache.contains(b"b")
+        assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 1}
+
+    def test_address_index(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+        _, carol_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block)
+
+        tx1: Transaction = Transaction()
+        tx1.add_input(genesis_block.coinbase.hash, 0)
+        tx1.add_output(10, bob_pk)
+        tx1.add_output(15, alice_pk)
+        tx1.sign(alice_sk, 0)
+
+        # Deux blocs concurrents au-dessus de la genèse
+        block1: Block = Block(carol_pk, genesis_block.hash)
+        block1.add_transaction(tx1)
+        block1.finalize()
+        fork: Block = Block(bob_pk, genesis_block.hash)
+        fork.add_transaction(tx1)
+        fork.finalize()
+        assert blockchain.add_block(block1)
+        assert blockchain.add_block(fork)
+
+        assert get_balances(blockchain, [alice_pk, bob_pk, carol_pk]) == [15, 10, 25]
+        assert list_unspent(blockchain, bob_pk) == [(UTXO(tx1.hash, 0), tx1.outputs[0])]
+
+        fork_pool: UTXOPool = blockchain.blockchain[fork.hash.hex()].utxo_pool
+        assert fork_pool.get_balances([alice_pk, bob_pk, carol_pk]) == [15, 35, 0]
+        assert len(fork_pool.list_unspent(bob_pk)) == 2
+
+        # L'index reste cohérent après aplatissement
+        snapshot: UTXOPool = fork_pool.flatten()
+        assert snapshot.get_balances([alice_pk, bob_pk, carol_pk]) == [15, 35, 0]
+        assert len(snapshot.list_unspent(alice_pk)) == 1
+
+        # Le solde est exact malgré les valeurs non représentables en binaire,
+        # et revient à 0 quand tout est dépensé
+        layer: UTXOPool = UTXOPool(snapshot)
+        dust: list[UTXO] = [UTXO(bytes(32), i) for i in range(3)]
+        for utxo, value in zip(dust, (0.1, 0.2, 0.7)):
+            layer.add_utxo(utxo, Transaction.Output(value, carol_pk))
+        assert layer.get_balance(carol_pk) == 1.0
+        layer.remove_utxo(dust[2])
+        assert layer.get_balance(carol_pk) == 0.3
+        for utxo in dust[:2]:
+            layer.remove_utxo(utxo)
+        assert layer.get_balance(carol_pk) == 0
+
+    def test_transaction_serialization(self):
+        _, pk = KeyPairGenerator.generate_key_pair()
+        raw_pk: bytes = pk.to_string()
+
+        tx: Transaction = Transaction()
+        tx.add_input(b"\x01" * 32, 3)
+        tx.add_output(5, pk)
+        tx.add_signature(b"\x02" * 64, 0)
+        assert tx.get_raw_data_to_sign(0) == (
+            b"\x01" * 32 + b"\x00\x03" + struct.pack("f", 5) + raw_pk
+        )
+        assert tx.to_bytes() == (
+            b"\x01" * 32 + b"\x00\x03" + b"\x02" * 64 + struct.pack("f", 5) + raw_pk
+        )
+
+        # Les encodages en cache sont invalidés quand la transaction change
+        tx.add_output(2.5, pk)
+        outputs: bytes = struct.pack("f", 5) + raw_pk + struct.pack("f", 2.5) + raw_pk
+        assert tx.get_raw_data_to_sign(0).endswith(outputs)
+        assert tx.to_bytes().endswith(b"\x02" * 64 + outputs)
+
+        # ... y compris quand la signature est ajoutée directement à l'entrée
+        tx.inputs[0].add_signature(b"\x04" * 64)
+        assert tx.to_bytes().endswith(b"\x04" * 64 + outputs)
+        tx.inputs[0].signature = b"\x05" * 64
+        assert tx.to_bytes().endswith(b"\x05" * 64 + outputs)
+
+        # ... ou quand la valeur d'une sortie est modifiée
+        tx.generate_hash()
+        old_hash: bytes = tx.hash
+        message: bytes = tx.get_raw_data_to_sign(0)
+        tx.outputs[0].value = 6
+        tx.generate_hash()
+        assert tx.hash != old_hash
+        assert tx.get_raw_data_to_sign(0) != message
+        assert tx.get_outputs_bytes().startswith(struct.pack("f", 6) + raw_pk)
+
+        block: Block = Block(pk, prev_block_hash=b"\x03" * 32)
+        block.add_transaction(tx)
+        assert block.to_bytes() == b"\x03" * 32 + tx.to_bytes()
+
+    def test_merkle_block(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        # L'arbre incrémental donne la même racine qu'un arbre construit d'un coup
+        leaves: list[bytes] = [bytes([i]) * 32 for i in range(7)]
+        tree: MerkleTree = MerkleTree()
+        for i, leaf in enumerate(leaves):
+            tree.append(leaf)
+            assert tree.root() == MerkleTree(leaves[: i + 1]).root()
+            for j in range(i + 1):
+                assert MerkleTree.verify_proof(
+                    leaves[j], tree.get_proof(j), tree.root()
+                )
+        assert not MerkleTree.verify_proof(leaves[0], tree.get_proof(1), tree.root())
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None, merkle=True)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block)
+
+        tx1: Transaction = Transaction()
+        tx1.add_input(genesis_block.coinbase.hash, 0)
+        tx1.add_output(25, bob_pk)
+        tx1.sign(alice_sk, 0)
+
+        block: Block = Block(bob_pk, genesis_block.hash, merkle=True)
+        root_before: bytes = block.get_merkle_root()
+        block.add_transaction(tx1)
+        block.finalize()
+        assert block.get_merkle_root() != root_before
+        assert block.to_bytes() == genesis_block.hash + block.get_merkle_root()
+
+        for tx in (block.coinbase, tx1):
+            proof = block.get_inclusion_proof(tx.hash)
+            assert MerkleTree.verify_proof(tx.hash, proof, block.get_merkle_root())
+        with pytest.raises(ValueError):
+            block.get_inclusion_proof(genesis_block.coinbase.hash)
+
+        assert blockchain.add_block(block)
+        assert get_balance(blockchain, bob_pk) == 50
+
+    def test_block_template(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        bob_sk, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block)
+        block_handler: BlockHandler = BlockHandler(blockchain)
+
+        # parent : frais de 1 ; enfant : frais de 9, paie pour son parent
+        parent: Transaction = Transaction()
+        parent.add_input(genesis_block.coinbase.hash, 0)
+        parent.add_output(14, bob_pk)
+        parent.add_output(10, alice_pk)
+        parent.sign(alice_sk, 0)
+        child: Transaction = Transaction()
+        child.add_input(parent.hash, 0)
+        child.add_output(5, bob_pk)
+        child.sign(bob_sk, 0)
+        grandchild: Transaction = Transaction()
+        grandchild.add_input(child.hash, 0)
+        grandchild.add_output(5, alice_pk)
+        grandchild.sign(bob_sk, 0)
+
+        # L'enfant arrive avant son parent : gardé hors du memory pool
+        assert not block_handler.process_transaction(grandchild)
+        assert not block_handler.process_transaction(child)
+        assert set(blockchain.orphans) == {grandchild.hash, child.hash}
+        assert not blockchain.tx_pool.pool
+        assert block_handler.process_transaction(parent)
+        assert not blockchain.orphans
+
+        entries = blockchain.tx_pool.entries
+        assert entries[child.hash].parents == {parent.hash}
+        assert entries[parent.hash].children == {child.hash}
+        assert (entries[parent.hash].fee, entries[child.hash].fee) == (1, 9)
+        assert blockchain.tx_pool.get_ancestors(grandchild.hash) == {
+            parent.hash,
+            child.hash,
+        }
+
+        assert blockchain.tx_pool.get_block_template() == [parent, child, grandchild]
+        # Seul le paquet parent + enfant tient dans la limite de taille
+        size: int = entries[parent.hash].size + entries[child.hash].size
+        assert blockchain.tx_pool.get_block_template(size) == [parent, child]
+
+        block: Block | None = block_handler.create_block(bob_pk)
+        assert block is not None
+        assert block.transactions == [parent, child, grandchild]
+        assert not blockchain.tx_pool.pool
+
+    def test_incremental_block_template(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        bob_sk, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        sink = MemorySink()
+        blockchain: Blockchain = Blockchain(genesis_block, metrics=Metrics(sink))
+        block_handler: BlockHandler = BlockHandler(blockchain)
+
+        tx1: Transaction = Transaction()
+        tx1.add_input(genesis_block.coinbase.hash, 0)
+        tx1.add_output(10, bob_pk)
+        tx1.add_output(15, alice_pk)
+        tx1.sign(alice_sk, 0)
+        tx2: Transaction = Transaction()
+        tx2.add_input(tx1.hash, 0)
+        tx2.add_output(10, alice_pk)
+        tx2.sign(bob_sk, 0)
+        tx3: Transaction = Transaction()
+        tx3.add_input(tx1.hash, 1)
+        tx3.add_output(15, bob_pk)
+        tx3.sign(alice_sk, 0)
+        # Dépense la même sortie que tx3
+        double_spend: Transaction = Transaction()
+        double_spend.add_input(tx1.hash, 1)
+        double_spend.add_output(14, alice_pk)
+        double_spend.sign(alice_sk, 0)
+
+        # Les transactions admises hors du BlockHandler sont rattrapées
+        assert block_handler.process_transaction(tx1)
+        assert blockchain.add_transaction(tx2)
+        assert block_handler.process_transaction(tx3)
+        template = block_handler.template
+        assert list(template.transactions.values()) == [tx1, tx2, tx3]
+        assert template.utxo_pool.parent is blockchain.get_max_height_utxo_pool()
+
+        # Un bloc reçu confirme tx1 et entre en conflit avec tx3 : le gabarit
+        # avance sans être reconstruit et ne garde que tx2
+        received: Block = Block(bob_pk, genesis_block.hash)
+        received.add_transaction(tx1)
+        received.add_transaction(double_spend)
+        received.finalize()
+        assert block_handler.process_block(received)
+        assert template.node is blockchain.max_height_node
+        assert list(template.transactions.values()) == [tx2]
+        assert sink.get_counter("block_template", event="rebuild") == 1
+        assert sink.get_counter("block_template", event="advance") == 1
+
+        # Une couche qui ne correspond pas aux transactions du bloc est ignorée :
+        # le bloc est validé normalement et tx3 est refusée
+        forged: Block = Block(alice_pk, received.hash)
+        forged.add_transaction(tx3)
+        forged.finalize()
+        assert not blockchain.add_block(forged, template.utxo_pool)
+        assert sink.get_span("add_block_stage", stage="transactions")[0] == 2
+
+        # add_block reprend le pool UTXO du gabarit sans revalider tx2
+        block: Block | None = block_handler.create_block(alice_pk)
+        assert block is not None and block.transactions == [tx2]
+        assert sink.get_span("add_block_stage", stage="transactions")[0] == 2
+        assert get_balance(blockchain, alice_pk) == 14 + 10 + 25
+        assert not template.transactions and not blockchain.tx_pool.pool
+
+    def test_mempool_admission(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block)
+        tx_pool: TransactionPool = blockchain.tx_pool
+
+        def pay(value: float) -> Transaction:
+            tx: Transaction = Transaction()
+            tx.add_input(genesis_block.coinbase.hash, 0)
+            tx.add_output(value, bob_pk)
+            tx.sign(alice_sk, 0)
+            return tx
+
+        # Signature invalide : refusée
+        forged: Transaction = pay(20)
+        forged.add_signature(forged.inputs[0].signature[::-1], 0)
+        forged.generate_hash()
+        assert not blockchain.add_transaction(forged)
+
+        low, high, higher = pay(24), pay(20), pay(20.5)
+        assert blockchain.add_transaction(low)
+        assert tx_pool.get_conflicts(high) == {low.hash}
+
+        # Remplacement seulement si les frais augmentent
+        assert blockchain.add_transaction(high)
+        assert set(tx_pool.pool) == {high.hash}
+        assert not blockchain.add_transaction(higher)
+        assert set(tx_pool.pool) == {high.hash}
+        assert tx_pool.spenders == {UTXO(genesis_block.coinbase.hash, 0): high.hash}
+
+        # Éviction par âge, puis par taille
+        tx_pool.expire(now=tx_pool.entries[high.hash].time + tx_pool.MAX_AGE + 1)
+        assert not tx_pool.pool and not tx_pool.spenders and tx_pool.size == 0
+
+        tx_pool.max_size = 1
+        assert not blockchain.add_transaction(low)
+        assert not tx_pool.pool and tx_pool.size == 0
+
+    @pytest.mark.parametrize("stored", [False, True])
+    def test_mempool_orphans(self, tmp_path, stored):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        bob_sk, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        store = BlockStore(tmp_path) if stored else None
+        blockchain: Blockchain = Blockchain(genesis_block, store=store)
+        block_handler: BlockHandler = BlockHandler(blockchain)
+
+        def spend(prev_tx_hash: bytes, sk, value: float) -> Transaction:
+            tx: Transaction = Transaction()
+            tx.add_input(prev_tx_hash, 0)
+            tx.add_output(value, bob_pk)
+            tx.sign(sk, 0)
+            return tx
+
+        parent = spend(genesis_block.coinbase.hash, alice_sk, 25)
+        child = spend(parent.hash, bob_sk, 25)
+
+        # L'enfant arrive avant son parent, qui est confirmé par un bloc
+        assert not block_handler.process_transaction(child)
+        assert set(blockchain.orphans) == {child.hash} and not blockchain.tx_pool.pool
+        block: Block = Block(bob_pk, genesis_block.hash)
+        block.add_transaction(parent)
+        block.finalize()
+        assert block_handler.process_block(block)
+        assert blockchain.is_confirmed(parent.hash)
+        assert not blockchain.orphans and set(blockchain.tx_pool.pool) == {child.hash}
+        assert list(block_handler.template.transactions) == [child.hash]
+
+        # Sortie d'une transaction confirmée déjà dépensée : refusée
+        assert not block_handler.process_transaction(
+            spend(genesis_block.coinbase.hash, alice_sk, 1000)
+        )
+        # Entrée inexistante : orpheline bornée, jamais dans le memory pool
+        for i in range(Blockchain.MAX_ORPHANS + 5):
+            assert not blockchain.add_transaction(
+                spend(i.to_bytes(32, "big"), bob_sk, 1000)
+            )
+        assert len(blockchain.orphans) == Blockchain.MAX_ORPHANS
+        assert set(blockchain.tx_pool.pool) == {child.hash}
+        if store is not None:
+            store.close()
+
+    def test_mempool_reorganisation(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        bob_sk, bob_pk = KeyPairGenerator.generate_key_pair()
+        carol_sk, carol_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block)
+
+        def make_tx(prev: Transaction, index: int, sk, outputs) -> Transaction:
+            tx: Transaction = Transaction()
+            tx.add_input(prev.hash, index)
+            for value, pk in outputs:
+                tx.add_output(value, pk)
+            tx.sign(sk, 0)
+            return tx
+
+        def make_block(parent: Block, miner, txs: list[Transaction]) -> Block:
+            assert parent.hash is not None
+            block: Block = Block(miner, parent.hash)
+            for tx in txs:
+                block.add_transaction(tx)
+            block.finalize()
+            return block
+
+        split = make_tx(
+            genesis_block.coinbase, 0, alice_sk, [(10, alice_pk), (15, alice_pk)]
+        )
+        base: Block = make_block(genesis_block, bob_pk, [split])
+        assert blockchain.add_block(base)
+
+        # Branche A : tx_a confirmée, son enfant tx_c dans le pool
+        tx_a = make_tx(split, 0, alice_sk, [(10, bob_pk)])
+        block_a: Block = make_block(base, carol_pk, [tx_a])
+        assert blockchain.add_block(block_a)
+        tx_c = make_tx(tx_a, 0, bob_sk, [(10, carol_pk)])
+        # tx_d dépense la coinbase du bloc A, qui disparaîtra
+        tx_d = make_tx(block_a.coinbase, 0, carol_sk, [(25, alice_pk)])
+        assert blockchain.add_transaction(tx_c)
+        assert blockchain.add_transaction(tx_d)
+
+        # Branche B, plus longue, qui confirme une transaction du pool
+        tx_b = make_tx(split, 1, alice_sk, [(15, carol_pk)])
+        assert blockchain.add_transaction(tx_b)
+        block_b1: Block = make_block(base, alice_pk, [tx_b])
+        assert blockchain.add_block(block_b1)
+        assert blockchain.get_max_height_block() is block_a  # pas encore de réorg
+        assert set(blockchain.tx_pool.pool) == {tx_c.hash, tx_d.hash, tx_b.hash}
+
+        block_b2: Block = make_block(
+            block_b1,
+            alice_pk,
+            [make_tx(block_b1.coinbase, 0, alice_sk, [(25, bob_pk)])],
+        )
+        assert blockchain.add_block(block_b2)
+        assert blockchain.get_max_height_block() is block_b2
+
+        # tx_a revient dans le pool avant son enfant, tx_b est confirmée et
+        # tx_d, qui dépense une coinbase abandonnée, est retirée
+        assert set(blockchain.tx_pool.pool) == {tx_a.hash, tx_c.hash}
+        assert blockchain.tx_pool.get_block_template() == [tx_a, tx_c]
+
+        disconnected, connected = Blockchain.get_fork_path(
+            blockchain.blockchain[block_b2.hash.hex()],
+            blockchain.blockchain[block_a.hash.hex()],
+        )
+        assert [node.block for node in disconnected] == [block_b2, block_b1]
+        assert [node.block for node in connected] == [block_a]
+
+    def test_pruning(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block, auto_prune=False)
+
+        def extend(parent: Block, prev_tx: Transaction) -> tuple[Block, Transaction]:
+            tx: Transaction = Transaction()
+            tx.add_input(prev_tx.hash, 0)
+            tx.add_output(25, alice_pk)
+            tx.sign(alice_sk, 0)
+            assert parent.hash is not None
+            block: Block = Block(bob_pk, parent.hash)
+            block.add_transaction(tx)
+            block.finalize()
+            assert blockchain.add_block(block)
+            return block, tx
+
+        block, tx = extend(genesis_block, genesis_block.coinbase)
+        stale, _ = extend(block, tx)  # branche abandonnée à la hauteur 3
+        for _ in range(15):
+            block, tx = extend(block, tx)
+        assert blockchain.max_height_node.height == 17
+        assert blockchain.get_max_height_block() is block
+
+        dropped: list[weakref.ref] = [
+            weakref.ref(node.utxo_pool)
+            for height in range(1, 7)
+            for node in blockchain.heights[height]
+            if node.utxo_pool is not None
+        ]
+        before: dict[str, int] = blockchain.memory_usage()
+        report: dict[str, int] = blockchain.prune()
+        after: dict[str, int] = blockchain.memory_usage()
+
+        # Horizon : 17 - CUT_OFF_AGE = 7 ; les hauteurs 1 à 6 sont élaguées
+        assert report == {"pools_dropped": 7, "nodes_removed": 1}
+        assert stale.hash.hex() not in blockchain.blockchain
+        assert after["block_nodes"] == before["block_nodes"] - 1 == 17
+        assert after["utxo_pools"] == before["utxo_pools"] - 7
+        assert after["utxo_layers"] < before["utxo_layers"]
+        assert after["utxo_entries"] < before["utxo_entries"]
+        assert blockchain.prune() == {"pools_dropped": 0, "nodes_removed": 0}
+
+        # Les pools abandonnés ne sont plus retenus par les couches au-dessus
+        gc.collect()
+        assert len(dropped) == 7
+        assert all(ref() is None for ref in dropped)
+
+        # Le solde et l'ajout de blocs ne sont pas affectés
+        assert get_balance(blockchain, alice_pk) == 25
+        block, tx = extend(block, tx)
+
+        # Le pool de hauteur 7, instantané complet, est repris par son enfant
+        horizon_pool = blockchain.heights[7][0].utxo_pool
+        pool = blockchain.heights[8][0].utxo_pool
+        assert horizon_pool is not None and horizon_pool.parent is None
+        assert pool is not None and pool.parent is horizon_pool
+        expected = dict(pool.items())
+        assert blockchain.prune() == {"pools_dropped": 1, "nodes_removed": 0}
+        assert pool.parent is None and pool.pool is horizon_pool.pool
+        assert dict(pool.items()) == expected
+        assert get_balance(blockchain, alice_pk) == 25
+
+    def test_pruning_abandoned_fork(self):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        blockchain: Blockchain = Blockchain(genesis_block, auto_prune=False)
+
+        def extend(parent: Block, prev_tx: Transaction) -> tuple[Block, Transaction]:
+            tx: Transaction = Transaction()
+            tx.add_input(prev_tx.hash, 0)
+            tx.add_output(25, alice_pk)
+            tx.sign(alice_sk, 0)
+            assert parent.hash is not None
+            block: Block = Block(bob_pk, parent.hash)
+            block.add_transaction(tx)
+            block.finalize()
+            assert blockchain.add_block(block)
+            return block, tx
+
+        # Branche abandonnée de deux blocs, aux hauteurs 3 et 4
+        block, tx = extend(genesis_block, genesis_block.coinbase)
+        stale, stale_tx = extend(block, tx)
+        stale_child, _ = extend(stale, stale_tx)
+        for _ in range(12):
+            block, tx = extend(block, tx)
+        assert blockchain.max_height_node.height == 14
+
+        # Horizon 4 : le noeud de hauteur 3 est gardé, sa branche l'atteint
+        assert blockchain.prune()["nodes_removed"] == 0
+        assert stale.hash.hex() in blockchain.blockchain
+
+        # Horizon 5 : la hauteur 3 n'est plus parcourue, mais le noeud est retiré
+        # avec son dernier enfant
+        block, tx = extend(block, tx)
+        assert blockchain.prune()["nodes_removed"] == 2
+        assert stale.hash.hex() not in blockchain.blockchain
+        assert stale_child.hash.hex() not in blockchain.blockchain
+        assert blockchain.memory_usage()["block_nodes"] == 15
+
+    def test_block_store(self, tmp_path):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        bob_sk, bob_pk = KeyPairGenerator.generate_key_pair()
+        _, miner_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        store: BlockStore = BlockStore(tmp_path)
+        blockchain: Blockchain = Blockchain(genesis_block, store=store)
+
+        def extend(
+            parent: Block,
+            prev_tx: Transaction,
+            sk: SigningKey,
+            pk: VerifyingKey,
+            value: float,
+        ) -> tuple[Block, Transaction]:
+            tx: Transaction = Transaction()
+            tx.add_input(prev_tx.hash, 0)
+            tx.add_output(value, pk)
+            tx.sign(sk, 0)
+            assert parent.hash is not None
+            block: Block = Block(miner_pk, parent.hash, merkle=True)
+            block.add_transaction(tx)
+            block.finalize()
+            assert blockchain.add_block(block)
+            return block, tx
+
+        block2, tx1 = extend(
+            genesis_block, genesis_block.coinbase, alice_sk, bob_pk, 25
+        )
+        block3, _ = extend(block2, tx1, bob_sk, alice_pk, 25)
+        fork3, fork_tx = extend(block2, tx1, bob_sk, alice_pk, 20)
+        store.close()
+
+        # Écriture interrompue après le dernier bloc indexé
+        with open(tmp_path / (BlockStore.BLOCK_FILE % 0), "ab") as f:
+            f.write(b"\xff" * 100)
+
+        store = BlockStore(tmp_path)
+        blockchain = Blockchain.open(store)
+        assert blockchain.max_height_node.hash == block3.hash
+        # Les coinbases de miner_pk ont le même hash : chacune remplace la précédente
+        assert get_balances(blockchain, [alice_pk, bob_pk, miner_pk]) == [25, 0, 25]
+        restored: Block = blockchain.get_max_height_block()
+        assert restored.hash == block3.hash
+        assert restored.get_merkle_root() == block3.get_merkle_root()
+        assert [tx.to_bytes() for tx in restored.transactions] == [
+            tx.to_bytes() for tx in block3.transactions
+        ]
+
+        # Le pool UTXO de la branche concurrente est reconstruit depuis les deltas
+        extend(fork3, fork_tx, alice_sk, bob_pk, 20)
+        assert get_balances(blockchain, [alice_pk, bob_pk, miner_pk]) == [0, 20, 25]
+        store.close()
+
+        with BlockStore(tmp_path) as store:
+            blockchain = Blockchain.open(store)
+            assert blockchain.max_height_node.height == 4
+            assert get_balances(blockchain, [alice_pk, bob_pk, miner_pk]) == [0, 20, 25]
+            with pytest.raises(ValueError):
+                Blockchain(genesis_block, store=store)
+
+    def test_block_views(self, tmp_path):
+        alice_sk, alice_pk = KeyPairGenerator.generate_key_pair()
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+
+        genesis_block: Block = Block(alice_pk, prev_block_hash=None)
+        genesis_block.finalize()
+        store: BlockStore = BlockStore(tmp_path)
+        blockchain: Blockchain = Blockchain(genesis_block, store=store)
+
+        tx: Transaction = Transaction()
+        tx.add_input(genesis_block.coinbase.hash, 0)
+        tx.add_output(10, bob_pk)
+        tx.add_output(15, alice_pk)
+        tx.sign(alice_sk, 0)
+        block: Block = Block(bob_pk, genesis_block.hash)
+        block.add_transaction(tx)
+        block.finalize()
+        assert blockchain.add_block(block)
+
+        # Vue sur un bloc écrit après la projection du fichier
+        view: codec.BlockView = store.read_block_view(block.hash)
+        assert view.hash == block.hash
+        assert view.prev_block_hash == genesis_block.hash
+        assert not view.is_merkle()
+        assert view.num_transactions() == 1
+        assert view.coinbase.is_coinbase()
+        assert view.to_block().to_bytes() == block.to_bytes()
+
+        tx_view: codec.TransactionView = store.read_transaction(tx.hash)
+        assert tx_view.hash == tx.hash
+        assert not tx_view.is_coinbase()
+        assert (tx_view.num_inputs(), tx_view.num_outputs()) == (1, 2)
+        prev_tx_hash, output_index, signature = tx_view.get_input(0)
+        assert bytes(prev_tx_hash) == genesis_block.coinbase.hash
+        assert output_index == 0
+        assert bytes(signature) == tx.inputs[0].signature
+        value, address = tx_view.get_output(1)
+        assert (value, bytes(address)) == (15, alice_pk.to_string())
+        assert tx_view.to_transaction().to_bytes() == tx.to_bytes()
+        with pytest.raises(ValueError):
+            tx_view.get_output(2)
+
+        assert [view.hash for view in store.iter_blocks()] == [
+            genesis_block.hash,
+            block.hash,
+        ]
+        assert store.locate_transaction(tx.hash)[0][0] == block.hash
+        assert store.read_transaction(bytes(32)) is None
+        store.close()
+
+    def test_compact_data_model(self):
+        _, alice_pk = KeyPairGenerator.generate_key_pair()
+        raw: bytes = alice_pk.to_string()
+
+        utxo: UTXO = UTXO(bytes(32), 1)
+        assert not hasattr(utxo, "__dict__")
+        assert utxo == UTXO(bytes(32), 1) and hash(utxo) == hash(UTXO(bytes(32), 1))
+        assert utxo != UTXO(bytes(32), 0)
+        # Son hash est mis en cache : le UTXO ne peut pas être modifié
+        with pytest.raises(AttributeError):
+            utxo.index = 0  # type: ignore[misc]
+        with pytest.raises(AttributeError):
+            utxo.tx_hash = bytes(32)  # type: ignore[misc]
+
+        # Une sortie créée depuis l'adresse brute ne décode la clé qu'à la demande
+        output: Transaction.Output = codec.decode_output(2.5, raw)
+        assert not hasattr(output, "__dict__")
+        assert output._address is None
+        assert output.get_raw_address() is raw
+        assert output.address.to_string() == raw
+        assert output.to_bytes() == Transaction.Output(2.5, alice_pk).to_bytes()
+
+        tx: Transaction = Transaction()
+        tx.add_output(2.5, raw)
+        assert not hasattr(tx, "__dict__")
+        assert not hasattr(tx.outputs[0], "__dict__")
+
+        # Changer l'adresse d'une sortie invalide les encodages de sa transaction
+        _, bob_pk = KeyPairGenerator.generate_key_pair()
+        before: bytes = tx.to_bytes()
+        tx.outputs[0].address = bob_pk
+        assert tx.outputs[0].get_raw_address() == bob_pk.to_string()
+        assert tx.outputs[0].address is bob_pk
+        assert tx.to_bytes() != before
+        assert tx.get_outputs_bytes() == Transaction.Output(2.5, bob_pk).to_bytes()
+        tx.outputs[0].address = raw
+        assert tx.outputs[0]._address is None
+        assert tx.to_bytes() == before
+
+    @pytest.mark.parametrize("name", ["ecdsa", "cryptography", "coincurve"])
+    def test_crypto_backends(self, name):
+        if name != "ecdsa":
+            pytest.importorskip(name)
+        previous: str = crypto.get_backend().name
+        crypto.set_backend(name)
+        try:
+            sk, pk = KeyPairGenerator.generate_key_pair()
+            raw: bytes = pk.to_string()
+            message: bytes = b"iftcoin"
+
+            # Les signatures d'ecdsa et du backend sont acceptées par les deux
+            for signature in (sk.sign(message), crypto.sign(sk, message)):
+                s: int = int.from_bytes(signature[32:], "big")
+                high_s: bytes = signature[:32] + (SECP256k1.order - s).to_bytes(
+                    32, "big"
+                )
+                for sig in (signature, high_s):
+                    assert pk.verify(sig, message)
+                    assert crypto.verify_signature(pk, message, sig)
+                    assert crypto.verify_signature(raw, message, sig)
+                assert not crypto.verify_signature(raw, b"autre", signature)
+                tampered: bytes = bytes([signature[0] ^ 1]) + signature[1:]
+                assert not crypto.verify_signature(raw, message, tampered)
+
+            signature = crypto.sign(sk, message)
+            assert not crypto.verify_signature(raw, message, None)
+            assert not crypto.verify_signature(raw, message, signature[:63])
+            assert not crypto.verify_signature(raw, message, bytes(64))
+            assert not crypto.verify_signature(bytes(64), message, signature)
+
+            # Clé fréquente : décodée une seule fois
+            misses: int = crypto.public_keys.misses
+            for _ in range(8):
+                assert crypto.verify_signature(raw, message, signature)
+            assert crypto.public_keys.misses == misses
+            assert crypto.public_keys.hits >= 8
+
+            # Cache partagé par les threads d'un exécuteur, avec évictions
+            keys = [KeyPairGenerator.generate_key_pair() for _ in range(4)]
+            checks = [
+                (pk.to_string(), message, crypto.sign(sk, message)) for sk, pk in keys
+            ] * 8
+            crypto.public_keys = crypto.PublicKeyCache(crypto.get_backend(), 2)
+            with ThreadPoolExecutor(4) as executor:
+                results = list(
+                    executor.map(
+                        crypto.find_invalid_raw, [checks[i:] for i in range(16)]
+                    )
+                )
+            assert results == [-1] * 16
+        finally:
+            crypto.set_backend(previous)
+
+    def test_benchmark_workloads(self):
+        options = run.parse_args(
+            "--wallets 3 --blocks 3 --txs 2 --fork-depth 1 --repeat 1".split()
+            + ["--sign-inputs", "2"]
+        )
+        report: dict = run.run(options)
+
+        results: dict[str, dict] = {r["name"]: r for r in report["results"]}
+        assert set(results) == set(run.SCENARIOS)
+        assert results["add_block"]["calls"] == 3
+        assert results["add_block"]["items"] == 6
+        assert results["fork"]["calls"] == 2 and results["fork"]["depth"] == 1
+        for result in results.values():
+            assert result["p50_ms"] <= result["p99_ms"] <= result["max_ms"]
+            assert result["peak_bytes"] > 0
+        assert report["environment"]["crypto_backend"] == crypto.get_backend().name
+
+    def test_history_index(self, generator):
+        fork = generator.fork()
+        history = HistoryIndex()
+        blockchain = Blockchain(generator.genesis, history=history)
+        main = generator.blocks(3, 3)
+        for block in main:
+            assert blockchain.add_block(block)
+
+        owners: dict[UTXO, bytes] = {}
+        expected: dict[bytes, list[tuple[bytes, str]]] = {}
+        for block in [generator.genesis] + main:
+            for position, tx in enumerate([block.coinbase] + block.transactions):
+                assert blockchain.find_transaction(tx.hash) == (block.hash, position)
+                touched: dict[tuple[bytes, str], None] = {}
+                for input_ in tx.inputs:
+                    spent = UTXO(input_.prev_tx_hash, input_.output_index)
+                    touched[(owners[spent], SENT)] = None
+                for index, output in enumerate(tx.outputs):
+                    owners[UTXO(tx.hash, index)] = output.get_raw_address()
+                    touched[(output.get_raw_address(), RECEIVED)] = None
+                for address, direction in sorted(touched, key=lambda t: t[1]):
+                    expected.setdefault(address, []).append((tx.hash, direction))
+
+        # Pages de 2, de la plus récente à la plus ancienne
+        pk = generator.wallets.public_keys[0]
+        entries: list = []
+        page, cursor = get_history(blockchain, pk, limit=2)
+        while True:
+            assert len(page) <= 2
+            entries += page
+            if cursor is None:
+                break
+            page, cursor = get_history(blockchain, pk, limit=2, before=cursor)
+        assert [(e.tx_hash, e.direction) for e in entries] == list(
+            reversed(expected[pk.to_string()])
+        )
+        assert entries[-1].tx_hash == generator.genesis.coinbase.hash
+
+        # Après une réorganisation, la branche abandonnée est masquée...
+        side = fork.blocks(4, 1)
+        for block in side:
+            assert blockchain.add_block(block)
+        assert blockchain.get_max_height_block() is side[-1]
+        assert blockchain.find_transaction(main[0].transactions[0].hash) is None
+        assert blockchain.find_transaction(side[0].transactions[0].hash) == (
+            side[0].hash,
+            1,
+        )
+        page, _ = blockchain.get_address_history(pk, limit=100)
+        assert all(blockchain.is_on_main_chain(e.height, e.block_hash) for e in page)
+
+        # ... puis retirée de l'index quand prune la retire de la chaîne
+        assert main[0].hash in history
+        for block in fork.blocks(Blockchain.CUT_OFF_AGE, 1):
+            assert blockchain.add_block(block)
+        assert main[0].hash not in history
+        assert main[0].transactions[0].hash not in history.locations
+
+        with pytest.raises(ValueError):
+            Blockchain(generator.genesis).find_transaction(main[0].hash)
+
+    def test_metrics(self, generator):
+        assert Metrics().span("add_block_stage") is Metrics().span("signatures")
+
+        sink = PrometheusSink()
+        blockchain = Blockchain(generator.genesis, metrics=Metrics(sink))
+        blocks = generator.blocks(2, 2)
+        orphan = Block(generator.wallets.public_keys[0], blocks[1].hash)
+        orphan.finalize()
+
+        assert blockchain.add_block(blocks[0])
+        assert not blockchain.add_block(orphan)
+        assert not blockchain.add_block(generator.genesis)
+        assert blockchain.add_block(blocks[1])
+        assert blockchain.add_transaction(generator.next_transaction())
+
+        assert sink.get_counter("blocks", result="accepted") == 2
+        assert sink.get_counter("blocks", result="rejected", reason="genesis") == 1
+        assert (
+            sink.get_counter("blocks", result="rejected", reason="unknown_parent") == 1
+        )
+        assert sink.get_counter("transactions", result="accepted") == 1
+        assert sink.get_span("add_block_stage", stage="transactions")[0] == 2
+        assert sink.get_span("signatures")[0] >= 4
+
+        text: str = sink.render()
+        assert 'iftcoin_blocks_total{result="accepted"} 2' in text
+        assert "# TYPE iftcoin_add_block_stage_seconds summary" in text
+
+    def test_node_service(self, tmp_path, generator):
+        blocks = generator.fork().blocks(2, 3)
+        txs = generator.transactions(6)
+        sink = MemorySink()
+        blockchain = Blockchain(generator.genesis, metrics=Metrics(sink))
+
+        # Dépense la coinbase de genèse avec la signature d'un autre message
+        forged = Transaction()
+        forged.add_input(generator.genesis.coinbase.hash, 0)
+        forged.add_output(1.0, generator.wallets.public_keys[1])
+        forged.add_signature(txs[0].inputs[0].signature, 0)
+        forged.generate_hash()
+
+        tampered = bytearray(codec.encode_block(blocks[0]))
+        tampered[-1] ^= 1
+        # Entrée encodée avec une signature vide
+        unsigned = Transaction()
+        unsigned.add_input(generator.genesis.coinbase.hash, 0)
+        unsigned.add_output(1.0, generator.wallets.public_keys[1])
+        unsigned.hash = bytes(32)
+        # Index de sortie hors de l'encodage sur 2 octets des données signées
+        overflow = Transaction()
+        overflow.add_input(generator.genesis.coinbase.hash, 0x10000)
+        overflow.add_output(1.0, generator.wallets.public_keys[1])
+        overflow.inputs[0].add_signature(txs[0].inputs[0].signature)
+        overflow.hash = bytes(32)
+
+        async def scenario():
+            async with Node(blockchain, queue_size=2) as node:
+                server = await node.serve_tcp()
+                port: int = server.sockets[0].getsockname()[1]
+                async with await NodeClient.connect("127.0.0.1", port) as client:
+                    # Requêtes en rafale : les transactions dépendantes sont
+                    # appliquées dans l'ordre malgré la file de taille 2
+                    results = await asyncio.gather(
+                        client.send_transaction(forged),
+                        *(client.send_transaction(tx) for tx in txs),
+                    )
+                    assert results == [False] + [True] * len(txs)
+                    with pytest.raises(ValueError):
+                        await client._request(MSG_BLOCK, b"\x01\x02")
+                    for malformed in (unsigned, overflow):
+                        status, _ = await client._send(
+                            MSG_TRANSACTION, codec.encode_transaction(malformed)
+                        )
+                        assert status == STATUS_MALFORMED
+
+                path: str = str(tmp_path / "node.sock")
+                await node.serve_unix(path)
+                async with await NodeClient.connect_unix(path) as client:
+                    status, _ = await client._send(MSG_BLOCK, bytes(tampered))
+                    assert status == STATUS_MALFORMED
+                    assert await client.send_block(blocks[0])
+                    assert await client.send_block(blocks[1])
+                    assert not await client.send_block(generator.genesis)
+                    assert await client.get_tip() == blocks[1].hash
+
+        asyncio.run(scenario())
+        assert blockchain.get_max_height_block().hash == blocks[1].hash
+        assert (
+            sink.get_counter(
+                "transactions", result="rejected", reason="invalid_signature"
+            )
+            == 1
+        )
+        assert sink.get_counter("transactions", result="accepted") == len(txs)
+        assert sink.get_counter("node_backpressure") > 0
+        assert sink.get_span("node_signatures")[0] >= 1
+
+    @pytest.mark.parametrize("merkle", [False, True])
+    def test_headers_first_sync(self, merkle, generator):
+        assert generator.merkle == merkle
+        blocks = generator.blocks(20, 2)
+        fork = generator.fork()
+        blocks += generator.blocks(20, 2)
+        source = Blockchain(generator.genesis)
+        for block in blocks:
+            assert source.add_block(block)
+        # Chaîne plus haute qui diverge après le bloc 20
+        tall = Blockchain(generator.genesis)
+        for block in blocks[:20] + fork.blocks(30, 2):
+            assert tall.add_block(block)
+
+        class CorruptPeer(LocalPeer):
+            async def get_blocks(self, hashes):
+                # Renvoie les bons blocs avec une transaction altérée
+                blocks = await super().get_blocks(hashes)
+                tampered = codec.decode_block(codec.encode_block(blocks[-1]))
+                tampered.transactions[0].outputs[0] = Transaction.Output(
+                    1000.0, tampered.coinbase.outputs[0].get_raw_address()
+                )
+                return blocks[:-1] + [tampered]
+
+        class HiddenPeer(LocalPeer):
+            async def get_blocks(self, hashes):
+                # Annonce ses en-têtes mais ne fournit aucun bloc
+                return []
+
+        async def scenario():
+            fresh = Blockchain(generator.genesis)
+            async with Node(source) as node:
+                server = await node.serve_tcp()
+                port: int = server.sockets[0].getsockname()[1]
+                async with await NodeClient.connect("127.0.0.1", port) as client:
+                    peers = [CorruptPeer(source), client, LocalPeer(source)]
+                    sync = Synchronizer(fresh, peers, batch_size=8, window=3)
+                    report = await sync.run()
+            assert report == {"headers": 40, "blocks": 40, "failed": 0}
+            assert fresh.get_max_height_block().hash == blocks[-1].hash
+            assert get_locator(fresh)[-1] == generator.genesis.hash
+            assert len(get_locator(fresh)) < 20
+
+            # Une chaîne déjà à jour n'a rien à télécharger ; une chaîne
+            # servie par un noeud ajoute les blocs par son écrivain
+            assert (await Synchronizer(fresh, [LocalPeer(source)]).run())[
+                "headers"
+            ] == 0
+            behind = Blockchain(generator.genesis)
+            for block in blocks[:5]:
+                assert behind.add_block(block)
+            async with Node(behind) as node:
+                report = await Synchronizer(
+                    behind, [LocalPeer(source)], node=node
+                ).run()
+            assert report == {"headers": 35, "blocks": 35, "failed": 0}
+
+            # Seul le pair corrompu a les blocs : la synchronisation s'arrête
+            lonely = Blockchain(generator.genesis)
+            report = await Synchronizer(lonely, [CorruptPeer(source)]).run()
+            assert report["blocks"] == 0 and report["failed"] == 1
+
+            # Le pair de la chaîne la plus haute est abandonné après les blocs
+            # communs, et la chaîne suivante est téléchargée
+            hidden = HiddenPeer(tall)
+            retry = Blockchain(generator.genesis)
+            sync = Synchronizer(retry, [hidden, LocalPeer(source)], batch_size=8)
+            report = await sync.run()
+            assert report == {"headers": 50 + 24, "blocks": 40, "failed": 1}
+            assert retry.get_max_height_block().hash == blocks[-1].hash
+            assert hidden not in sync.peers and len(sync.peers) == 1
+
+            # Les en-têtes demandés sont bornés ; la synchronisation suivante
+            # reprend après le dernier
+            capped = Blockchain(generator.genesis)
+            for _ in range(2):
+                report = await Synchronizer(
+                    capped, [LocalPeer(source)], max_headers=15
+                ).run()
+                assert report == {"headers": 15, "blocks": 15, "failed": 0}
+            assert capped.max_height_node.height == 31
+
+        asyncio.run(scenario())
+
+    def test_proof_of_work(self, generator):
+        # La coinbase de genèse ne dépend que de l'adresse : les transactions du
+        # générateur dépensent aussi celle de la genèse avec preuve de travail
+        pk = generator.wallets.public_keys[0]
+        miner = Miner(workers=1)
+        target: int = target_from_bits(6)
+        genesis = Block(pk, target=target, timestamp=1000)
+        assert miner.mine(genesis).found
+
+        sink = MemorySink()
+        blockchain = Blockchain(
+            genesis,
+            metrics=Metrics(sink),
+            proof_of_work=ProofOfWork(block_time=10, retarget_interval=4),
+        )
+        legacy = Block(pk)
+        legacy.finalize()
+        with pytest.raises(ValueError):
+            Blockchain(legacy, proof_of_work=ProofOfWork())
+
+        # Blocs trois fois plus rapides que prévu : la cible est divisée par 3
+        for height in range(2, 6):
+            node = blockchain.max_height_node
+            block = Block(
+                pk,
+                node.hash,
+                target=blockchain.get_next_target(node),
+                timestamp=1000 + 10 * (height - 1) // 3,
+            )
+            block.add_transaction(generator.next_transaction())
+            result = miner.mine(block)
+            assert result.found and result.hashes > 0 and result.hashrate > 0
+            assert block.has_valid_work()
+            assert blockchain.add_block(block)
+        tip = blockchain.max_height_node
+        assert tip.block.target == target * 10 // 30
+        assert blockchain.get_next_target(tip) == tip.block.target
+        assert blockchain.get_next_target(tip.parent.parent) == target
+
+        # Travail insuffisant, mauvaise cible, horodatage antérieur au parent
+        lazy = Block(
+            pk, tip.hash, target=blockchain.get_next_target(tip), timestamp=2000
+        )
+        lazy.finalize()
+        while lazy.has_valid_work():
+            lazy.nonce += 1
+            lazy.finalize()
+        easy = Block(pk, tip.hash, target=target * 2, timestamp=2000)
+        early = Block(pk, tip.hash, target=blockchain.get_next_target(tip), timestamp=1)
+        for block in (easy, early):
+            assert miner.mine(block).found
+        assert not blockchain.add_block(lazy)
+        assert not blockchain.add_block(easy)
+        assert not blockchain.add_block(early)
+        for reason in ("invalid_work", "bad_target", "bad_timestamp"):
+            assert sink.get_counter("blocks", result="rejected", reason=reason) == 1
+
+        # Minage par le BlockHandler, dans plusieurs processus
+        parallel = Miner(workers=2, chunk_size=16)
+        try:
+            handler = BlockHandler(blockchain, miner=parallel)
+            assert blockchain.add_transaction(generator.next_transaction())
+            mined = handler.create_block(pk)
+            assert mined is not None and mined.has_valid_work()
+            assert handler.last_mining.hashes > 0
+            assert sink.get_counter("mining_hashes") == handler.last_mining.hashes
+        finally:
+            parallel.close()
+
+        # Les champs de preuve de travail survivent à l'encodage et aux en-têtes
+        decoded = codec.decode_block(codec.encode_block(mined), verify=True)
+        assert (decoded.nonce, decoded.timestamp, decoded.target) == (
+            mined.nonce,
+            mined.timestamp,
+            mined.target,
+        )
+        assert codec.BlockView(memoryview(codec.encode_block(mined))).coinbase.hash == (
+            mined.coinbase.hash
+        )
+        header = BlockHeader.from_bytes(BlockHeader.from_block(mined, 7).to_bytes())
+        assert header.target == mined.target and header.is_valid()
+        assert header.matches(decoded)
+
+    def test_cumulative_work_fork_choice(self, tmp_path, generator):
+        # Ancêtres par les pointeurs skip, comparés à une marche linéaire
+        nodes = [Blockchain.BlockNode(None, None, None, bytes(32))]
+        for i in range(1, 300):
+            nodes.append(
+                Blockchain.BlockNode(None, nodes[-1], None, i.to_bytes(32, "big"))
+            )
+        fork = Blockchain.BlockNode(None, nodes[150], None, b"\xff" * 32)
+        for node in (nodes[-1], nodes[200], nodes[37]):
+            for height in range(1, node.height + 1):
+                assert node.get_ancestor(height) is nodes[height - 1]
+            assert node.get_ancestor(node.height + 1) is None
+            assert node.chain_work == node.height
+        assert Blockchain.get_common_ancestor(nodes[-1], fork) is nodes[150]
+        assert Blockchain.get_common_ancestor(nodes[80], fork) is nodes[80]
+
+        # Avec preuve de travail, la branche la plus courte peut avoir le plus de
+        # travail : des blocs rapides rendent la cible suivante 4 fois plus dure
+        pk = generator.wallets.public_keys[0]
+        miner = Miner(workers=1)
+        genesis = Block(pk, target=target_from_bits(4), timestamp=1000)
+        assert miner.mine(genesis).found
+        proof_of_work = ProofOfWork(block_time=10, retarget_interval=2)
+        store = BlockStore(tmp_path)
+        blockchain = Blockchain(genesis, store=store, proof_of_work=proof_of_work)
+        other = generator.fork()
+
+        def extend(branch, tip, timestamp):
+            node = blockchain.blockchain[tip.hash.hex()]
+            block = Block(
+                pk,
+                tip.hash,
+                target=blockchain.get_next_target(node),
+                timestamp=timestamp,
+            )
+            block.add_transaction(branch.next_transaction())
+            assert miner.mine(block).found
+            assert blockchain.add_block(block)
+            return block
+
+        slow2 = extend(other, genesis, 1100)
+        slow3 = extend(other, slow2, 1200)
+        slow4 = extend(other, slow3, 1300)
+        assert blockchain.get_max_height_block() is slow4
+
+        fast2 = extend(generator, genesis, 1001)
+        assert blockchain.get_max_height_block() is slow4
+        fast3 = extend(generator, fast2, 1002)
+        tip = blockchain.max_height_node
+        assert tip.block is fast3 and tip.height == 3
+        work = get_work(genesis.target)
+        assert tip.chain_work == 2 * work + get_work(fast3.target)
+        assert get_work(fast3.target) >= 4 * work
+        slow = blockchain.blockchain[slow4.hash.hex()]
+        assert slow.chain_work < tip.chain_work and slow.height == 4
+
+        disconnected, connected = Blockchain.get_fork_path(slow, tip)
+        assert [n.block for n in disconnected] == [slow4, slow3, slow2]
+        assert [n.block for n in connected] == [fast2, fast3]
+
+        # La synchronisation vérifie la cible des en-têtes : un en-tête au format
+        # d'origine qui annonce une cible minuscule et un hash nul est refusé
+        class ForgedPeer(LocalPeer):
+            async def get_headers(self, locator, limit=MAX_HEADERS):
+                forged = BlockHeader(
+                    bytes(32),
+                    genesis.hash,
+                    2,
+                    work=WORK.pack(1001, (1).to_bytes(32, "big")) + NONCE.pack(0),
+                )
+                assert forged.is_valid()
+                return [forged]
+
+        async def sync(peers):
+            fresh = Blockchain(genesis, proof_of_work=proof_of_work)
+            report = await Synchronizer(fresh, peers).run()
+            return fresh, report
+
+        fresh, report = asyncio.run(sync([ForgedPeer(blockchain)]))
+        assert report == {"headers": 0, "blocks": 0, "failed": 0}
+        fresh, report = asyncio.run(
+            sync([ForgedPeer(blockchain), LocalPeer(blockchain)])
+        )
+        assert report == {"headers": 2, "blocks": 2, "failed": 0}
+        assert fresh.max_height_node.chain_work == tip.chain_work
+
+        # Le travail cumulé est reconstruit à la réouverture du stockage
+        store.close()
+        with BlockStore(tmp_path) as reopened:
+            chain = Blockchain.open(reopened, proof_of_work=proof_of_work)
+            assert chain.max_height_node.hash == fast3.hash
+            assert chain.max_height_node.chain_work == tip.chain_work
+
+    def test_assume_valid(self, generator):
+        blocks = generator.blocks(4, 2)
+        headers = [(block.hash, block.prev_block_hash) for block in blocks]
+
+        sink = MemorySink()
+        blockchain = Blockchain(
+            generator.genesis, metrics=Metrics(sink), assume_valid=blocks[2].hash
+        )
+        with pytest.raises(ValueError):
+            blockchain.add_assumed_headers([headers[0], headers[2]])
+        assert blockchain.add_assumed_headers(headers[:2]) == 0
+        assert blockchain.add_assumed_headers(headers) == 3
+
+        # Signatures non vérifiées jusqu'au bloc de référence inclus...
+        for block in blocks[:3]:
+            assert blockchain.add_block(block)
+        assert sink.get_span("signatures") == (0, 0.0)
+        assert sink.get_counter("assumed_valid_blocks") == 3
+
+        # ... puis vérification complète
+        assert blockchain.add_block(blocks[3])
+        assert sink.get_span("signatures")[0] == sum(
+            len(tx.inputs) for tx in blocks[3].transactions
+        )
+        assert sink.get_counter("assumed_valid_blocks") == 3
+
+        # Une signature invalide passe dans un ancêtre du bloc de référence, mais
+        # pas une double dépense ni un bloc qui n'a pas le parent de son en-tête
+        thief_sk, thief_pk = KeyPairGenerator.generate_key_pair()
+        genesis = generator.genesis
+
+        def spend(*outputs: int) -> Block:
+            tx = Transaction()
+            for _ in outputs:
+                tx.add_input(genesis.coinbase.hash, 0)
+            for value in outputs:
+                tx.add_output(value, thief_pk)
+            tx.sign_all([thief_sk] * len(outputs))
+            block = Block(thief_pk, genesis.hash)
+            block.add_transaction(tx)
+            block.finalize()
+            return block
+
+        forged = spend(25)
+        double_spend = spend(25, 25)
+        for block, prev_block_hash, accepted in [
+            (forged, genesis.hash, True),
+            (double_spend, genesis.hash, False),
+            (forged, bytes(32), False),
+        ]:
+            chain = Blockchain(genesis, assume_valid=block.hash)
+            assert chain.add_assumed_headers([(block.hash, prev_block_hash)]) == 1
+            assert chain.add_block(block) is accepted
+        assert not Blockchain(genesis).add_block(forged)
+
+    def test_chain_export_import(self, tmp_path, generator):
+        blockchain = Blockchain(generator.genesis)
+        blocks = generator.blocks(Blockchain.CUT_OFF_AGE + 3, 2)
+        for block in blocks:
+            assert blockchain.add_block(block)
+        path = tmp_path / "chain.iftc"
+        assert export_chain(blockchain, path) == len(blocks) + 1
+
+        inputs = sum(len(tx.inputs) for block in blocks for tx in block.transactions)
+        for executor in [None, ProcessPoolExecutor(2)]:
+            chain = Blockchain(read_genesis(path))
+            report = import_chain(chain, path, executor, window=4)
+            assert report == {"blocks": len(blocks), "known": 1, "failed": 0}
+            assert chain.max_height_node.hash == blockchain.max_height_node.hash
+            assert {
+                utxo: (output.value, output.get_raw_address())
+                for utxo, output in chain.get_max_height_utxo_pool().items()
+            } == {
+                utxo: (output.value, output.get_raw_address())
+                for utxo, output in blockchain.get_max_height_utxo_pool().items()
+            }
+            if executor is not None:
+                # Signatures vérifiées d'avance par l'exécuteur
+                assert chain.signature_cache.hits == inputs
+                executor.shutdown()
+        assert import_chain(chain, path)["known"] == len(blocks) + 1
+
+        # Une adresse dépensée fausse ne fait que rater le cache
+        data = bytearray(path.read_bytes())
+        data[-1] ^= 1
+        path.write_bytes(bytes(data))
+        with ProcessPoolExecutor(1) as executor:
+            chain = Blockchain(read_genesis(path))
+            assert import_chain(chain, path, executor)["blocks"] == len(blocks)
+        path.write_bytes(bytes(data[:-1]))
+        with pytest.raises(ValueError):
+            import_chain(Blockchain(generator.genesis), path)
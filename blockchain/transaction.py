@@ -3,11 +3,33 @@ from __future__ import annotations
 import hashlib
 import struct
 
-from blockchain.crypto import PrivateKey, PublicKey
+from blockchain.crypto import (
+    BatchSigner,
+    PrivateKey,
+    PublicKey,
+    decode_public_key,
+    sign,
+)
+
+# Encodage de la valeur d'une sortie
+_VALUE = struct.Struct("f")
 
 
 class Transaction:
+    # Les classes du modèle de données n'ont pas de __dict__ par instance : un pool
+    # UTXO ou un memory pool en contient des millions
+    __slots__ = (
+        "hash",
+        "inputs",
+        "outputs",
+        "coinbase",
+        "_outputs_bytes",
+        "_bytes",
+    )
+
     class Input:
+        __slots__ = ("prev_tx_hash", "output_index", "_signature", "_dirty")
+
         def __init__(self, prev_hash: bytes, index: int):
             # Hash de la transaction dont la sortie est utilisée
             self.prev_tx_hash: bytes = prev_hash
@@ -16,18 +38,75 @@ class Transaction:
             self.output_index: int = index
 
             # Signature produite pour vérifier la validité
-            self.signature: bytes | None = None
+            self._signature: bytes | None = None
+
+            # True si la signature a changé depuis le dernier encodage de la
+            # transaction, qui invalide alors son encodage en cache
+            self._dirty: bool = False
+
+        @property
+        def signature(self) -> bytes | None:
+            return self._signature
+
+        @signature.setter
+        def signature(self, sig: bytes | None) -> None:
+            self._signature = sig
+            self._dirty = True
 
         def add_signature(self, sig: bytes) -> None:
             self.signature = sig
 
     class Output:
-        def __init__(self, value: float, address: PublicKey):
-            # Valeur en iftcoins de la sortie
-            self.value = value
+        __slots__ = ("_value", "_address", "_raw_address", "_dirty")
 
-            # Adresse (clé publique) du destinataire
-            self.address = address
+        def __init__(self, value: float, address: PublicKey | bytes):
+            # Valeur en iftcoins de la sortie
+            self._value: float = value
+
+            # Adresse (clé publique) du destinataire, sous forme brute (64 octets) ;
+            # l'objet PublicKey n'est construit qu'au premier accès à self.address
+            self._address: PublicKey | None
+            self._raw_address: bytes
+            self._set_address(address)
+
+            # True si la sortie a changé depuis le dernier encodage de sa
+            # transaction, qui invalide alors ses encodages en cache
+            self._dirty: bool = False
+
+        def _set_address(self, address: PublicKey | bytes) -> None:
+            if isinstance(address, bytes):
+                self._address = None
+                self._raw_address = address
+            else:
+                self._address = address
+                self._raw_address = address.to_string()
+
+        @property
+        def value(self) -> float:
+            return self._value
+
+        @value.setter
+        def value(self, value: float) -> None:
+            self._value = value
+            self._dirty = True
+
+        @property
+        def address(self) -> PublicKey:
+            if self._address is None:
+                self._address = decode_public_key(self._raw_address)
+            return self._address
+
+        @address.setter
+        def address(self, address: PublicKey | bytes) -> None:
+            self._set_address(address)
+            self._dirty = True
+
+        def get_raw_address(self) -> bytes:
+            """Renvoie l'adresse du destinataire sous forme brute (64 octets)."""
+            return self._raw_address
+
+        def to_bytes(self) -> bytes:
+            return _VALUE.pack(self._value) + self._raw_address
 
     def __init__(self):
         # Hash de la transaction (identifiant unique)
@@ -37,6 +116,11 @@ class Transaction:
         self.outputs: list[Transaction.Output] = []
         self.coinbase: bool = False
 
+        # Encodages mis en cache, invalidés par les méthodes qui modifient la
+        # transaction et par les entrées et sorties modifiées (_dirty)
+        self._outputs_bytes: bytes | None = None
+        self._bytes: bytes | None = None
+
     @classmethod
     def create_coinbase(cls, coinbase: float, address: PublicKey) -> Transaction:
         """Crée une transaction coinbase de valeur <coinbase> et appelle generate_hash."""
@@ -56,17 +140,38 @@ class Transaction:
     def add_input(self, prev_tx_hash: bytes, output_index: int) -> None:
         input_: Transaction.Input = Transaction.Input(prev_tx_hash, output_index)
         self.inputs.append(input_)
+        self._bytes = None
 
-    def add_output(self, value: float, address: PublicKey) -> None:
+    def add_output(self, value: float, address: PublicKey | bytes) -> None:
         output: Transaction.Output = Transaction.Output(value, address)
         self.outputs.append(output)
+        self._outputs_bytes = None
+        self._bytes = None
 
     def remove_input_via_index(self, index: int) -> None:
         del self.inputs[index]
+        self._bytes = None
+
+    def get_outputs_bytes(self) -> bytes:
+        """Renvoie l'encodage de toutes les sorties, commun aux données à signer
+        de chaque entrée et à la représentation en bytes de la transaction."""
+        if self._outputs_bytes is None or self._clear_dirty(self.outputs):
+            self._outputs_bytes = b"".join(output.to_bytes() for output in self.outputs)
+            self._bytes = None
+        return self._outputs_bytes
+
+    @staticmethod
+    def _clear_dirty(items: list[Transaction.Input] | list[Transaction.Output]) -> bool:
+        """Renvoie True si un élément de <items> a changé depuis le dernier
+        encodage, et les marque tous comme encodés."""
+        dirty: bool = False
+        for item in items:
+            if item._dirty:
+                item._dirty = False
+                dirty = True
+        return dirty
 
     def get_raw_data_to_sign(self, index: int) -> bytes:
-        sig_data: bytes = b""
-
         if index > len(self.inputs):
             raise ValueError(f"Index {index} invalide!")
 
@@ -75,24 +180,22 @@ class Transaction:
         prev_tx_hash: bytes = input_.prev_tx_hash
         output_index: bytes = input_.output_index.to_bytes(2, byteorder="big")
 
-        if prev_tx_hash is not None:
-            sig_data += prev_tx_hash
-
-        sig_data += output_index
-
-        for output in self.outputs:
-            value: bytes = struct.pack("f", output.value)
+        if prev_tx_hash is None:
+            return output_index + self.get_outputs_bytes()
 
-            sig_data += value
-            sig_data += output.address.to_string()
-
-        return sig_data
+        return b"".join((prev_tx_hash, output_index, self.get_outputs_bytes()))
 
     def add_signature(self, signature: bytes, index: int) -> None:
         self.inputs[index].add_signature(signature)
 
     def to_bytes(self) -> bytes:
-        raw_tx: bytes = b""
+        outputs_bytes: bytes = self.get_outputs_bytes()
+        if self._clear_dirty(self.inputs):
+            self._bytes = None
+        if self._bytes is not None:
+            return self._bytes
+
+        parts: list[bytes] = []
 
         for input_ in self.inputs:
             prev_tx_hash: bytes = input_.prev_tx_hash
@@ -101,29 +204,70 @@ class Transaction:
             signature: bytes = input_.signature
 
             if prev_tx_hash is not None:
-                raw_tx += prev_tx_hash
+                parts.append(prev_tx_hash)
 
-            raw_tx += output_index
+            parts.append(output_index)
 
             if signature is not None:
-                raw_tx += signature
+                parts.append(signature)
 
-        for output in self.outputs:
-            value: bytes = struct.pack("f", output.value)
-            raw_tx += value
+        parts.append(outputs_bytes)
 
-            raw_tx += output.address.to_string()
-
-        return raw_tx
+        self._bytes = b"".join(parts)
+        return self._bytes
 
     def generate_hash(self) -> None:
         self.hash = hashlib.sha256(self.to_bytes()).digest()
 
     def sign(self, sk: PrivateKey, index: int) -> None:
-        sig = sk.sign(self.get_raw_data_to_sign(index))
+        sig = sign(sk, self.get_raw_data_to_sign(index))
         self.add_signature(sig, index)
         self.generate_hash()
 
+    def sign_all(
+        self, keys: PrivateKey | list[PrivateKey], signer: BatchSigner | None = None
+    ) -> None:
+        """
+        Signe toutes les entrées, l'entrée i avec <keys>[i] (ou toutes avec <keys>
+        si c'est une seule clé), puis calcule le hash une seule fois. Avec
+        <signer>, les signatures sont faites par lot, éventuellement en parallèle.
+        """
+        Transaction.sign_transactions([self], [keys], signer)
+
+    @staticmethod
+    def sign_transactions(
+        transactions: list[Transaction],
+        keys: list[PrivateKey | list[PrivateKey]],
+        signer: BatchSigner | None = None,
+    ) -> None:
+        """
+        Signe toutes les entrées de chaque transaction de <transactions> avec les
+        clés correspondantes de <keys> (voir sign_all), en un seul lot pour
+        <signer>. Le hash de chaque transaction n'est calculé qu'une fois, après
+        toutes ses signatures.
+        """
+        requests: list[tuple[PrivateKey, bytes]] = []
+        for tx, tx_keys in zip(transactions, keys, strict=True):
+            if not isinstance(tx_keys, list):
+                tx_keys = [tx_keys] * tx.num_inputs()
+            if len(tx_keys) != tx.num_inputs():
+                raise ValueError(f"{len(tx_keys)} clés pour {tx.num_inputs()} entrées!")
+            for index, sk in enumerate(tx_keys):
+                requests.append((sk, tx.get_raw_data_to_sign(index)))
+
+        signatures: list[bytes]
+        if signer is None:
+            signatures = [sign(sk, message) for sk, message in requests]
+        else:
+            signatures = signer.sign(requests)
+
+        position: int = 0
+        for tx in transactions:
+            for input_ in tx.inputs:
+                input_.add_signature(signatures[position])
+                position += 1
+            tx.generate_hash()
+
     def get_input(self, index: int) -> Transaction.Input:
         if index < self.num_inputs():
             return self.inputs[index]
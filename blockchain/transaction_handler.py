@@ -1,18 +1,51 @@
-
-from blockchain.crypto import verify_signature
+from blockchain.crypto import (
+    BatchVerifier,
+    SignatureCache,
+    SignatureCheck,
+    SignatureKey,
+    signature_key,
+    verify_signature,
+)
+from blockchain.metrics import Metrics
 from blockchain.transaction import Transaction
 from blockchain.utxo import UTXO
 from blockchain.utxo_pool import UTXOPool
 
 
 class TransactionHandler:
-    def __init__(self, utxo_pool: UTXOPool):
+    def __init__(
+        self,
+        utxo_pool: UTXOPool,
+        verifier: BatchVerifier | None = None,
+        signature_cache: SignatureCache | None = None,
+        metrics: Metrics | None = None,
+        verify_signatures: bool = True,
+    ):
         """
         Crée un registre public dont le pool UTXO actuel est <utxo_pool>.
         Nous faisons une copie défensive de <utxo_pool> en utilisant le constructeur
-        UTXOPool.from_utxo_pool(utxo_pool: UTXOPool).
+        UTXOPool.from_utxo_pool(utxo_pool: UTXOPool), qui crée une couche delta
+        au-dessus de <utxo_pool> sans copier son contenu.
+
+        Si <verifier> est fourni, handle_transactions fait d'abord les vérifications
+        peu coûteuses (UTXO, double dépense, montants) sur tout le lot, puis
+        vérifie toutes les signatures d'un coup avec <verifier>.
+
+        Si <signature_cache> est fourni, les signatures qui s'y trouvent ne sont pas
+        revérifiées et celles vérifiées avec succès y sont ajoutées.
+
+        Si <metrics> est fourni, la durée des vérifications de signatures y est
+        mesurée (span "signatures", par signature ou par lot).
+
+        Si <verify_signatures> est False, les signatures ne sont pas vérifiées ;
+        toutes les autres règles le sont (blocs couverts par un point de contrôle
+        assume-valid, voir Blockchain).
         """
         self.utxo_pool: UTXOPool = UTXOPool.from_utxo_pool(utxo_pool)
+        self.verifier: BatchVerifier | None = verifier
+        self.signature_cache: SignatureCache | None = signature_cache
+        self.metrics: Metrics = metrics or Metrics()
+        self.verify_signatures: bool = verify_signatures
 
     def is_valid_transaction(self, tx: Transaction) -> bool:
         """
@@ -25,6 +58,19 @@ class TransactionHandler:
         de ses valeurs de sortie ; et False sinon.
         """
         # TODO: Votre code ici
+        return self._is_valid_transaction(tx, None, None)
+
+    def _is_valid_transaction(
+        self,
+        tx: Transaction,
+        signatures: list[SignatureCheck] | None,
+        keys: list[SignatureKey | None] | None,
+    ) -> bool:
+        """
+        Comme is_valid_transaction, mais si <signatures> n'est pas None, les
+        vérifications de signature absentes du cache y sont ajoutées au lieu
+        d'être faites, et leurs clés de cache sont ajoutées à <keys>.
+        """
         dblDepense = []
         valTotInputs = 0
 
@@ -35,8 +81,24 @@ class TransactionHandler:
                 return False
 
             txOutput = self.utxo_pool.get_tx_output(utxoAttendu)
-            if not self.validerSignature(txOutput, index, txInput, tx):
-                return False
+            if not self.verify_signatures:
+                pass  # signature présumée valide (assume-valid)
+            elif signatures is not None and keys is not None:
+                cle = self.cleSignature(txOutput, index, tx)
+                if not self.signatureEnCache(cle):
+                    signatures.append(
+                        (
+                            txOutput.get_raw_address(),
+                            tx.get_raw_data_to_sign(index),
+                            txInput.signature,
+                        )
+                    )
+                    keys.append(cle)
+            else:
+                with self.metrics.span("signatures"):
+                    valide = self.validerSignature(txOutput, index, txInput, tx)
+                if not valide:
+                    return False
 
             if utxoAttendu in dblDepense:
                 return False
@@ -49,22 +111,99 @@ class TransactionHandler:
 
         return True
 
-    def handle_transactions(self, possible_txs: list[Transaction]) -> list[Transaction]:
+    def handle_transactions(
+        self, possible_txs: list[Transaction], stop_on_invalid: bool = False
+    ) -> list[Transaction]:
         """
         - Reçoit une liste de transactions proposées,
         - Vérifie l'exactitude de chaque transaction, et
         - Renvoie une liste de transactions valides acceptées
           tout en mettant à jour le pool UTXO actuel.
+
+        Si <stop_on_invalid> est True, le traitement s'arrête à la première
+        transaction invalide (utile pour valider un bloc entier).
         """
         # TODO: Votre code ici
+        if self.verifier is not None and self.verify_signatures:
+            return self._handle_transactions_batch(possible_txs, stop_on_invalid)
+
         transactionsValides = []
         for transaction in possible_txs:
             if self.is_valid_transaction(transaction):
                 transactionsValides.append(transaction)
                 self.enleverUtxoDuPool(transaction)
                 self.ajouterOutputAuPool(transaction)
+            elif stop_on_invalid:
+                break
         return transactionsValides
 
+    def _handle_transactions_batch(
+        self, possible_txs: list[Transaction], stop_on_invalid: bool
+    ) -> list[Transaction]:
+        """
+        Version de handle_transactions qui vérifie toutes les signatures du lot
+        en une fois. Les transactions sont d'abord appliquées sur une couche
+        temporaire ; les transactions dont une signature est invalide sont toutes
+        écartées d'un coup et le lot restant est réappliqué. Les signatures déjà
+        vérifiées ne le sont pas de nouveau : seules celles des transactions
+        devenues applicables (une double dépense d'une transaction écartée, par
+        exemple) sont vérifiées au passage suivant.
+        """
+        assert self.verifier is not None
+        candidates: list[Transaction] = list(possible_txs)
+        # Signatures valides vérifiées aux passages précédents
+        verified: set[SignatureCheck] = set()
+
+        while True:
+            handler: TransactionHandler = TransactionHandler(
+                self.utxo_pool, signature_cache=self.signature_cache
+            )
+            accepted: list[Transaction] = []
+            signatures: list[SignatureCheck] = []
+            keys: list[SignatureKey | None] = []
+            owners: list[Transaction] = []
+
+            for transaction in candidates:
+                if handler._is_valid_transaction(transaction, signatures, keys):
+                    accepted.append(transaction)
+                    owners.extend([transaction] * (len(signatures) - len(owners)))
+                    handler.enleverUtxoDuPool(transaction)
+                    handler.ajouterOutputAuPool(transaction)
+                else:
+                    del signatures[len(owners) :]
+                    del keys[len(owners) :]
+                    if stop_on_invalid:
+                        return []
+
+            pending: list[int] = [
+                i for i, check in enumerate(signatures) if check not in verified
+            ]
+            checks: list[SignatureCheck] = [signatures[i] for i in pending]
+            with self.metrics.span("signatures"):
+                invalid: list[int]
+                if stop_on_invalid:
+                    first: int | None = self.verifier.find_invalid(checks)
+                    invalid = [] if first is None else [first]
+                else:
+                    invalid = self.verifier.find_all_invalid(checks)
+            self.metrics.increment("signatures", len(checks))
+            if not invalid:
+                if self.signature_cache is not None:
+                    for cle in keys:
+                        if cle is not None:
+                            self.signature_cache.add(cle)
+                self.fusionnerCouche(handler.utxo_pool)
+                return accepted
+            if stop_on_invalid:
+                return []
+
+            verified.update(checks)
+            rejected: set[Transaction] = set()
+            for index in invalid:
+                verified.discard(checks[index])
+                rejected.add(owners[pending[index]])
+            candidates = [tx for tx in candidates if tx not in rejected]
+
     # ===== Fonctions utiles pour simplifier le developpement et le debugging =====#
 
     def sortieEstDansPool(self, utxo: UTXO) -> bool:
@@ -79,12 +218,36 @@ class TransactionHandler:
         txInput: Transaction.Input,
         tx: Transaction,
     ) -> bool:
-        outPutPk = txOutput.address
+        cle = self.cleSignature(txOutput, index, tx)
+        if self.signatureEnCache(cle):
+            return True
+        outPutPk = txOutput.get_raw_address()
         message = tx.get_raw_data_to_sign(index)
         if not verify_signature(outPutPk, message, txInput.signature):
             return False
+        if self.signature_cache is not None and cle is not None:
+            self.signature_cache.add(cle)
         return True
 
+    def cleSignature(
+        self, txOutput: Transaction.Output, index: int, tx: Transaction
+    ) -> SignatureKey | None:
+        """Renvoie la clé de cache de la signature de l'entrée <index> de <tx>,
+        ou None s'il n'y a pas de cache. La clé est calculée sur les données
+        signées : le hash de <tx> n'est pas recalculé et ne sert pas de clé."""
+        if self.signature_cache is None:
+            return None
+        return signature_key(
+            txOutput.get_raw_address(),
+            tx.get_raw_data_to_sign(index),
+            tx.inputs[index].signature,
+        )
+
+    def signatureEnCache(self, cle: SignatureKey | None) -> bool:
+        if self.signature_cache is None or cle is None:
+            return False
+        return self.signature_cache.contains(cle)
+
     def validerMontants(self, tx: Transaction, valTotInputs: int) -> bool:
         valTotOutputs = 0
         for txOutputTx in tx.outputs:
@@ -100,6 +263,14 @@ class TransactionHandler:
             utxoCorrespondant = UTXO(txInput.prev_tx_hash, txInput.output_index)
             self.utxo_pool.remove_utxo(utxoCorrespondant)
 
+    def fusionnerCouche(self, layer: UTXOPool):
+        """Applique au pool actuel le delta de <layer>, une couche au-dessus de celui-ci."""
+        assert layer.parent is self.utxo_pool
+        for utxo in layer.spent:
+            self.utxo_pool.remove_utxo(utxo)
+        for utxo, output in layer.pool.items():
+            self.utxo_pool.add_utxo(utxo, output)
+
     def ajouterOutputAuPool(self, tx: Transaction):
         for indexOutput, output in enumerate(tx.outputs):
             utxoCree = UTXO(tx.hash, indexOutput)
@@ -1,20 +1,374 @@
 from __future__ import annotations
 
+import heapq
+import time
+
 from blockchain.transaction import Transaction
+from blockchain.utxo import UTXO
+from blockchain.utxo_pool import UTXOPool
 
 
 class TransactionPool:
-    def __init__(self):
+    """
+    Memory pool des transactions en attente.
+
+    Le pool relie chaque transaction aux transactions du pool dont elle dépense
+    des sorties (parents) et à celles qui dépensent les siennes (enfants), même si
+    l'enfant arrive avant son parent. Il calcule les frais de chaque transaction
+    (entrées moins sorties) dès que la valeur de toutes ses entrées est connue.
+
+    Chaque UTXO est dépensé par au plus une transaction du pool. Une transaction en
+    conflit avec le pool ne le remplace que si elle paie plus de frais que toutes
+    les transactions qu'elle évince. Le pool est borné en taille (les transactions
+    de plus faibles frais par octet sont évincées en premier) et en âge.
+    """
+
+    # Taille maximale par défaut d'un gabarit de bloc, en octets
+    MAX_BLOCK_SIZE: int = 1_000_000
+    # Taille maximale par défaut du pool, en octets
+    MAX_POOL_SIZE: int = 50_000_000
+    # Âge maximal par défaut d'une transaction dans le pool, en secondes
+    MAX_AGE: float = 14 * 24 * 3600
+
+    class Entry:
+        def __init__(self, tx: Transaction, sequence: int):
+            self.tx: Transaction = tx
+            # Ordre d'arrivée dans le pool
+            self.sequence: int = sequence
+            self.time: float = time.monotonic()
+            self.size: int = len(tx.to_bytes())
+            # Valeur de chaque entrée de tx, None tant qu'elle est inconnue
+            self.input_values: list[float | None] = [None] * tx.num_inputs()
+            self.parents: set[bytes] = set()
+            self.children: set[bytes] = set()
+
+        @property
+        def fee(self) -> float | None:
+            """Frais de la transaction, None si la valeur d'une entrée est inconnue."""
+            if any(value is None for value in self.input_values):
+                return None
+            inputs: float = sum(
+                value for value in self.input_values if value is not None
+            )
+            return inputs - sum(output.value for output in self.tx.outputs)
+
+        @property
+        def fee_rate(self) -> float | None:
+            """Frais par octet de la transaction."""
+            fee: float | None = self.fee
+            return None if fee is None else fee / max(self.size, 1)
+
+    def __init__(self, max_size: int = MAX_POOL_SIZE, max_age: float = MAX_AGE):
         self.pool: dict[bytes, Transaction] = {}
+        self.entries: dict[bytes, TransactionPool.Entry] = {}
+        # UTXO -> hash de la transaction du pool qui le dépense
+        self.spenders: dict[UTXO, bytes] = {}
+        self.max_size: int = max_size
+        self.max_age: float = max_age
+        # Taille totale des transactions du pool, en octets
+        self.size: int = 0
+        # Tas (frais par octet, séquence, hash) pour évincer les transactions les
+        # moins rentables ; les éléments périmés sont ignorés au retrait
+        self._by_fee_rate: list[tuple[float, int, bytes]] = []
+        self._sequence: int = 0
+        # Nombre de transactions retirées du pool depuis sa création
+        self.removals: int = 0
+
+    @property
+    def sequence(self) -> int:
+        """Séquence de la prochaine transaction admise dans le pool."""
+        return self._sequence
+
+    def get_conflicts(self, tx: Transaction) -> set[bytes]:
+        """Renvoie les hashs des transactions du pool qui dépensent un UTXO dépensé par <tx>."""
+        conflicts: set[bytes] = set()
+        for input_ in tx.inputs:
+            spender: bytes | None = self.spenders.get(
+                UTXO(input_.prev_tx_hash, input_.output_index)
+            )
+            if spender is not None and spender != tx.hash:
+                conflicts.add(spender)
+        return conflicts
+
+    def add_transaction(
+        self, tx: Transaction, utxo_pool: UTXOPool | None = None
+    ) -> bool:
+        """
+        Ajoute <tx> au pool. La valeur des entrées qui ne dépensent pas une
+        transaction du pool est cherchée dans <utxo_pool>, s'il est fourni.
 
-    def add_transaction(self, tx: Transaction) -> None:
+        Si <tx> est en conflit avec des transactions du pool, elle les remplace
+        (ainsi que leurs descendants) seulement si ses frais sont connus, supérieurs
+        à la somme de leurs frais, et si ses frais par octet sont supérieurs à ceux
+        de chacune des transactions en conflit direct.
+
+        Returns:
+            bool: True si <tx> est dans le pool après l'appel, False sinon.
+        """
+        if tx.hash in self.pool:
+            return True
+
+        self.expire()
+
+        conflicts: set[bytes] = self.get_conflicts(tx)
+        if conflicts:
+            replaced: set[bytes] = set(conflicts)
+            for conflict in conflicts:
+                replaced |= self.get_descendants(conflict)
+            if not self._can_replace(tx, utxo_pool, conflicts, replaced):
+                return False
+            for tx_hash in replaced:
+                if tx_hash in self.entries:
+                    self.remove_transaction(tx_hash)
+
+        entry: TransactionPool.Entry = TransactionPool.Entry(tx, self._sequence)
+        self._sequence += 1
         self.pool[tx.hash] = tx
+        self.entries[tx.hash] = entry
+        self.size += entry.size
+
+        for i, input_ in enumerate(tx.inputs):
+            self.spenders[UTXO(input_.prev_tx_hash, input_.output_index)] = tx.hash
+
+            parent: TransactionPool.Entry | None = self.entries.get(input_.prev_tx_hash)
+            if parent is not None:
+                self._link(parent, entry)
+                continue
+
+            utxo: UTXO = UTXO(input_.prev_tx_hash, input_.output_index)
+            if utxo_pool is not None and utxo in utxo_pool:
+                entry.input_values[i] = utxo_pool.get_tx_output(utxo).value
+
+        # Les enfants arrivés avant tx (ou restés dans le pool pendant que tx était
+        # confirmée) peuvent maintenant y être reliés
+        for i in range(tx.num_outputs()):
+            child_hash: bytes | None = self.spenders.get(UTXO(tx.hash, i))
+            if child_hash is not None:
+                self._link(entry, self.entries[child_hash])
+        self._push_fee_rate(entry)
+
+        self.trim()
+        return tx.hash in self.pool
+
+    def _can_replace(
+        self,
+        tx: Transaction,
+        utxo_pool: UTXOPool | None,
+        conflicts: set[bytes],
+        replaced: set[bytes],
+    ) -> bool:
+        """Renvoie True si <tx> peut remplacer les transactions <replaced>, dont
+        <conflicts> sont en conflit direct avec elle."""
+        if any(input_.prev_tx_hash in replaced for input_ in tx.inputs):
+            return False  # tx dépendrait d'une transaction qu'elle évince
+
+        candidate: TransactionPool.Entry = TransactionPool.Entry(tx, -1)
+        for i, input_ in enumerate(tx.inputs):
+            parent: Transaction | None = self.pool.get(input_.prev_tx_hash)
+            utxo: UTXO = UTXO(input_.prev_tx_hash, input_.output_index)
+            if parent is not None and input_.output_index < parent.num_outputs():
+                candidate.input_values[i] = parent.get_output(input_.output_index).value
+            elif utxo_pool is not None and utxo in utxo_pool:
+                candidate.input_values[i] = utxo_pool.get_tx_output(utxo).value
+
+        fee: float | None = candidate.fee
+        fee_rate: float | None = candidate.fee_rate
+        if fee is None or fee_rate is None:
+            return False
+
+        if fee <= sum(self.entries[h].fee or 0 for h in replaced):
+            return False
+
+        return all(fee_rate > (self.entries[h].fee_rate or 0) for h in conflicts)
+
+    def expire(self, now: float | None = None) -> None:
+        """Retire du pool les transactions plus vieilles que max_age, et leurs descendants."""
+        if now is None:
+            now = time.monotonic()
+        # Les entrées sont rangées par ordre d'arrivée : les plus vieilles en tête
+        while self.entries:
+            tx_hash, entry = next(iter(self.entries.items()))
+            if now - entry.time <= self.max_age:
+                break
+            self.remove_with_descendants(tx_hash)
+
+    def trim(self) -> None:
+        """Évince les transactions de plus faibles frais par octet (et leurs
+        descendants) jusqu'à ce que le pool respecte max_size."""
+        while self.size > self.max_size and self._by_fee_rate:
+            rate, _, tx_hash = heapq.heappop(self._by_fee_rate)
+            entry: TransactionPool.Entry | None = self.entries.get(tx_hash)
+            if entry is not None and rate == self._eviction_rate(entry):
+                self.remove_with_descendants(tx_hash)
+
+    def remove_with_descendants(self, tx_hash: bytes) -> None:
+        """Retire du pool la transaction <tx_hash> et tous ses descendants."""
+        for h in self.get_descendants(tx_hash) | {tx_hash}:
+            self.remove_transaction(h)
+
+    @staticmethod
+    def _eviction_rate(entry: TransactionPool.Entry) -> float:
+        fee_rate: float | None = entry.fee_rate
+        return float("-inf") if fee_rate is None else fee_rate
+
+    def _push_fee_rate(self, entry: TransactionPool.Entry) -> None:
+        if len(self._by_fee_rate) > 2 * len(self.entries) + 64:
+            # Reconstruit le tas pour se débarrasser des éléments périmés
+            self._by_fee_rate = [
+                (self._eviction_rate(e), e.sequence, h) for h, e in self.entries.items()
+            ]
+            heapq.heapify(self._by_fee_rate)
+        heapq.heappush(
+            self._by_fee_rate,
+            (self._eviction_rate(entry), entry.sequence, entry.tx.hash),
+        )
+
+    def _link(
+        self, parent: TransactionPool.Entry, child: TransactionPool.Entry
+    ) -> None:
+        """Relie <child> à <parent> et renseigne la valeur des entrées de <child>
+        qui dépensent des sorties de <parent>."""
+        parent.children.add(child.tx.hash)
+        child.parents.add(parent.tx.hash)
+        for i, input_ in enumerate(child.tx.inputs):
+            if input_.prev_tx_hash == parent.tx.hash:
+                if input_.output_index < parent.tx.num_outputs():
+                    child.input_values[i] = parent.tx.get_output(
+                        input_.output_index
+                    ).value
+        self._push_fee_rate(child)
 
     def remove_transaction(self, tx_hash: bytes) -> None:
         self.pool.pop(tx_hash)
+        entry: TransactionPool.Entry = self.entries.pop(tx_hash)
+        self.size -= entry.size
+        self.removals += 1
+
+        for parent_hash in entry.parents:
+            self.entries[parent_hash].children.discard(tx_hash)
+        for child_hash in entry.children:
+            # Les valeurs des entrées de l'enfant restent connues
+            self.entries[child_hash].parents.discard(tx_hash)
+        for input_ in entry.tx.inputs:
+            utxo: UTXO = UTXO(input_.prev_tx_hash, input_.output_index)
+            if self.spenders.get(utxo) == tx_hash:
+                del self.spenders[utxo]
 
     def get_transaction(self, tx_hash: bytes) -> Transaction | None:
         return self.pool.get(tx_hash)
 
     def get_transactions(self) -> list[Transaction]:
         return list(self.pool.values())
+
+    def get_transactions_since(self, sequence: int) -> list[Transaction]:
+        """
+        Renvoie les transactions du pool admises depuis la séquence <sequence>, par
+        ordre d'arrivée. Les entrées sont rangées par séquence : le coût est
+        proportionnel au nombre de transactions renvoyées.
+        """
+        recent: list[Transaction] = []
+        for entry in reversed(self.entries.values()):
+            if entry.sequence < sequence:
+                break
+            recent.append(entry.tx)
+        recent.reverse()
+        return recent
+
+    def get_ancestors(self, tx_hash: bytes) -> set[bytes]:
+        """Renvoie les hashs des ancêtres de la transaction <tx_hash> dans le pool."""
+        ancestors: set[bytes] = set()
+        stack: list[bytes] = list(self.entries[tx_hash].parents)
+        while stack:
+            parent_hash: bytes = stack.pop()
+            if parent_hash not in ancestors:
+                ancestors.add(parent_hash)
+                stack.extend(self.entries[parent_hash].parents)
+        return ancestors
+
+    def get_descendants(self, tx_hash: bytes) -> set[bytes]:
+        """Renvoie les hashs des descendants de la transaction <tx_hash> dans le pool."""
+        descendants: set[bytes] = set()
+        stack: list[bytes] = list(self.entries[tx_hash].children)
+        while stack:
+            child_hash: bytes = stack.pop()
+            if child_hash not in descendants:
+                descendants.add(child_hash)
+                stack.extend(self.entries[child_hash].children)
+        return descendants
+
+    def get_block_template(self, max_size: int = MAX_BLOCK_SIZE) -> list[Transaction]:
+        """
+        Renvoie les transactions à inclure dans un bloc d'au plus <max_size> octets,
+        chaque parent précédant ses enfants.
+
+        Les transactions sont choisies par paquets : une transaction et ses ancêtres
+        non encore choisis, par ordre décroissant de frais par octet du paquet. Les
+        transactions dont les frais sont inconnus ou négatifs sont ignorées, ainsi
+        que leurs descendants.
+        """
+        # Transactions admissibles et leurs ancêtres
+        ancestors: dict[bytes, set[bytes]] = {}
+        excluded: set[bytes] = set()
+        for tx_hash, entry in self.entries.items():
+            fee: float | None = entry.fee
+            if fee is None or fee < 0:
+                excluded.add(tx_hash)
+                excluded |= self.get_descendants(tx_hash)
+        for tx_hash in self.entries:
+            if tx_hash not in excluded:
+                ancestors[tx_hash] = self.get_ancestors(tx_hash)
+
+        # Frais et taille du paquet de chaque transaction
+        package_fee: dict[bytes, float] = {}
+        package_size: dict[bytes, int] = {}
+        heap: list[tuple[float, int, bytes]] = []
+        for tx_hash, tx_ancestors in ancestors.items():
+            package: list[TransactionPool.Entry] = [self.entries[tx_hash]] + [
+                self.entries[h] for h in tx_ancestors
+            ]
+            package_fee[tx_hash] = sum(e.fee or 0 for e in package)
+            package_size[tx_hash] = sum(e.size for e in package)
+            self._push_package(heap, tx_hash, package_fee, package_size)
+
+        selected: list[Transaction] = []
+        included: set[bytes] = set()
+        total_size: int = 0
+        while heap:
+            neg_rate, _, tx_hash = heapq.heappop(heap)
+            if tx_hash in included:
+                continue
+            if -neg_rate != package_fee[tx_hash] / max(package_size[tx_hash], 1):
+                continue  # entrée périmée, une plus récente est dans le tas
+            if total_size + package_size[tx_hash] > max_size:
+                continue
+
+            # Ajoute les ancêtres non choisis puis la transaction, dans l'ordre topologique
+            package_hashes: list[bytes] = [
+                h for h in ancestors[tx_hash] if h not in included
+            ] + [tx_hash]
+            package_hashes.sort(key=lambda h: len(ancestors[h]))
+            for h in package_hashes:
+                included.add(h)
+                selected.append(self.entries[h].tx)
+            total_size += package_size[tx_hash]
+
+            # Les paquets des descendants ne comptent plus les transactions choisies
+            for h in package_hashes:
+                chosen: TransactionPool.Entry = self.entries[h]
+                for descendant in self.get_descendants(h):
+                    if descendant in ancestors and descendant not in included:
+                        package_fee[descendant] -= chosen.fee or 0
+                        package_size[descendant] -= chosen.size
+                        self._push_package(heap, descendant, package_fee, package_size)
+
+        return selected
+
+    @staticmethod
+    def _push_package(
+        heap: list[tuple[float, int, bytes]],
+        tx_hash: bytes,
+        package_fee: dict[bytes, float],
+        package_size: dict[bytes, int],
+    ) -> None:
+        rate: float = package_fee[tx_hash] / max(package_size[tx_hash], 1)
+        heapq.heappush(heap, (-rate, len(heap), tx_hash))
@@ -1,18 +1,37 @@
 class UTXO:
+    # Pas de __dict__ par instance : un pool UTXO en contient des millions
+    __slots__ = ("_tx_hash", "_index", "_hash")
+
     def __init__(self, tx_hash: bytes, index: int):
         """Crée un nouvel UTXO correspondant à la sortie avec l'index <index>
         de la transaction dont le hash est <tx_hash>."""
         # Hash de la transaction à l'origine de cet UTXO
-        self.tx_hash = tx_hash
+        self._tx_hash = tx_hash
 
         # Index de la sortie correspondante à ladite transaction
-        self.index = index
+        self._index = index
+
+        # Calculé une seule fois : un UTXO est haché à chaque accès à un pool, d'où
+        # tx_hash et index en lecture seule
+        self._hash = hash((tx_hash, index))
+
+    @property
+    def tx_hash(self) -> bytes:
+        return self._tx_hash
+
+    @property
+    def index(self) -> int:
+        return self._index
 
     def __hash__(self):
-        return hash((self.tx_hash, self.index))
+        return self._hash
 
     def __eq__(self, other):
-        return (self.tx_hash, self.index) == (other.tx_hash, other.index)
+        return (
+            self._hash == other._hash
+            and self._index == other._index
+            and self._tx_hash == other._tx_hash
+        )
 
     def __ne__(self, other):
         return not (self == other)
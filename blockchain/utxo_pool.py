@@ -1,38 +1,195 @@
 from __future__ import annotations
 
+from typing import Iterator
+
+from blockchain.crypto import PublicKey
 from blockchain.utxo import UTXO
 from blockchain.transaction import Transaction
 
+# Unités de base par iftcoin : les soldes sont cumulés en entiers, sans l'erreur
+# d'arrondi qu'accumulerait une somme de flottants
+UNITS_PER_COIN: int = 10**8
+
+
+def _to_units(value: float) -> int:
+    return round(value * UNITS_PER_COIN)
+
 
 class UTXOPool:
-    def __init__(self):
-        """Crée un nouveau UTXOPool vide."""
+    """
+    Pool d'UTXOs organisé en couches (copy-on-write).
+
+    Une couche ne stocke que son delta par rapport à sa couche parente : les UTXOs
+    qu'elle crée (self.pool) et les UTXOs du parent qu'elle dépense (self.spent).
+    Une couche sans parent est un instantané complet. Une couche qui a des enfants
+    ne doit plus être modifiée.
+
+    Attributes:
+        pool (dict): UTXOs créés dans cette couche, mappés à leur sortie.
+        spent (set): UTXOs des couches parentes dépensés dans cette couche.
+        parent (UTXOPool): Couche parente, None pour un instantané complet.
+        depth (int): Nombre de couches entre celle-ci et l'instantané de base.
+        by_address (dict): UTXOs créés dans cette couche, groupés par adresse brute.
+        balances (dict): Solde par adresse brute, en unités de base
+            (UNITS_PER_COIN) ; pour une couche, la variation du solde par rapport
+            à la couche parente.
+    """
+
+    def __init__(self, parent: UTXOPool | None = None):
+        """Crée un nouveau UTXOPool vide, ou une couche vide au-dessus de <parent>."""
         # La collection actuelle d'UTXOs, chacun étant mappé à sa sortie de transaction correspondante
         self.pool: dict[UTXO, Transaction.Output] = {}
+        self.spent: set[UTXO] = set()
+        self.parent: UTXOPool | None = parent
+        self.depth: int = 0 if parent is None else parent.depth + 1
+        # Index par adresse (clé publique brute, 64 octets)
+        self.by_address: dict[bytes, dict[UTXO, Transaction.Output]] = {}
+        self.balances: dict[bytes, int] = {}
 
     @classmethod
     def from_utxo_pool(cls, utxo_pool: UTXOPool):
-        """Crée un nouveau UTXOPool qui est une copie de <utxo_pool>."""
-        up = cls()
-        up.pool = utxo_pool.pool.copy()
+        """
+        Crée un nouveau UTXOPool ayant le même contenu que <utxo_pool>.
+        La copie est une couche vide au-dessus de <utxo_pool> : elle coûte O(1)
+        et les modifications ultérieures n'affectent pas <utxo_pool>.
+        """
+        return cls(utxo_pool)
+
+    def flatten(self) -> UTXOPool:
+        """Renvoie un instantané complet (sans parent) ayant le même contenu que ce pool."""
+        up = UTXOPool()
+        for utxo, output in self.items():
+            up.add_utxo(utxo, output)
         return up
 
+    def detach(self, reuse_parent: bool = False) -> None:
+        """
+        Intègre le contenu des couches parentes à cette couche, qui devient un
+        instantané complet. Le contenu ne change pas : les couches construites
+        au-dessus restent valides, et ne retiennent plus les couches parentes.
+
+        Si <reuse_parent> est True et que le parent est un instantané complet, ses
+        conteneurs sont repris et mis à jour avec le delta de cette couche au lieu
+        d'être copiés ; le parent ne doit alors plus être utilisé par personne.
+        """
+        if self.parent is None:
+            return
+        base: UTXOPool
+        if reuse_parent and self.parent.parent is None:
+            base = self.parent
+            for utxo in self.spent:
+                base.remove_utxo(utxo)
+            for utxo, output in self.pool.items():
+                base.add_utxo(utxo, output)
+        else:
+            base = self.flatten()
+        self.pool = base.pool
+        self.spent = set()
+        self.parent = None
+        self.depth = 0
+        self.by_address = base.by_address
+        self.balances = base.balances
+
     def add_utxo(self, utxo: UTXO, tx_output: Transaction.Output) -> None:
-        """Ajoute un mappage de UTXO <utxo> à la sortie de transaction <tx_output> au pool."""
+        """
+        Ajoute un mappage de UTXO <utxo> à la sortie de transaction <tx_output> au pool.
+        Si <utxo> est déjà dans le pool, sa sortie est remplacée.
+        """
+        if utxo in self:
+            self._unindex(utxo, self.get_tx_output(utxo))
+
         self.pool[utxo] = tx_output
+        address: bytes = tx_output.get_raw_address()
+        self.by_address.setdefault(address, {})[utxo] = tx_output
+        self.balances[address] = self.balances.get(address, 0) + _to_units(
+            tx_output.value
+        )
 
     def remove_utxo(self, utxo: UTXO) -> None:
         """Supprime l'UTXO <utxo> du pool."""
-        self.pool.pop(utxo)
+        self._unindex(utxo, self.get_tx_output(utxo))
+        self.pool.pop(utxo, None)
+        if utxo not in self.spent and self.parent is not None and utxo in self.parent:
+            self.spent.add(utxo)
+
+    def _unindex(self, utxo: UTXO, tx_output: Transaction.Output) -> None:
+        """Retire <utxo>, de sortie <tx_output>, de l'index par adresse."""
+        address: bytes = tx_output.get_raw_address()
+        created: dict[UTXO, Transaction.Output] | None = self.by_address.get(address)
+        if created is not None and created.pop(utxo, None) is not None and not created:
+            del self.by_address[address]
+        self.balances[address] = self.balances.get(address, 0) - _to_units(
+            tx_output.value
+        )
 
     def get_tx_output(self, utxo: UTXO) -> Transaction.Output:
         """Renvoie la sortie de la transaction correspondant à l'UTXO <utxo>."""
-        return self.pool[utxo]
+        layer: UTXOPool | None = self
+        while layer is not None:
+            output: Transaction.Output | None = layer.pool.get(utxo)
+            if output is not None:
+                return output
+            if utxo in layer.spent:
+                break
+            layer = layer.parent
+
+        raise KeyError(utxo)
 
     def __contains__(self, utxo: UTXO) -> bool:
         """Renvoie True si l'UTXO <utxo> est dans le pool et False sinon."""
-        return utxo in self.pool
+        layer: UTXOPool | None = self
+        while layer is not None:
+            if utxo in layer.pool:
+                return True
+            if utxo in layer.spent:
+                return False
+            layer = layer.parent
+
+        return False
+
+    def items(self) -> Iterator[tuple[UTXO, Transaction.Output]]:
+        """Itère sur les paires (UTXO, sortie) du pool, toutes couches confondues."""
+        hidden: set[UTXO] = set()
+        layer: UTXOPool | None = self
+        while layer is not None:
+            for utxo, output in layer.pool.items():
+                if utxo not in hidden:
+                    hidden.add(utxo)
+                    yield utxo, output
+            hidden |= layer.spent
+            layer = layer.parent
 
     def get_all_utxo(self) -> list[UTXO]:
         """Renvoie une liste de tous les UTXO du pool."""
-        return list(self.pool.keys())
+        return [utxo for utxo, _ in self.items()]
+
+    def get_balance(self, address: PublicKey) -> float:
+        """Renvoie la somme des valeurs des UTXOs appartenant à <address>, à une
+        unité de base près."""
+        raw: bytes = address.to_string()
+        units: int = 0
+        layer: UTXOPool | None = self
+        while layer is not None:
+            units += layer.balances.get(raw, 0)
+            layer = layer.parent
+        return units / UNITS_PER_COIN
+
+    def get_balances(self, addresses: list[PublicKey]) -> list[float]:
+        """Renvoie le solde de chacune des adresses <addresses>."""
+        return [self.get_balance(address) for address in addresses]
+
+    def list_unspent(self, address: PublicKey) -> list[tuple[UTXO, Transaction.Output]]:
+        """Renvoie les paires (UTXO, sortie) non dépensées appartenant à <address>."""
+        raw: bytes = address.to_string()
+        unspent: list[tuple[UTXO, Transaction.Output]] = []
+        above: list[UTXOPool] = []
+        layer: UTXOPool | None = self
+        while layer is not None:
+            for utxo, output in layer.by_address.get(raw, {}).items():
+                if not any(
+                    utxo in upper.spent or utxo in upper.pool for upper in above
+                ):
+                    unspent.append((utxo, output))
+            above.append(layer)
+            layer = layer.parent
+        return unspent
@@ -1,14 +1,176 @@
-from blockchain.crypto import PublicKey
+import math
+
+from blockchain.crypto import BatchSigner, PrivateKey, PublicKey
 from blockchain.blockchain import Blockchain
+from blockchain.history import Cursor, HistoryEntry
+from blockchain.transaction import Transaction
+from blockchain.utxo import UTXO
 
 
 def get_balance(blockchain: Blockchain, pk: PublicKey) -> float:
     """Retourne le solde associé à l'adresse <pk>."""
     # TODO: Votre code ici
     utxoPool = blockchain.get_max_height_utxo_pool()
-    balance = 0
-    for utxo in utxoPool.get_all_utxo():
-        output = utxoPool.get_tx_output(utxo)
-        if output.address == pk:
-            balance += output.value
-    return balance
+    return utxoPool.get_balance(pk)
+
+
+def get_balances(blockchain: Blockchain, pks: list[PublicKey]) -> list[float]:
+    """Retourne le solde associé à chacune des adresses <pks>."""
+    return blockchain.get_max_height_utxo_pool().get_balances(pks)
+
+
+def list_unspent(
+    blockchain: Blockchain, pk: PublicKey
+) -> list[tuple[UTXO, Transaction.Output]]:
+    """Retourne les UTXOs (et leurs sorties) dépensables par l'adresse <pk>."""
+    return blockchain.get_max_height_utxo_pool().list_unspent(pk)
+
+
+def get_history(
+    blockchain: Blockchain,
+    pk: PublicKey,
+    limit: int = 50,
+    before: Cursor | None = None,
+) -> tuple[list[HistoryEntry], Cursor | None]:
+    """Retourne une page de l'historique des transactions de l'adresse <pk> et le
+    curseur de la page suivante (la chaîne doit avoir un index d'historique)."""
+    return blockchain.get_address_history(pk, limit, before)
+
+
+# UTXO dépensable par un portefeuille et sa sortie
+Coin = tuple[UTXO, Transaction.Output]
+
+
+class TransactionBuilder:
+    """
+    Construit des transactions signées qui paient depuis les UTXOs des clés <keys>
+    au sommet de <blockchain>, avec au plus <max_inputs> entrées chacune. Les
+    signatures d'un lot de transactions sont faites en une fois par <signer>
+    (dans le processus courant s'il est None).
+
+    Les UTXOs dépensés par le memory pool ou par une transaction déjà construite
+    (réservés jusqu'à leur confirmation, ou jusqu'à release) ne sont pas choisis.
+    La monnaie est rendue à la première clé de <keys>.
+    """
+
+    MAX_INPUTS: int = 500
+
+    def __init__(
+        self,
+        blockchain: Blockchain,
+        keys: list[PrivateKey],
+        signer: BatchSigner | None = None,
+        max_inputs: int = MAX_INPUTS,
+    ):
+        assert keys, "Aucune clé!"
+        self.blockchain: Blockchain = blockchain
+        self.addresses: list[PublicKey] = [sk.get_verifying_key() for sk in keys]
+        # Clé privée de chaque adresse brute
+        self.keys: dict[bytes, PrivateKey] = {
+            pk.to_string(): sk for pk, sk in zip(self.addresses, keys)
+        }
+        self.signer: BatchSigner | None = signer
+        self.max_inputs: int = max_inputs
+        self.reserved: set[UTXO] = set()
+
+    def get_spendable(self) -> list[Coin]:
+        """Renvoie les UTXOs des clés qui ne sont ni dépensés par le memory pool
+        ni réservés."""
+        utxo_pool = self.blockchain.get_max_height_utxo_pool()
+        spenders: dict[UTXO, bytes] = self.blockchain.tx_pool.spenders
+        # Les UTXOs réservés qui ont quitté le pool UTXO sont confirmés
+        self.reserved = {utxo for utxo in self.reserved if utxo in utxo_pool}
+        return [
+            (utxo, output)
+            for address in self.addresses
+            for utxo, output in utxo_pool.list_unspent(address)
+            if utxo not in spenders and utxo not in self.reserved
+        ]
+
+    def select_coins(self, spendable: list[Coin], amount: float) -> list[Coin]:
+        """
+        Choisit parmi <spendable> des UTXOs d'une valeur totale d'au moins
+        <amount> : le plus petit qui suffit seul, sinon les plus gros d'abord.
+        Lève ValueError si <max_inputs> UTXOs ne suffisent pas.
+        """
+        enough: list[Coin] = [coin for coin in spendable if coin[1].value >= amount]
+        if enough:
+            return [min(enough, key=lambda coin: coin[1].value)]
+
+        selected: list[Coin] = []
+        total: float = 0
+        largest: list[Coin] = sorted(
+            spendable, key=lambda coin: coin[1].value, reverse=True
+        )
+        for coin in largest[: self.max_inputs]:
+            selected.append(coin)
+            total += coin[1].value
+            if total >= amount:
+                return selected
+        raise ValueError(f"Fonds insuffisants pour payer {amount}!")
+
+    def build(
+        self, payments: list[tuple[PublicKey, float]], fee: float = 0
+    ) -> Transaction:
+        """Renvoie une transaction signée qui effectue les paiements
+        (adresse, valeur) <payments> et laisse <fee> de frais."""
+        return self.build_batch([payments], fee)[0]
+
+    def build_batch(
+        self, payouts: list[list[tuple[PublicKey, float]]], fee: float = 0
+    ) -> list[Transaction]:
+        """
+        Renvoie une transaction signée par liste de paiements de <payouts>, chacune
+        avec <fee> de frais, sans UTXO commun. Toutes les entrées sont signées en
+        un seul lot. Lève ValueError (sans rien réserver) si les fonds ne
+        suffisent pas.
+        """
+        spendable: list[Coin] = self.get_spendable()
+        transactions: list[Transaction] = []
+        keys: list[PrivateKey | list[PrivateKey]] = []
+        for payments in payouts:
+            amount: float = sum(value for _, value in payments) + fee
+            coins: list[Coin] = self.select_coins(spendable, amount)
+            chosen: set[UTXO] = {utxo for utxo, _ in coins}
+            spendable = [coin for coin in spendable if coin[0] not in chosen]
+
+            tx: Transaction = Transaction()
+            for utxo, _ in coins:
+                tx.add_input(utxo.tx_hash, utxo.index)
+            for address, value in payments:
+                tx.add_output(value, address)
+            change: float = self._change(coins, payments, fee)
+            if change > 0:
+                tx.add_output(change, self.addresses[0])
+            transactions.append(tx)
+            keys.append([self.keys[output.get_raw_address()] for _, output in coins])
+
+        Transaction.sign_transactions(transactions, keys, self.signer)
+        for tx in transactions:
+            self.reserved.update(
+                UTXO(i.prev_tx_hash, i.output_index) for i in tx.inputs
+            )
+        return transactions
+
+    @staticmethod
+    def _change(
+        coins: list[Coin], payments: list[tuple[PublicKey, float]], fee: float
+    ) -> float:
+        """Renvoie la monnaie à rendre, arrondie vers le bas pour que la somme des
+        sorties, calculée comme par TransactionHandler, ne dépasse pas celle des
+        entrées."""
+        inputs: float = 0
+        for _, output in coins:
+            inputs += output.value
+        outputs: float = 0
+        for _, value in payments:
+            outputs += value
+        change: float = inputs - outputs - fee
+        while change > 0 and outputs + change > inputs - fee:
+            change = math.nextafter(change, 0)
+        return change
+
+    def release(self, tx: Transaction) -> None:
+        """Libère les UTXOs réservés par <tx>, qui ne sera pas diffusée."""
+        for input_ in tx.inputs:
+            self.reserved.discard(UTXO(input_.prev_tx_hash, input_.output_index))